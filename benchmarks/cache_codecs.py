@@ -0,0 +1,47 @@
+"""
+Compares the size and speed of the cache codecs on a few typical payloads.
+
+Run it from the repository root with:
+
+    PYTHONPATH=kasushi python -m benchmarks.cache_codecs
+"""
+import timeit
+
+from kasushi.cache.codecs import Serializer
+
+PAYLOADS = {
+    'int': 123456789,
+    'prefix': '!',
+    'settings': {'prefix': '!', 'language': 'en', 'cooldown': 30, 'disabled_commands': ['ban', 'kick']},
+    'embed': {
+        'title': 'Leaderboard',
+        'description': 'The top hunters of the server',
+        'fields': [{'name': f'Hunter #{i}', 'value': f'{i * 1337} points', 'inline': True} for i in range(25)],
+        'footer': {'text': 'Updated every 5 minutes'},
+    },
+    'leaderboard': [[i, 1_000_000 - i * 37, f'user{i}'] for i in range(2000)],
+}
+
+SERIALIZERS = {
+    'pickle': Serializer(['pickle']),
+    'json': Serializer(['json', 'pickle']),
+    'varint+pickle': Serializer(['varint', 'pickle']),
+    'pickle+zlib': Serializer(['pickle'], compression='zlib'),
+    'pickle+lzma': Serializer(['pickle'], compression='lzma'),
+    'json+zlib': Serializer(['json', 'pickle'], compression='zlib'),
+}
+
+
+def bench(number: int = 200):
+    print(f"{'payload':<12} {'codec':<15} {'bytes':>8} {'encode µs':>10} {'decode µs':>10}")
+    for payload_name, payload in PAYLOADS.items():
+        for serializer_name, serializer in SERIALIZERS.items():
+            data = serializer.dumps(payload)
+            serializer.loads(data)
+            encode = timeit.timeit(lambda: serializer.dumps(payload), number=number) / number * 1e6
+            decode = timeit.timeit(lambda: serializer.loads(data), number=number) / number * 1e6
+            print(f"{payload_name:<12} {serializer_name:<15} {len(data):>8} {encode:>10.1f} {decode:>10.1f}")
+
+
+if __name__ == '__main__':
+    bench()
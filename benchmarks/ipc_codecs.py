@@ -0,0 +1,50 @@
+"""
+Compares the frame size and speed of the IPC wire codecs on a few typical messages.
+
+Run it from the repository root with:
+
+    PYTHONPATH=kasushi python -m benchmarks.ipc_codecs
+"""
+import json
+import timeit
+
+from kasushi.ipc.codecs import CODECS, DEFAULT_COMPRESSION_THRESHOLD, decode_frame, encode_frame
+
+MESSAGES = {
+    'login': {'handler': 'login', 'type': 'request', 'rtoken': 'a' * 32, 'data': {
+        'shared_secret': 'not so secret',
+        'guilds': [700_000_000_000_000_000 + i * 7919 for i in range(2500)],
+        'shards': list(range(16)),
+        'codecs': ['msgpack', 'json'],
+        'compression': ['zlib'],
+    }},
+    'find_member': {'handler': 'find_member', 'type': 'response', 'rtoken': 'a' * 32,
+                    'data': [700_000_000_000_000_000 + i * 104729 for i in range(300)]},
+    'shard_status': {'handler': 'shard_status', 'type': 'response', 'rtoken': 'a' * 32,
+                     'data': {shard_id: {'latency': 0.0421, 'ws_ratelimited': False, 'closed': False}
+                              for shard_id in range(16)}},
+    'guild_info': {'handler': 'guild_info', 'type': 'request', 'rtoken': 'a' * 32, 'data': {'guild_id': 1234}},
+}
+
+
+def bench(number: int = 200):
+    print(f"{'message':<14} {'codec':<15} {'bytes':>8} {'encode µs':>10} {'decode µs':>10}")
+    for message_name, message in MESSAGES.items():
+        text = json.dumps(message)
+        encode = timeit.timeit(lambda: json.dumps(message), number=number) / number * 1e6
+        decode = timeit.timeit(lambda: json.loads(text), number=number) / number * 1e6
+        print(f"{message_name:<14} {'text json':<15} {len(text.encode()):>8} {encode:>10.1f} {decode:>10.1f}")
+
+        for codec in CODECS.values():
+            for compression_threshold in (None, DEFAULT_COMPRESSION_THRESHOLD):
+                name = codec.name + ('+zlib' if compression_threshold is not None else '')
+                frame = encode_frame(message, codec, compression_threshold)
+                decode_frame(frame)
+                encode = timeit.timeit(lambda: encode_frame(message, codec, compression_threshold),
+                                       number=number) / number * 1e6
+                decode = timeit.timeit(lambda: decode_frame(frame), number=number) / number * 1e6
+                print(f"{message_name:<14} {name:<15} {len(frame):>8} {encode:>10.1f} {decode:>10.1f}")
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,83 @@
+"""
+Compares the round-trip time of IPC requests over TCP and over a unix socket.
+
+Run it from the repository root with:
+
+    PYTHONPATH=kasushi python -m benchmarks.ipc_transports
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from kasushi.ipc.client import IPCClient
+from kasushi.ipc.handlers import GuildInfoHandler
+from kasushi.ipc.server import IPCServer
+
+
+class GuildMock:
+    def __init__(self, id):
+        self.id = id
+        self.name = f"Guild {id}"
+        self.member_count = 1234
+
+
+class BotMock:
+    def __init__(self, guild_ids):
+        self.shards = {}
+        self.guilds = [GuildMock(guild_id) for guild_id in guild_ids]
+
+    def get_guild(self, id):
+        for guild in self.guilds:
+            if guild.id == id:
+                return guild
+        return None
+
+
+async def bench_transport(name: str, server_url: str, config: dict, number: int):
+    client_config = {**config, "client": {"server_url": server_url}}
+    asking = IPCClient(BotMock([1]), client_config)
+    answering = IPCClient(BotMock([2]), client_config)
+    await asking.async_setup()
+    await answering.async_setup()
+    await asking.online.wait()
+    await answering.online.wait()
+
+    await asking.send_request('guild_info', guild_id=2)
+    start = time.perf_counter()
+    for _ in range(number):
+        await asking.send_request('guild_info', guild_id=2)
+    sequential = (time.perf_counter() - start) / number * 1e6
+
+    start = time.perf_counter()
+    await asyncio.gather(*(asking.send_request('guild_info', guild_id=2) for _ in range(number)))
+    concurrent = (time.perf_counter() - start) / number * 1e6
+
+    print(f"{name:<10} {sequential:>15.1f} {concurrent:>15.1f}")
+
+    await asking.async_teardown()
+    await answering.async_teardown()
+
+
+async def bench(number: int = 2000):
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "ipc.sock")
+        config = {
+            "shared_secret": "benchmark",
+            "server_listen_host": "127.0.0.1",
+            "server_listen_port": 12399,
+            "server_listen_path": socket_path,
+            "handlers": [GuildInfoHandler],
+        }
+        server = IPCServer(config)
+        await server.async_setup()
+
+        print(f"{'transport':<10} {'sequential µs':>15} {'concurrent µs':>15}")
+        await bench_transport('tcp', "http://127.0.0.1:12399", config, number)
+        await bench_transport('unix', "unix:" + socket_path, config, number)
+
+        await server.async_teardown()
+
+
+if __name__ == '__main__':
+    asyncio.run(bench())
@@ -1 +1,3 @@
-from .cog import *
\ No newline at end of file
+from .cog import *
+from .decorators import cached
+from .ratelimit import SlidingWindow, TokenBucket
@@ -0,0 +1,292 @@
+import abc
+import heapq
+import itertools
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from aiomcache.exceptions import ClientException, ValidationException
+
+# Like memcached, expiration times over 30 days are unix timestamps rather than a number of seconds.
+RELATIVE_EXPTIME_LIMIT = 60 * 60 * 24 * 30
+
+
+class Backend(abc.ABC):
+    """
+    The storage under `Cache`. Keys and values are bytes, and expiration times are ints in seconds, 0 meaning never.
+
+    Implementations must behave like memcached: `add` only stores missing keys, `cas` only stores keys that weren't
+    modified since the matching `gets`, and `incr`/`decr` work on decimal values, returning None for missing keys.
+    """
+
+    @abc.abstractmethod
+    async def get(self, key: bytes, default: Optional[bytes] = None) -> Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    async def gets(self, key: bytes, default: Optional[bytes] = None) -> Tuple[Optional[bytes], Optional[int]]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: bytes, value: bytes, exptime: int = 0) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def add(self, key: bytes, value: bytes, exptime: int = 0) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def cas(self, key: bytes, value: bytes, cas_token: int, exptime: int = 0) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: bytes) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def incr(self, key: bytes, increment: int = 1) -> Optional[int]:
+        ...
+
+    @abc.abstractmethod
+    async def decr(self, key: bytes, decrement: int = 1) -> Optional[int]:
+        ...
+
+    @abc.abstractmethod
+    async def touch(self, key: bytes, exptime: int) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def multi_get(self, *keys: bytes) -> Tuple[Optional[bytes], ...]:
+        ...
+
+    @abc.abstractmethod
+    async def multi_set(self, items: Iterable[Tuple[bytes, bytes, int]]) -> List[bool]:
+        ...
+
+    @abc.abstractmethod
+    async def multi_delete(self, *keys: bytes) -> List[bool]:
+        ...
+
+    async def multi_incr(self, items: Iterable[Tuple[bytes, int]]) -> List[Optional[int]]:
+        """
+        Increment many keys at once. `items` is an iterable of (key, increment) tuples.
+        """
+        return [await self.incr(key, increment) for key, increment in items]
+
+    async def multi_gets(self, *keys: bytes) -> Tuple[Tuple[Optional[bytes], Optional[int]], ...]:
+        """
+        Get many keys at once, with their CAS tokens. Returns a (value, cas token) tuple per key, in the same order.
+        """
+        return tuple([await self.gets(key) for key in keys])
+
+    async def multi_cas(self, items: Iterable[Tuple[bytes, bytes, Optional[int], int]]) -> List[bool]:
+        """
+        Compare-and-set many keys at once. `items` is an iterable of (key, value, cas token, exptime) tuples, where a
+        None cas token adds the key instead, for keys that were missing.
+
+        Returns a list of booleans, in the same order as `items`, True for the keys that were stored.
+        """
+        return [await (self.add(key, value, exptime) if cas_token is None else self.cas(key, value, cas_token, exptime))
+                for key, value, cas_token, exptime in items]
+
+    async def close(self) -> None:
+        pass
+
+
+class _Item:
+    __slots__ = ('value', 'expires_at', 'cas')
+
+    def __init__(self, value: bytes, expires_at: float, cas: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.cas = cas
+
+
+class MemoryBackend(Backend):
+    """
+    An in-process backend, for single-process bots and tests that shouldn't need a memcached server.
+
+    Items expire through a timing wheel of one-second slots swept on every command, and the least recently used items
+    are evicted once the values take more than `max_bytes`. Values larger than `max_item_size` are refused, like
+    memcached does.
+    """
+    _valid_key_re = re.compile("^[^\\s\x00-\x1F\x7F-\x9F]{1,250}$")
+
+    def __init__(self, *, max_bytes: int = 64 * 1024 * 1024, max_item_size: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_item_size = max_item_size
+
+        self._items: 'OrderedDict[bytes, _Item]' = OrderedDict()
+        self.current_bytes = 0
+        self.evictions = 0
+
+        self._cas_counter = itertools.count(1)
+        self._wheel: Dict[int, Set[bytes]] = {}
+        self._wheel_slots: List[int] = []
+
+    def _validate_key(self, key: bytes) -> bytes:
+        if not isinstance(key, bytes):
+            raise ValidationException('key must be bytes', key)
+
+        key_str = key.decode()
+        m = self._valid_key_re.match(key_str)
+        if not m or len(m.group(0)) != len(key_str):
+            raise ValidationException('invalid key', key)
+        return key
+
+    def _expires_at(self, exptime: int) -> float:
+        if not isinstance(exptime, int):
+            raise ValidationException('exptime not int', exptime)
+        elif exptime < 0:
+            raise ValidationException('exptime negative', exptime)
+        elif exptime == 0:
+            return 0
+        elif exptime > RELATIVE_EXPTIME_LIMIT:
+            return exptime
+        return time.time() + exptime
+
+    def _sweep(self, now: float) -> None:
+        while self._wheel_slots and self._wheel_slots[0] <= now:
+            slot = heapq.heappop(self._wheel_slots)
+            for key in self._wheel.pop(slot):
+                item = self._items.get(key)
+                # The item may have been replaced or touched since it was put in this slot.
+                if item is not None and item.expires_at and item.expires_at <= now:
+                    self._remove(key)
+
+    def _lookup(self, key: bytes) -> Optional[_Item]:
+        self._validate_key(key)
+        now = time.time()
+        self._sweep(now)
+
+        item = self._items.get(key)
+        if item is None:
+            return None
+        elif item.expires_at and item.expires_at <= now:
+            self._remove(key)
+            return None
+
+        self._items.move_to_end(key)
+        return item
+
+    def _remove(self, key: bytes) -> bool:
+        item = self._items.pop(key, None)
+        if item is None:
+            return False
+        self.current_bytes -= len(item.value)
+        return True
+
+    def _schedule(self, key: bytes, expires_at: float) -> None:
+        if not expires_at:
+            return
+
+        slot = int(expires_at) + 1
+        keys = self._wheel.get(slot)
+        if keys is None:
+            keys = self._wheel[slot] = set()
+            heapq.heappush(self._wheel_slots, slot)
+        keys.add(key)
+
+    def _store(self, key: bytes, value: bytes, expires_at: float) -> None:
+        if len(value) > self.max_item_size:
+            raise ClientException('stats set failed', b'SERVER_ERROR object too large for cache')
+
+        self._remove(key)
+        self._items[key] = _Item(value, expires_at, next(self._cas_counter))
+        self.current_bytes += len(value)
+        self._schedule(key, expires_at)
+
+        while self.current_bytes > self.max_bytes:
+            old_key, old_item = self._items.popitem(last=False)
+            self.current_bytes -= len(old_item.value)
+            self.evictions += 1
+
+    def _check_value(self, value: bytes) -> None:
+        if not isinstance(value, bytes):
+            raise ValidationException("flag handler must be set for non-byte values")
+
+    async def get(self, key: bytes, default: Optional[bytes] = None) -> Optional[bytes]:
+        item = self._lookup(key)
+        return default if item is None else item.value
+
+    async def gets(self, key: bytes, default: Optional[bytes] = None) -> Tuple[Optional[bytes], Optional[int]]:
+        item = self._lookup(key)
+        if item is None:
+            return default, None
+        return item.value, item.cas
+
+    async def set(self, key: bytes, value: bytes, exptime: int = 0) -> bool:
+        self._validate_key(key)
+        self._check_value(value)
+        self._store(key, value, self._expires_at(exptime))
+        return True
+
+    async def add(self, key: bytes, value: bytes, exptime: int = 0) -> bool:
+        self._check_value(value)
+        expires_at = self._expires_at(exptime)
+        if self._lookup(key) is not None:
+            return False
+        self._store(key, value, expires_at)
+        return True
+
+    async def cas(self, key: bytes, value: bytes, cas_token: int, exptime: int = 0) -> bool:
+        self._check_value(value)
+        expires_at = self._expires_at(exptime)
+        item = self._lookup(key)
+        if item is None or item.cas != cas_token:
+            return False
+        self._store(key, value, expires_at)
+        return True
+
+    async def delete(self, key: bytes) -> bool:
+        if self._lookup(key) is None:
+            return False
+        return self._remove(key)
+
+    async def _incr_decr(self, key: bytes, delta: int) -> Optional[int]:
+        item = self._lookup(key)
+        if item is None:
+            return None
+        elif not item.value.isdigit():
+            raise ClientException('Memcached incr command failed',
+                                  b'CLIENT_ERROR cannot increment or decrement non-numeric value')
+
+        # memcached wraps around on overflow, and stops at 0 when decrementing.
+        value = max(0, (int(item.value) + delta) % 2 ** 64 if delta > 0 else int(item.value) + delta)
+        item.value, old_size = str(value).encode(), len(item.value)
+        item.cas = next(self._cas_counter)
+        self.current_bytes += len(item.value) - old_size
+        return value
+
+    async def incr(self, key: bytes, increment: int = 1) -> Optional[int]:
+        return await self._incr_decr(key, increment)
+
+    async def decr(self, key: bytes, decrement: int = 1) -> Optional[int]:
+        return await self._incr_decr(key, -decrement)
+
+    async def touch(self, key: bytes, exptime: int) -> bool:
+        expires_at = self._expires_at(exptime)
+        item = self._lookup(key)
+        if item is None:
+            return False
+        item.expires_at = expires_at
+        self._schedule(key, expires_at)
+        return True
+
+    async def multi_get(self, *keys: bytes) -> Tuple[Optional[bytes], ...]:
+        if len(set(keys)) != len(keys):
+            raise ClientException('duplicate keys passed to multi_get')
+        return tuple([await self.get(key) for key in keys])
+
+    async def multi_set(self, items: Iterable[Tuple[bytes, bytes, int]]) -> List[bool]:
+        return [await self.set(key, value, exptime) for key, value, exptime in items]
+
+    async def multi_delete(self, *keys: bytes) -> List[bool]:
+        return [await self.delete(key) for key in keys]
+
+    async def close(self) -> None:
+        self._items.clear()
+        self._wheel.clear()
+        self._wheel_slots.clear()
+        self.current_bytes = 0
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import struct
+import zlib
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+# Values too large for a single memcached item are stored as a manifest under their own key, and chunks under keys
+# derived from it. The magic can't be produced by the cache codecs, whose values start with 0x80 or a byte below it.
+MANIFEST_MAGIC = b'\xffkasushi-chunks\x00'
+_MANIFEST_STRUCT = struct.Struct('>8sIQI')  # token, chunk count, total length, crc32
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024 - 1024  # Leaves room for the item header in memcached's default 1MB limit.
+
+
+class Manifest(NamedTuple):
+    chunk_keys: List[bytes]
+    length: int
+    checksum: int
+
+
+def _chunk_keys(key: bytes, token: bytes, count: int) -> List[bytes]:
+    # Keys are limited to 250 bytes, long ones are replaced by their hash.
+    base = key if len(key) <= 200 else hashlib.md5(key).hexdigest().encode()
+    return [b'%b:chunk:%b:%d' % (base, token.hex().encode(), index) for index in range(count)]
+
+
+def split(key: bytes, value: bytes, chunk_size: int) -> Tuple[bytes, List[Tuple[bytes, bytes]]]:
+    """
+    Split a value into chunks of at most `chunk_size` bytes.
+
+    Returns the manifest to store under `key`, and a list of (chunk key, chunk) tuples. Every write uses a new random
+    token in the chunk keys, so a reader can never mix chunks of two different writes.
+    """
+    token = os.urandom(8)
+    count = -(-len(value) // chunk_size)
+    view = memoryview(value)
+    chunks = [(chunk_key, bytes(view[index * chunk_size:(index + 1) * chunk_size]))
+              for index, chunk_key in enumerate(_chunk_keys(key, token, count))]
+
+    manifest = MANIFEST_MAGIC + _MANIFEST_STRUCT.pack(token, count, len(value), zlib.crc32(value))
+    return manifest, chunks
+
+
+def parse_manifest(key: bytes, data: bytes) -> Optional[Manifest]:
+    """
+    Get the manifest stored in `data`, or None if it's a regular value.
+    """
+    if not data.startswith(MANIFEST_MAGIC):
+        return None
+
+    token, count, length, checksum = _MANIFEST_STRUCT.unpack_from(data, len(MANIFEST_MAGIC))
+    return Manifest(_chunk_keys(key, token, count), length, checksum)
+
+
+def join(manifest: Manifest, chunks: Sequence[Optional[bytes]]) -> Optional[bytes]:
+    """
+    Put the chunks back together, or return None if some of them were evicted or don't match the manifest.
+    """
+    if any(chunk is None for chunk in chunks):
+        return None
+
+    value = b''.join(chunks)
+    if len(value) != manifest.length or zlib.crc32(value) != manifest.checksum:
+        return None
+    return value
@@ -0,0 +1,281 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiomcache import constants as const
+from aiomcache.client import Client, acquire
+from aiomcache.exceptions import ClientException, ValidationException
+from aiomcache.pool import Connection
+
+from .backends import Backend
+from .ring import HashRing
+
+
+class MemcachedClient(Client, Backend):
+    """
+    An aiomcache client with pipelined multi-key storage commands.
+
+    All the commands of a batch are written to the same connection at once, and the responses are read back in order,
+    so a batch costs a single round-trip whatever its size.
+    """
+
+    async def _incr_decr(self, conn: Connection, command: bytes, key: bytes, delta: int) -> Optional[int]:
+        # aiomcache raises on missing keys, even though its documentation says None is returned.
+        delta_byte = str(delta).encode('utf-8')
+        response = await self._execute_simple_command(conn, b' '.join([command, key, delta_byte]) + b'\r\n')
+        if response == const.NOT_FOUND:
+            return None
+        elif not response.isdigit():
+            raise ClientException('Memcached {} command failed'.format(str(command)), response)
+        return int(response)
+
+    async def _pipeline(self, conn: Connection, commands: List[bytes], expected: Tuple[bytes, ...],
+                        success: bytes) -> List[bool]:
+        if not commands:
+            return []
+
+        conn.writer.write(b''.join(commands))
+        await conn.writer.drain()
+
+        results = []
+        for _ in commands:
+            response = (await conn.reader.readline())[:-2]
+            if response not in expected:
+                raise ClientException('Memcached pipelined command failed', response)
+            results.append(response == success)
+
+        return results
+
+    @acquire
+    async def multi_set(self, conn: Connection, items: Iterable[Tuple[bytes, bytes, int]]) -> List[bool]:
+        """
+        Set many keys at once. `items` is an iterable of (key, value, exptime) tuples.
+
+        Returns a list of booleans, in the same order as `items`, True for the keys that were stored.
+        """
+        commands = []
+        for key, value, exptime in items:
+            self._validate_key(key)
+            if not isinstance(exptime, int):
+                raise ValidationException('exptime not int', exptime)
+            elif exptime < 0:
+                raise ValidationException('exptime negative', exptime)
+
+            commands.append(b'set %b 0 %d %d\r\n%b\r\n' % (key, exptime, len(value), value))
+
+        return await self._pipeline(conn, commands,
+                                    (const.STORED, const.NOT_STORED, const.EXISTS, const.NOT_FOUND), const.STORED)
+
+    @acquire
+    async def multi_incr(self, conn: Connection, items: Iterable[Tuple[bytes, int]]) -> List[Optional[int]]:
+        """
+        Increment many keys at once. `items` is an iterable of (key, increment) tuples.
+
+        Returns the new values in the same order as `items`, None for the keys that were not found.
+        """
+        commands = []
+        for key, increment in items:
+            self._validate_key(key)
+            commands.append(b'incr %b %d\r\n' % (key, increment))
+
+        if not commands:
+            return []
+
+        conn.writer.write(b''.join(commands))
+        await conn.writer.drain()
+
+        results = []
+        for _ in commands:
+            response = (await conn.reader.readline())[:-2]
+            if response == const.NOT_FOUND:
+                results.append(None)
+            elif response.isdigit():
+                results.append(int(response))
+            else:
+                raise ClientException('Memcached pipelined incr failed', response)
+
+        return results
+
+    @acquire
+    async def multi_gets(self, conn: Connection, *keys: bytes) -> Tuple[Tuple[Optional[bytes], Optional[int]], ...]:
+        """
+        Get many keys at once with a single `gets` command, with their CAS tokens.
+        """
+        values, cas_tokens = await self._multi_get(conn, *keys, with_cas=True)
+        return tuple((values.get(key), cas_tokens.get(key)) for key in keys)
+
+    @acquire
+    async def multi_cas(self, conn: Connection, items: Iterable[Tuple[bytes, bytes, Optional[int], int]]) -> List[bool]:
+        """
+        Compare-and-set many keys at once. `items` is an iterable of (key, value, cas token, exptime) tuples, where a
+        None cas token adds the key instead.
+
+        Returns a list of booleans, in the same order as `items`, True for the keys that were stored.
+        """
+        commands = []
+        for key, value, cas_token, exptime in items:
+            self._validate_key(key)
+            if not isinstance(exptime, int):
+                raise ValidationException('exptime not int', exptime)
+            elif exptime < 0:
+                raise ValidationException('exptime negative', exptime)
+
+            if cas_token is None:
+                commands.append(b'add %b 0 %d %d\r\n%b\r\n' % (key, exptime, len(value), value))
+            else:
+                commands.append(b'cas %b 0 %d %d %d\r\n%b\r\n' % (key, exptime, len(value), cas_token, value))
+
+        return await self._pipeline(conn, commands,
+                                    (const.STORED, const.NOT_STORED, const.EXISTS, const.NOT_FOUND), const.STORED)
+
+    @acquire
+    async def multi_delete(self, conn: Connection, *keys: bytes) -> List[bool]:
+        """
+        Delete many keys at once.
+
+        Returns a list of booleans, in the same order as `keys`, True for the keys that were deleted.
+        """
+        commands = []
+        for key in keys:
+            self._validate_key(key)
+            commands.append(b'delete %b\r\n' % key)
+
+        return await self._pipeline(conn, commands, (const.DELETED, const.NOT_FOUND), const.DELETED)
+
+
+class ShardedClient(Backend):
+    """
+    Spreads keys over several memcached servers with a consistent hash ring.
+
+    It has the same methods as `MemcachedClient`. Single-key commands go to the server owning the key, and multi-key
+    commands are split per server and run concurrently.
+    """
+
+    def __init__(self, servers: List[Tuple[str, int, int]], **client_kwargs):
+        """
+        `servers` is a list of (host, port, weight) tuples.
+        """
+        self.nodes: Dict[str, MemcachedClient] = {}
+        weights = {}
+        for host, port, weight in servers:
+            name = f"{host}:{port}"
+            self.nodes[name] = MemcachedClient(host, port, **client_kwargs)
+            weights[name] = weight
+
+        self.ring = HashRing(weights)
+
+    def node_for(self, key: bytes) -> MemcachedClient:
+        return self.nodes[self.ring.get_node(key)]
+
+    def _split(self, keys: Iterable[bytes]) -> Dict[str, List[int]]:
+        """
+        Group the positions of `keys` by the server owning them.
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, key in enumerate(keys):
+            groups.setdefault(self.ring.get_node(key), []).append(index)
+        return groups
+
+    async def get(self, key: bytes, default: Optional[bytes] = None) -> Optional[bytes]:
+        return await self.node_for(key).get(key, default)
+
+    async def gets(self, key: bytes, default: Optional[bytes] = None) -> Tuple[Optional[bytes], Optional[int]]:
+        return await self.node_for(key).gets(key, default)
+
+    async def set(self, key: bytes, value: bytes, exptime: int = 0) -> bool:
+        return await self.node_for(key).set(key, value, exptime)
+
+    async def add(self, key: bytes, value: bytes, exptime: int = 0) -> bool:
+        return await self.node_for(key).add(key, value, exptime)
+
+    async def cas(self, key: bytes, value: bytes, cas_token: int, exptime: int = 0) -> bool:
+        return await self.node_for(key).cas(key, value, cas_token, exptime)
+
+    async def delete(self, key: bytes) -> bool:
+        return await self.node_for(key).delete(key)
+
+    async def incr(self, key: bytes, increment: int = 1) -> Optional[int]:
+        return await self.node_for(key).incr(key, increment)
+
+    async def decr(self, key: bytes, decrement: int = 1) -> Optional[int]:
+        return await self.node_for(key).decr(key, decrement)
+
+    async def touch(self, key: bytes, exptime: int) -> bool:
+        return await self.node_for(key).touch(key, exptime)
+
+    async def multi_get(self, *keys: bytes) -> Tuple[Optional[bytes], ...]:
+        groups = self._split(keys)
+        results = await asyncio.gather(*(
+            self.nodes[node].multi_get(*(keys[index] for index in indexes)) for node, indexes in groups.items()
+        ))
+
+        values: List[Optional[bytes]] = [None] * len(keys)
+        for indexes, node_values in zip(groups.values(), results):
+            for index, value in zip(indexes, node_values):
+                values[index] = value
+        return tuple(values)
+
+    async def multi_set(self, items: Iterable[Tuple[bytes, bytes, int]]) -> List[bool]:
+        items = list(items)
+        groups = self._split(key for key, _, _ in items)
+        results = await asyncio.gather(*(
+            self.nodes[node].multi_set(items[index] for index in indexes) for node, indexes in groups.items()
+        ))
+
+        stored = [False] * len(items)
+        for indexes, node_results in zip(groups.values(), results):
+            for index, result in zip(indexes, node_results):
+                stored[index] = result
+        return stored
+
+    async def multi_gets(self, *keys: bytes) -> Tuple[Tuple[Optional[bytes], Optional[int]], ...]:
+        groups = self._split(keys)
+        results = await asyncio.gather(*(
+            self.nodes[node].multi_gets(*(keys[index] for index in indexes)) for node, indexes in groups.items()
+        ))
+
+        values: List[Tuple[Optional[bytes], Optional[int]]] = [(None, None)] * len(keys)
+        for indexes, node_values in zip(groups.values(), results):
+            for index, value in zip(indexes, node_values):
+                values[index] = value
+        return tuple(values)
+
+    async def multi_cas(self, items: Iterable[Tuple[bytes, bytes, Optional[int], int]]) -> List[bool]:
+        items = list(items)
+        groups = self._split(key for key, _, _, _ in items)
+        results = await asyncio.gather(*(
+            self.nodes[node].multi_cas(items[index] for index in indexes) for node, indexes in groups.items()
+        ))
+
+        stored = [False] * len(items)
+        for indexes, node_results in zip(groups.values(), results):
+            for index, result in zip(indexes, node_results):
+                stored[index] = result
+        return stored
+
+    async def multi_delete(self, *keys: bytes) -> List[bool]:
+        groups = self._split(keys)
+        results = await asyncio.gather(*(
+            self.nodes[node].multi_delete(*(keys[index] for index in indexes)) for node, indexes in groups.items()
+        ))
+
+        deleted = [False] * len(keys)
+        for indexes, node_results in zip(groups.values(), results):
+            for index, result in zip(indexes, node_results):
+                deleted[index] = result
+        return deleted
+
+    async def multi_incr(self, items: Iterable[Tuple[bytes, int]]) -> List[Optional[int]]:
+        items = list(items)
+        groups = self._split(key for key, _ in items)
+        results = await asyncio.gather(*(
+            self.nodes[node].multi_incr(items[index] for index in indexes) for node, indexes in groups.items()
+        ))
+
+        values: List[Optional[int]] = [None] * len(items)
+        for indexes, node_results in zip(groups.values(), results):
+            for index, result in zip(indexes, node_results):
+                values[index] = result
+        return values
+
+    async def close(self) -> None:
+        await asyncio.gather(*(node.close() for node in self.nodes.values()))
@@ -0,0 +1,241 @@
+import json
+import lzma
+import pickle
+import zlib
+from typing import Any, Dict, List, Optional
+
+from kasushi.exceptions import InvalidConfigurationError
+
+# Every pickle since protocol 2 starts with the PROTO opcode, so values written before codecs existed (and uncompressed
+# pickles written now) are recognised by their first byte. Other values start with a header byte that always has its
+# high bit clear: the codec id lives in the low nibble, and the compression id in the next three bits.
+PICKLE_HEADER = 0x80
+
+
+class Codec:
+    """
+    Turns python objects into bytes and back. Subclasses need a unique `name`, and an `id` between 1 and 15 that is
+    written in the header of every value they encode.
+    """
+    name: str = None
+    id: int = None
+
+    def can_encode(self, obj: Any) -> bool:
+        return True
+
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class PickleCodec(Codec):
+    name = 'pickle'
+    id = 1
+
+    def __init__(self, protocol: int = 5):
+        self.protocol = protocol
+
+    def encode(self, obj: Any) -> bytes:
+        return pickle.dumps(obj, protocol=self.protocol)
+
+    def decode(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+class JSONCodec(Codec):
+    """
+    Encodes values that JSON gives back unchanged: None, bools, ints, floats, strings, and lists and str-keyed dicts of
+    them. Other values, like tuples, sets, bytes, int-keyed dicts or subclasses of these types, are left to the next
+    codec.
+    """
+    name = 'json'
+    id = 2
+
+    def can_encode(self, obj: Any) -> bool:
+        stack = [obj]
+        # Containers already checked. One found twice is shared or cyclic, which JSON doesn't keep.
+        seen = set()
+        while stack:
+            value = stack.pop()
+            kind = type(value)
+            if kind is list:
+                if id(value) in seen:
+                    return False
+                seen.add(id(value))
+                stack.extend(value)
+            elif kind is dict:
+                if id(value) in seen or any(type(key) is not str for key in value):
+                    return False
+                seen.add(id(value))
+                stack.extend(value.values())
+            elif value is not None and kind not in (bool, int, float, str):
+                return False
+        return True
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class VarintCodec(Codec):
+    """
+    Encodes ints as zigzag varints: small counters and IDs take one to a few bytes instead of a full pickle.
+    """
+    name = 'varint'
+    id = 3
+
+    def can_encode(self, obj: Any) -> bool:
+        return type(obj) is int
+
+    def encode(self, obj: int) -> bytes:
+        n = obj * 2 if obj >= 0 else -obj * 2 - 1
+        out = bytearray()
+        while n > 0x7f:
+            out.append((n & 0x7f) | 0x80)
+            n >>= 7
+        out.append(n)
+        return bytes(out)
+
+    def decode(self, data: bytes) -> int:
+        n = 0
+        for shift, byte in enumerate(data):
+            n |= (byte & 0x7f) << (7 * shift)
+        return n // 2 if not n & 1 else -(n + 1) // 2
+
+
+class Compressor:
+    """
+    Compresses encoded values. Subclasses need a unique `name`, and an `id` between 1 and 7.
+    """
+    name: str = None
+    id: int = None
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    name = 'zlib'
+    id = 1
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LZMACompressor(Compressor):
+    name = 'lzma'
+    id = 2
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=[{"id": lzma.FILTER_LZMA2}])
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=[{"id": lzma.FILTER_LZMA2}])
+
+
+CODECS: Dict[str, Codec] = {}
+COMPRESSORS: Dict[str, Compressor] = {}
+
+_codecs_by_id: Dict[int, Codec] = {}
+_compressors_by_id: Dict[int, Compressor] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """
+    Make a codec available by name in the cache configuration, and readable when it is found in a value header.
+    """
+    if not codec.id or not 1 <= codec.id <= 15:
+        raise InvalidConfigurationError(f"Codec {codec.name} must have an id between 1 and 15.")
+    CODECS[codec.name] = codec
+    _codecs_by_id[codec.id] = codec
+
+
+def register_compressor(compressor: Compressor) -> None:
+    if not compressor.id or not 1 <= compressor.id <= 7:
+        raise InvalidConfigurationError(f"Compressor {compressor.name} must have an id between 1 and 7.")
+    COMPRESSORS[compressor.name] = compressor
+    _compressors_by_id[compressor.id] = compressor
+
+
+for _codec in (PickleCodec(), JSONCodec(), VarintCodec()):
+    register_codec(_codec)
+
+for _compressor in (ZlibCompressor(), LZMACompressor()):
+    register_compressor(_compressor)
+
+
+class Serializer:
+    """
+    Encodes values with the first configured codec that accepts them, and compresses the result if it is larger than
+    `compression_threshold` bytes and compression actually makes it smaller.
+
+    Decoding only relies on the header byte, so values written with any registered codec can be read whatever the
+    current configuration is.
+    """
+
+    def __init__(self, codecs: Optional[List[str]] = None, *, compression: Optional[str] = None,
+                 compression_threshold: int = 1024):
+        codecs = codecs or ['pickle']
+        try:
+            self.codecs = [CODECS[name] for name in codecs]
+        except KeyError as e:
+            raise InvalidConfigurationError(f"Unknown cache codec {e}. Available codecs: {list(CODECS.keys())}")
+
+        if compression is None:
+            self.compressor = None
+        else:
+            try:
+                self.compressor = COMPRESSORS[compression]
+            except KeyError:
+                raise InvalidConfigurationError(
+                    f"Unknown cache compression {compression}. Available compressions: {list(COMPRESSORS.keys())}"
+                )
+
+        self.compression_threshold = compression_threshold
+
+    def dumps(self, obj: Any) -> bytes:
+        for codec in self.codecs:
+            if not codec.can_encode(obj):
+                continue
+
+            try:
+                data = codec.encode(obj)
+            except (TypeError, ValueError):
+                continue
+
+            if self.compressor is not None and len(data) > self.compression_threshold:
+                compressed = self.compressor.compress(data)
+                if len(compressed) < len(data):
+                    return bytes((self.compressor.id << 4 | codec.id,)) + compressed
+
+            if codec.id == PickleCodec.id:
+                # Uncompressed pickles describe themselves, and stay readable by older versions.
+                return data
+            return bytes((codec.id,)) + data
+
+        raise TypeError(f"No configured cache codec can encode {type(obj).__name__} objects.")
+
+    def loads(self, data: bytes) -> Any:
+        header = data[0]
+        if header == PICKLE_HEADER:
+            return pickle.loads(data)
+
+        body = data[1:]
+        compressor_id = header >> 4
+        if compressor_id:
+            body = _compressors_by_id[compressor_id].decompress(body)
+
+        return _codecs_by_id[header & 0x0f].decode(body)
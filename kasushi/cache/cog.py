@@ -1,65 +1,481 @@
+import asyncio
+import hashlib
 import inspect
-import pickle
+import logging
+import math
+import random
+import time
 from datetime import timedelta
-from typing import Optional, Union, Any
+from typing import Optional, Union, Any, List, Iterable, Mapping, Dict, Tuple, Callable, Awaitable
 from discord.ext import commands
 
 from kasushi.exceptions import InvalidConfigurationError, InvalidRequirementsError
+from . import chunks
+from .codecs import Serializer
+from .metrics import CacheMetrics
+from .namespace import CacheNamespace
+from .near import NearCache
+from .warmstart import WarmStart
+from .writebehind import WriteBehindBuffer
 
 try:
     import aiomcache
 except ImportError:
     raise InvalidRequirementsError("aiomcache is not installed.")
 
+from .backends import Backend, MemoryBackend
+from .client import MemcachedClient, ShardedClient
+
+logger = logging.getLogger(__name__)
+
+Key = Union[str, bytes]
+
+
+def to_bytes(key: Key) -> bytes:
+    if isinstance(key, str):
+        return key.encode()
+    return key
+
+
+def to_exptime(expire: Optional[timedelta]) -> int:
+    if expire is None:
+        return 0
+    return int(expire.total_seconds())
+
 
 class Cache:
-    def __init__(self, bot: commands.Bot, raw_cache: aiomcache.Client):
+    def __init__(self, bot: commands.Bot, raw_cache: Backend, *,
+                 near_cache: Optional[NearCache] = None, serializer: Optional[Serializer] = None,
+                 metrics: Optional[CacheMetrics] = None, chunk_size: Optional[int] = chunks.DEFAULT_CHUNK_SIZE):
         self.bot = bot
         self._raw_cache = raw_cache
+        self.near_cache = near_cache
+        self.serializer = serializer or Serializer()
+        self.metrics = metrics
+        self.chunk_size = chunk_size
+        self.write_behind: Optional[WriteBehindBuffer] = None
+        self.warm_start: Optional[WarmStart] = None
+        self._in_flight: Dict[bytes, asyncio.Task] = {}
+        self._generations: Dict[bytes, Tuple[int, float]] = {}
+
+    async def _call(self, operation: str, coro: Awaitable[Any]) -> Any:
+        """
+        Await a memcached command, recording its latency and errors if metrics are enabled.
+        """
+        if self.metrics is None:
+            return await coro
+
+        start = time.perf_counter()
+        try:
+            result = await coro
+        except Exception:
+            self.metrics.record_error(operation)
+            raise
+
+        self.metrics.observe_latency(operation, time.perf_counter() - start)
+        return result
+
+    def _split_chunks(self, key: bytes, value: bytes, exptime: int) -> List[Tuple[bytes, bytes, int]]:
+        """
+        Get the items to store for a value: the value itself, or its chunks followed by their manifest if it's too
+        large for a single memcached item.
+        """
+        if self.chunk_size is None or len(value) <= self.chunk_size:
+            return [(key, value, exptime)]
+
+        manifest, parts = chunks.split(key, value, self.chunk_size)
+        return [(chunk_key, chunk, exptime) for chunk_key, chunk in parts] + [(key, manifest, exptime)]
+
+    async def _join_chunks(self, values: Dict[bytes, bytes]) -> None:
+        """
+        Replace the chunk manifests found in `values` by the values they describe, fetching every chunk with a single
+        multi-get. Values whose chunks are incomplete are removed, like a miss.
+        """
+        manifests = {}
+        for key, value in values.items():
+            manifest = chunks.parse_manifest(key, value)
+            if manifest is not None:
+                manifests[key] = manifest
+
+        if not manifests:
+            return
+
+        chunk_keys = [chunk_key for manifest in manifests.values() for chunk_key in manifest.chunk_keys]
+        chunk_values = iter(await self._call('get_chunks', self._raw_cache.multi_get(*chunk_keys)))
+        for key, manifest in manifests.items():
+            value = chunks.join(manifest, [next(chunk_values) for _ in manifest.chunk_keys])
+            if value is None:
+                del values[key]
+            else:
+                values[key] = value
 
     async def bget(self, key: bytes, *, default: Optional[bytes] = None) -> bytes:
-        return await self._raw_cache.get(key, default=default)
+        if self.warm_start is not None:
+            self.warm_start.record(key)
+
+        if self.write_behind is not None:
+            value = self.write_behind.get(key)
+            if value is not None:
+                return value
+
+        if self.near_cache is not None:
+            value = self.near_cache.get(key)
+            if value is not None:
+                if self.metrics is not None:
+                    self.metrics.record_get(key, value, near=True)
+                return value
+
+        value = await self._call('get', self._raw_cache.get(key))
+        if value is not None and value.startswith(chunks.MANIFEST_MAGIC):
+            values = {key: value}
+            await self._join_chunks(values)
+            value = values.get(key)
+
+        if self.metrics is not None:
+            self.metrics.record_get(key, value)
+
+        if value is None:
+            return default
+
+        if self.near_cache is not None:
+            self.near_cache.set(key, value)
+
+        return value
 
     async def bset(self, key: bytes, value: bytes, *, expire: Optional[timedelta] = None) -> bool:
         """
         Set a key in the cache. If expire is not None, the key will expire after the given time.
+
+        Values larger than `chunk_size` are transparently split over several memcached items.
         """
-        if expire is None:
-            exptime = 0
+        if self.write_behind is not None:
+            await self.write_behind.discard([key])
+
+        exptime = to_exptime(expire)
+        if self.chunk_size is None or len(value) <= self.chunk_size:
+            stored = await self._call('set', self._raw_cache.set(key, value, exptime=exptime))
         else:
-            exptime = expire.total_seconds()
+            *parts, manifest = self._split_chunks(key, value, exptime)
+            # Chunks are written before the manifest, so that readers never find a manifest without its chunks.
+            stored = all(await self._call('set_chunks', self._raw_cache.multi_set(parts)))
+            if stored:
+                stored = await self._call('set', self._raw_cache.set(key, manifest[1], exptime=exptime))
+        if self.metrics is not None:
+            self.metrics.record_set(key, value)
 
-        return await self._raw_cache.set(key, value, exptime=exptime)
+        if self.near_cache is not None:
+            if stored:
+                self.near_cache.set(key, value, expire=exptime)
+            else:
+                self.near_cache.delete(key)
+            await self.publish_invalidation([key])
+
+        return stored
 
     async def bdelete(self, key: bytes) -> bool:
         """
         Delete a key from the cache.
 
-        Returns True if the key was deleted, False if it was not found.
+        Returns True if the key was deleted, False if it was not found. The chunks of large values are left for
+        memcached to evict, since nothing references them anymore.
         """
-        return await self._raw_cache.delete(key)
+        if self.write_behind is not None:
+            await self.write_behind.discard([key])
+
+        deleted = await self._call('delete', self._raw_cache.delete(key))
+        if self.metrics is not None:
+            self.metrics.record_delete(key)
+
+        if self.near_cache is not None:
+            self.near_cache.delete(key)
+            await self.publish_invalidation([key])
+
+        return deleted
+
+    async def bget_many(self, keys: Iterable[bytes]) -> Dict[bytes, bytes]:
+        """
+        Get many keys from the cache with a single memcached multi-get.
+
+        Returns a dict containing only the keys that were found.
+        """
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if self.warm_start is not None:
+                self.warm_start.record(key)
+
+            if self.write_behind is not None:
+                value = self.write_behind.get(key)
+                if value is not None:
+                    found[key] = value
+                    continue
+
+            value = self.near_cache.get(key) if self.near_cache is not None else None
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+                if self.metrics is not None:
+                    self.metrics.record_get(key, value, near=True)
+
+        if missing:
+            values = await self._call('get_many', self._raw_cache.multi_get(*missing))
+            values = {key: value for key, value in zip(missing, values) if value is not None}
+            await self._join_chunks(values)
+
+            for key in missing:
+                value = values.get(key)
+                if self.metrics is not None:
+                    self.metrics.record_get(key, value)
+                if value is not None:
+                    found[key] = value
+                    if self.near_cache is not None:
+                        self.near_cache.set(key, value)
+
+        return found
+
+    async def bset_many(self, items: Mapping[bytes, bytes], *, expire: Optional[timedelta] = None,
+                        expires: Optional[Mapping[bytes, timedelta]] = None) -> Dict[bytes, bool]:
+        """
+        Set many keys in the cache, with pipelined memcached commands.
+
+        `expire` applies to every key, unless an expiration for that key is given in `expires`.
+        Returns a dict mapping each key to True if it was stored.
+        """
+        if self.write_behind is not None:
+            await self.write_behind.discard(items.keys())
+
+        expires = expires or {}
+        return await self._store_many(items, {key: to_exptime(expires.get(key, expire)) for key in items.keys()})
+
+    async def _store_many(self, items: Mapping[bytes, bytes], exptimes: Mapping[bytes, int]) -> Dict[bytes, bool]:
+        batch = []
+        positions = {}
+        for key, value in items.items():
+            split = self._split_chunks(key, value, exptimes[key])
+            positions[key] = range(len(batch), len(batch) + len(split))
+            batch.extend(split)
+
+        stored = await self._call('set_many', self._raw_cache.multi_set(batch))
+        # A chunked value is only stored if its manifest and all its chunks are.
+        results = {key: all(stored[index] for index in positions[key]) for key in items.keys()}
+        if self.metrics is not None:
+            for key, value in items.items():
+                self.metrics.record_set(key, value)
+
+        if self.near_cache is not None and items:
+            for key, value in items.items():
+                if results[key]:
+                    self.near_cache.set(key, value, expire=exptimes[key])
+                else:
+                    self.near_cache.delete(key)
+            await self.publish_invalidation(list(results.keys()))
+
+        return results
+
+    async def bdelete_many(self, keys: Iterable[bytes]) -> Dict[bytes, bool]:
+        """
+        Delete many keys from the cache, with pipelined memcached commands.
+
+        Returns a dict mapping each key to True if it was deleted, False if it was not found.
+        """
+        keys = list(dict.fromkeys(keys))
+        if self.write_behind is not None:
+            await self.write_behind.discard(keys)
+
+        results = dict(zip(keys, await self._call('delete_many', self._raw_cache.multi_delete(*keys))))
+        if self.metrics is not None:
+            for key in keys:
+                self.metrics.record_delete(key)
+
+        if self.near_cache is not None and keys:
+            for key in keys:
+                self.near_cache.delete(key)
+            await self.publish_invalidation(keys)
+
+        return results
+
+    def drop_local(self, keys: Iterable[bytes]) -> None:
+        """
+        Forget what this process knows about these keys, because another process changed them.
+        """
+        for key in keys:
+            self._generations.pop(key, None)
+            if self.near_cache is not None:
+                self.near_cache.invalidate([key])
+
+    async def publish_invalidation(self, keys: List[bytes]) -> None:
+        """
+        Tell the other processes to drop these keys from their near cache and namespace generations.
+
+        This goes through the `cache_invalidate` IPC handler, and is a no-op if IPC isn't loaded, isn't logged in to the
+        server, or the handler isn't registered. It is best-effort: a failure to send is logged, never raised, since the
+        cache write itself already succeeded.
+        """
+        ipc = getattr(self.bot, 'ipc', None)
+        if ipc is None or ipc.closed or not ipc.online.is_set():
+            return
+
+        handler = ipc.handlers.get('cache_invalidate')
+        if handler is None:
+            return
+
+        try:
+            await handler.send_request(keys=keys)
+        except Exception:
+            logger.debug("Couldn't publish a cache invalidation, the IPC connection is unavailable", exc_info=True)
 
     def encode(self, obj: Any) -> bytes:
-        return pickle.dumps(obj)
+        return self.serializer.dumps(obj)
 
     def decode(self, data: bytes) -> Any:
-        return pickle.loads(data)
+        return self.serializer.loads(data)
+
+    async def get(self, key: Key, *, default: Any = None) -> Any:
+        return self.decode(await self.bget(to_bytes(key), default=self.encode(default)))
+
+    async def set(self, key: Key, value: Any, *, expire: Optional[timedelta] = None) -> bool:
+        """
+        Set a key in the cache. If expire is not None, the key will expire after the given time.
+
+        With write-behind enabled, the value is only buffered, and this always returns True.
+        """
+        if self.write_behind is not None:
+            self.write_behind.put(to_bytes(key), self.encode(value), to_exptime(expire))
+            return True
+
+        return await self.bset(to_bytes(key), self.encode(value), expire=expire)
+
+    async def delete(self, key: Key) -> bool:
+        return await self.bdelete(to_bytes(key))
+
+    def namespace(self, name: str, *, generation_ttl: timedelta = timedelta(seconds=5)) -> CacheNamespace:
+        """
+        Get a view of the cache whose keys can all be invalidated at once, like `bot.cache.namespace("guild:123")`.
+        """
+        return CacheNamespace(self, name, generation_ttl)
+
+    async def get_many(self, keys: Iterable[Key], *, default: Any = None,
+                       defaults: Optional[Mapping[Key, Any]] = None) -> Dict[Key, Any]:
+        """
+        Get many keys at once. Keys can be str or bytes, and the returned dict uses the keys as they were given.
+
+        Missing keys are set to their value in `defaults` if present, or to `default` otherwise.
+        """
+        defaults = defaults or {}
+        keys = list(keys)
+        found = await self.bget_many(to_bytes(key) for key in keys)
+
+        ret = {}
+        for key in keys:
+            value = found.get(to_bytes(key))
+            if value is None:
+                ret[key] = defaults.get(key, default)
+            else:
+                ret[key] = self.decode(value)
+        return ret
+
+    async def set_many(self, items: Mapping[Key, Any], *, expire: Optional[timedelta] = None,
+                       expires: Optional[Mapping[Key, timedelta]] = None) -> Dict[Key, bool]:
+        """
+        Set many keys at once. `expire` applies to every key, unless an expiration for that key is given in `expires`.
+
+        Returns a dict mapping each key, as it was given, to True if it was stored.
+        """
+        expires = {to_bytes(key): value for key, value in (expires or {}).items()}
+        results = await self.bset_many({to_bytes(key): self.encode(value) for key, value in items.items()},
+                                       expire=expire, expires=expires)
+        return {key: results[to_bytes(key)] for key in items.keys()}
+
+    async def delete_many(self, keys: Iterable[Key]) -> Dict[Key, bool]:
+        """
+        Delete many keys at once.
+
+        Returns a dict mapping each key, as it was given, to True if it was deleted, False if it was not found.
+        """
+        keys = list(keys)
+        results = await self.bdelete_many(to_bytes(key) for key in keys)
+        return {key: results[to_bytes(key)] for key in keys}
+
+    async def get_or_set(self, key: Key, coro_factory: Callable[[], Awaitable[Any]], *,
+                         expire: Optional[timedelta] = None, beta: float = 1.0,
+                         lock_timeout: timedelta = timedelta(seconds=10)) -> Any:
+        """
+        Get a key from the cache, or compute it with `await coro_factory()` and store it.
+
+        Concurrent callers in this process share a single computation. Across processes, a short memcached lock makes
+        sure only one of them recomputes a missing key while the others wait for its result, for at most
+        `lock_timeout`. Keys with an expiration are also refreshed a bit before they expire, with a probability that
+        grows as the expiration gets closer and as the computation gets slower (the XFetch algorithm, tuned by `beta`).
+
+        The time it took to compute the value and its expiration are stored under a separate `<key>:xfetch` key, so
+        the value itself can still be read with `get` and `get_many`. Values stored by `set` are never refreshed early.
+        """
+        key = to_bytes(key)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._get_or_set(key, coro_factory, expire, beta, lock_timeout))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    async def _get_or_set(self, key: bytes, coro_factory: Callable[[], Awaitable[Any]], expire: Optional[timedelta],
+                          beta: float, lock_timeout: timedelta) -> Any:
+        # Keys are limited to 250 bytes, long ones are replaced by their hash.
+        base_key = key if len(key) <= 200 else hashlib.md5(key).hexdigest().encode()
+        lock_key = base_key + b':lock'
+        xfetch_key = base_key + b':xfetch'
+        lock_exptime = max(1, to_exptime(lock_timeout))
+
+        found = await self.bget_many([key, xfetch_key])
+        cached = found.get(key)
+        if cached is not None:
+            value = self.decode(cached)
+            if xfetch_key not in found:
+                return value
 
-    async def get(self, key: str, *, default: Any = None) -> str:
-        return self.decode(await self.bget(key.encode(), default=self.encode(default)))
+            delta, expires_at = self.decode(found[xfetch_key])
+            if expires_at is None or time.time() - delta * beta * math.log(1 - random.random()) < expires_at:
+                return value
 
-    async def set(self, key: str, value: Any, *, expire: Optional[timedelta] = None) -> bool:
-        return await self.bset(key.encode(), self.encode(value), expire=expire)
+            # Early refresh: if another process already holds the lock, it is refreshing the key for us.
+            locked = await self._raw_cache.add(lock_key, b'1', lock_exptime)
+            if not locked:
+                return value
+        else:
+            locked = await self._raw_cache.add(lock_key, b'1', lock_exptime)
+            if not locked:
+                deadline = time.monotonic() + lock_timeout.total_seconds()
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+                    cached = await self.bget(key)
+                    if cached is not None:
+                        return self.decode(cached)
+                # The process holding the lock took too long, compute the value ourselves. The lock isn't ours, it
+                # must be left for its holder to release.
+
+        try:
+            start = time.monotonic()
+            value = await coro_factory()
+            delta = time.monotonic() - start
+
+            expires_at = time.time() + expire.total_seconds() if expire is not None else None
+            await self.bset_many({key: self.encode(value), xfetch_key: self.encode([delta, expires_at])}, expire=expire)
+        finally:
+            if locked:
+                await self._raw_cache.delete(lock_key)
 
-    async def delete(self, key: str) -> bool:
-        return await self.bdelete(key.encode())
+        return value
 
 
 class CacheCog(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
-        self.raw_cache: Optional[aiomcache.Client] = None
+        self.raw_cache: Optional[Backend] = None
         self.cache: Optional[Cache] = None
+        # The memcached servers as (host, port, weight), normalized from the config by config_check.
+        self.servers: List[Tuple[str, int, int]] = []
 
     async def config_check(self) -> dict:
         config: dict = self.bot._kasushi_config
@@ -69,25 +485,157 @@ class CacheCog(commands.Cog):
                 message="Cache isn't configured. Please set the `cache` in your config."
             )
 
-        cache_server = cache_config.get('server_ip')
-        if not cache_server:
+        backend = cache_config.setdefault('backend', 'memcached')
+        if backend not in ('memcached', 'memory'):
             raise InvalidConfigurationError(
-                message="Cache isn't configured. Please set the `server_ip` key in your cache config."
+                message="The `backend` key in your cache config must be `memcached` or `memory`."
             )
 
-        server_port = cache_config.setdefault('server_port', 11211)
+        servers = cache_config.get('servers')
+        if backend == 'memory':
+            cache_config.setdefault('max_bytes', 64 * 1024 * 1024)
+            cache_config.setdefault('max_item_size', 1024 * 1024)
+        elif servers:
+            normalized_servers = []
+            for server in servers:
+                if isinstance(server, str):
+                    host, _, port = server.partition(':')
+                    server = {'server_ip': host, 'server_port': int(port or 11211)}
+                elif not isinstance(server, dict) or not server.get('server_ip'):
+                    raise InvalidConfigurationError(
+                        message="Every entry in `servers` must be a `host:port` string, "
+                                "or a dict with at least a `server_ip` key."
+                    )
+                normalized_servers.append((server['server_ip'], server.get('server_port', 11211),
+                                           server.get('weight', 1)))
+            self.servers = normalized_servers
+        else:
+            cache_server = cache_config.get('server_ip')
+            if not cache_server:
+                raise InvalidConfigurationError(
+                    message="Cache isn't configured. Please set the `server_ip` key in your cache config."
+                )
+
+            server_port = cache_config.setdefault('server_port', 11211)
+            self.servers = [(cache_server, server_port, 1)]
+
+        near_cache_config = cache_config.setdefault('near_cache', None)
+        if near_cache_config is not None and not isinstance(near_cache_config, dict):
+            raise InvalidConfigurationError(
+                message="The `near_cache` key in your cache config must be a dict of settings, or None."
+            )
+
+        metrics_config = cache_config.setdefault('metrics', None)
+        if metrics_config is not None and not isinstance(metrics_config, dict):
+            raise InvalidConfigurationError(
+                message="The `metrics` key in your cache config must be a dict of settings, or None."
+            )
+
+        write_behind_config = cache_config.setdefault('write_behind', None)
+        if write_behind_config is not None and not isinstance(write_behind_config, dict):
+            raise InvalidConfigurationError(
+                message="The `write_behind` key in your cache config must be a dict of settings, or None."
+            )
+
+        warm_start_config = cache_config.setdefault('warm_start', None)
+        if warm_start_config is not None and (not isinstance(warm_start_config, dict)
+                                              or not warm_start_config.get('path')):
+            raise InvalidConfigurationError(
+                message="The `warm_start` key in your cache config must be a dict with at least a `path` key, or None."
+            )
+        elif warm_start_config is not None and near_cache_config is None:
+            raise InvalidConfigurationError(
+                message="The `warm_start` key in your cache config needs a `near_cache` to fill."
+            )
+
+        cache_config.setdefault('chunk_size', chunks.DEFAULT_CHUNK_SIZE)
+        cache_config.setdefault('codecs', ['pickle'])
+        cache_config.setdefault('compression', None)
+        cache_config.setdefault('compression_threshold', 1024)
 
         return config
 
+    def make_serializer(self, cache_config: dict) -> Serializer:
+        return Serializer(
+            cache_config['codecs'],
+            compression=cache_config['compression'],
+            compression_threshold=cache_config['compression_threshold'],
+        )
+
+    def make_metrics(self, metrics_config: Optional[dict]) -> Optional[CacheMetrics]:
+        if metrics_config is None:
+            return None
+
+        return CacheMetrics(
+            sample_rate=metrics_config.get('sample_rate', 0.1),
+            separator=metrics_config.get('separator', ':'),
+            max_prefixes=metrics_config.get('max_prefixes', 100),
+        )
+
+    def make_near_cache(self, near_cache_config: Optional[dict]) -> Optional[NearCache]:
+        if near_cache_config is None:
+            return None
+
+        return NearCache(
+            max_size=near_cache_config.get('max_size', 1024),
+            max_bytes=near_cache_config.get('max_bytes', 16 * 1024 * 1024),
+            ttl=timedelta(seconds=near_cache_config.get('ttl', 30)),
+        )
+
+    def make_write_behind(self, cache: Cache, write_behind_config: Optional[dict]) -> Optional[WriteBehindBuffer]:
+        if write_behind_config is None:
+            return None
+
+        return WriteBehindBuffer(
+            cache,
+            interval=timedelta(seconds=write_behind_config.get('interval', 1)),
+            max_pending=write_behind_config.get('max_pending', 1000),
+        )
+
+    def make_warm_start(self, cache: Cache, warm_start_config: Optional[dict]) -> Optional[WarmStart]:
+        if warm_start_config is None:
+            return None
+
+        return WarmStart(
+            cache,
+            warm_start_config['path'],
+            max_keys=warm_start_config.get('max_keys', 1000),
+            max_age=timedelta(seconds=warm_start_config.get('max_age', 600)),
+        )
+
+    def make_backend(self, cache_config: dict) -> Backend:
+        if cache_config['backend'] == 'memory':
+            return MemoryBackend(max_bytes=cache_config['max_bytes'], max_item_size=cache_config['max_item_size'])
+
+        if len(self.servers) == 1:
+            host, port, _ = self.servers[0]
+            return MemcachedClient(host, port)
+
+        return ShardedClient(self.servers)
+
     async def cog_load(self) -> None:
         config = await self.config_check()
-        mc = aiomcache.Client(config["cache"]["server_ip"], config["cache"]["server_port"])
+        mc = self.make_backend(config["cache"])
         self.raw_cache = mc
-        self.cache = Cache(self.bot, mc)
+        self.cache = Cache(self.bot, mc,
+                           near_cache=self.make_near_cache(config["cache"]["near_cache"]),
+                           serializer=self.make_serializer(config["cache"]),
+                           metrics=self.make_metrics(config["cache"]["metrics"]),
+                           chunk_size=config["cache"]["chunk_size"])
+        self.cache.write_behind = self.make_write_behind(self.cache, config["cache"]["write_behind"])
+        self.cache.warm_start = self.make_warm_start(self.cache, config["cache"]["warm_start"])
         self.bot.cache = self.cache
 
+        if self.cache.warm_start is not None:
+            await self.cache.warm_start.load()
+
     async def cog_unload(self) -> None:
-        pass
+        if self.cache is not None and self.cache.warm_start is not None:
+            await self.cache.warm_start.save()
+        if self.cache is not None and self.cache.write_behind is not None:
+            await self.cache.write_behind.close()
+        if self.raw_cache is not None:
+            await self.raw_cache.close()
 
 
 async def async_setup(bot: commands.Bot):
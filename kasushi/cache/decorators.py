@@ -0,0 +1,225 @@
+import datetime
+import functools
+import hashlib
+import inspect
+import time
+from datetime import timedelta
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union, TYPE_CHECKING
+
+from kasushi.exceptions import InvalidConfigurationError
+from .codecs import Serializer
+from .near import NearCache
+
+if TYPE_CHECKING:
+    from .cog import Cache
+
+IGNORED_ARGUMENTS = ('self', 'cls', 'ctx', 'interaction')
+
+# Types whose repr only depends on their value, and is the same in every process.
+_STABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, Decimal, Enum,
+                 datetime.date, datetime.time, datetime.timedelta)
+
+
+def _stable_repr(value: Any) -> str:
+    """
+    Represent an argument in a cache key. Raises TypeError for values without a stable representation, like most
+    objects, whose default repr contains their memory address.
+    """
+    # Discord objects (guilds, members, channels...) are identified by their ID, not by their repr.
+    snowflake = getattr(value, 'id', None)
+    if isinstance(snowflake, int):
+        return f"{type(value).__name__}({snowflake})"
+    elif isinstance(value, _STABLE_TYPES):
+        return repr(value)
+    elif isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}({','.join(_stable_repr(item) for item in value)})"
+    elif isinstance(value, (set, frozenset)):
+        return f"{type(value).__name__}({','.join(sorted(_stable_repr(item) for item in value))})"
+    elif isinstance(value, dict):
+        items = sorted(f"{_stable_repr(key)}:{_stable_repr(item)}" for key, item in value.items())
+        return f"dict({','.join(items)})"
+    raise TypeError(f"{type(value).__name__} has no stable representation to build a cache key from")
+
+
+def _find_cache(args: Tuple) -> 'Cache':
+    """
+    Find `bot.cache` from the arguments of a cog method, a command, or a function taking the bot.
+    """
+    for arg in args:
+        for candidate in (arg, getattr(arg, 'bot', None), getattr(arg, 'client', None)):
+            cache = getattr(candidate, 'cache', None)
+            if cache is not None and hasattr(cache, 'bget'):
+                return cache
+
+    raise InvalidConfigurationError(
+        "Can't find the cache from the arguments of this function. Pass `cache=` to the cached decorator."
+    )
+
+
+class CachedFunction:
+    """
+    The state behind a function decorated with `cached`: it calls through to the function on a miss, and has helpers
+    to compute keys, invalidate them, and see how often the cache was used.
+    """
+
+    def __init__(self, func: Callable[..., Awaitable[Any]], expire: Optional[timedelta], key: Optional[Callable],
+                 prefix: Optional[str], tier: str, negative: Union[bool, timedelta],
+                 cache: Optional[Union['Cache', Callable[[], 'Cache']]], max_size: int):
+        if tier not in ('local', 'remote'):
+            raise InvalidConfigurationError(f"Unknown cache tier {tier}, must be `local` or `remote`.")
+
+        self.func = func
+        self.expire = expire
+        self.key_function = key
+        self.prefix = prefix or f"{func.__module__}.{func.__qualname__}".replace(' ', '_')
+        self.tier = tier
+        self.cache = cache
+        self._signature = inspect.signature(func)
+
+        if negative is True:
+            self.negative_expire = expire
+        elif negative is False:
+            self.negative_expire = None
+        else:
+            self.negative_expire = negative
+        self.negative = negative is not False
+
+        if tier == 'local':
+            self.local_cache = NearCache(max_size=max_size, ttl=expire or timedelta.max)
+            self.local_serializer = Serializer()
+        else:
+            self.local_cache = None
+
+        self.hits = 0
+        self.misses = 0
+        self._compute_time = 0.0
+
+    def key_for(self, *args, **kwargs) -> str:
+        """
+        Get the cache key used for these arguments.
+        """
+        if self.key_function is not None:
+            return f"{self.prefix}:{self.key_function(*args, **kwargs)}"
+
+        bound = self._signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        parts = []
+        for name, value in bound.arguments.items():
+            if name in IGNORED_ARGUMENTS:
+                continue
+            try:
+                parts.append(f"{name}={_stable_repr(value)}")
+            except TypeError as e:
+                raise TypeError(f"Can't build a cache key for {self.prefix} from its `{name}` argument: {e}. "
+                                f"Pass `key=` to the cached decorator to build keys yourself.") from None
+
+        parts = ','.join(parts)
+        return f"{self.prefix}:{hashlib.md5(parts.encode()).hexdigest()}"
+
+    def _get_cache(self, args: Tuple) -> 'Cache':
+        if self.cache is None:
+            return _find_cache(args)
+        elif callable(self.cache):
+            return self.cache()
+        return self.cache
+
+    async def _get(self, key: str, args: Tuple) -> Optional[Tuple[Any]]:
+        if self.local_cache is not None:
+            data = self.local_cache.get(key.encode())
+            return None if data is None else self.local_serializer.loads(data)
+        return await self._get_cache(args).get(key)
+
+    async def _set(self, key: str, value: Any, args: Tuple) -> None:
+        expire = self.negative_expire if value is None else self.expire
+        if self.local_cache is not None:
+            self.local_cache.set(key.encode(), self.local_serializer.dumps((value,)),
+                                 expire=expire.total_seconds() if expire else None)
+        else:
+            await self._get_cache(args).set(key, (value,), expire=expire)
+
+    async def __call__(self, *args, **kwargs) -> Any:
+        key = self.key_for(*args, **kwargs)
+
+        # Values are wrapped in a tuple, so that a cached None can be told apart from a miss.
+        cached = await self._get(key, args)
+        if cached is not None:
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
+        start = time.monotonic()
+        value = await self.func(*args, **kwargs)
+        self._compute_time += time.monotonic() - start
+
+        if value is not None or self.negative:
+            await self._set(key, value, args)
+
+        return value
+
+    async def invalidate(self, *args, **kwargs) -> bool:
+        """
+        Drop the cached value for these arguments, so that the next call recomputes it.
+
+        Returns True if a value was cached.
+        """
+        key = self.key_for(*args, **kwargs)
+        if self.local_cache is not None:
+            return self.local_cache.delete(key.encode())
+        return await self._get_cache(args).delete(key)
+
+    def invalidate_all(self) -> None:
+        """
+        Drop every cached value. Only available for the local tier, since memcached can't delete keys by prefix.
+        """
+        if self.local_cache is None:
+            raise InvalidConfigurationError("invalidate_all is only available for the local cache tier.")
+        self.local_cache.clear()
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        average = self._compute_time / self.misses if self.misses else 0.0
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'average_compute_time': average,
+            'saved_time': average * self.hits,
+        }
+
+
+def cached(expire: Optional[timedelta] = None, *, key: Optional[Callable[..., Any]] = None,
+           prefix: Optional[str] = None, tier: str = 'remote', negative: Union[bool, timedelta] = False,
+           cache: Optional[Union['Cache', Callable[[], 'Cache']]] = None,
+           max_size: int = 1024) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+    """
+    Memoize a coroutine function in the cache.
+
+    Keys are made of `prefix` (the function's qualified name by default) and a hash of the arguments, ignoring
+    `self`, `ctx` and similar. Arguments must be discord objects, or built-in values like numbers, strings and
+    containers of them: other objects raise TypeError, since their repr isn't stable. Pass `key` to build keys yourself:
+    it is called with the same arguments as the function.
+
+    The `remote` tier stores values in `bot.cache`, which is found from the arguments (a cog, a context, or the bot)
+    unless `cache` is given. The `local` tier keeps up to `max_size` values in this process only.
+
+    None results are only cached if `negative` is set, for `expire` if it's True, or for the given time.
+
+    The decorated function gets `invalidate(*args, **kwargs)`, `key_for(*args, **kwargs)`, `invalidate_all()` and
+    `cache_info()` attributes. They take the same arguments as the function, including `self` for cog methods.
+    """
+
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        state = CachedFunction(func, expire, key, prefix, tier, negative, cache, max_size)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await state(*args, **kwargs)
+
+        wrapper.invalidate = state.invalidate
+        wrapper.invalidate_all = state.invalidate_all
+        wrapper.key_for = state.key_for
+        wrapper.cache_info = lambda: state.stats
+        return wrapper
+
+    return decorator
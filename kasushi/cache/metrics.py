@@ -0,0 +1,175 @@
+import bisect
+import random
+from typing import Dict, List, Optional, Sequence
+
+# Upper bounds of the histogram buckets, the last bucket (+Inf) is implicit.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+COUNTERS = ('hits', 'near_hits', 'misses', 'sets', 'deletes')
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+
+        return {
+            'buckets': dict(zip([*self.buckets, float('inf')], cumulative)),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+def _escape(value: str) -> str:
+    """
+    Escape a label value for the Prometheus text format.
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class CacheMetrics:
+    """
+    Counts cache hits, misses, sets and deletes per key prefix, and errors per operation.
+
+    Latencies (per operation) and value sizes (per prefix) go into histograms. Only a `sample_rate` share of the
+    operations are added to the histograms, to keep the cost negligible on the hot path; counters are always exact.
+
+    The prefix of a key is the part before the first `separator`. Past `max_prefixes` distinct prefixes, new ones are
+    counted together as `other`.
+    """
+
+    def __init__(self, *, sample_rate: float = 0.1, separator: str = ':', max_prefixes: int = 100):
+        self.sample_rate = sample_rate
+        self.separator = separator.encode()
+        self.max_prefixes = max_prefixes
+
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.errors: Dict[str, int] = {}
+        self.latencies: Dict[str, Histogram] = {}
+        self.sizes: Dict[str, Histogram] = {}
+
+    def prefix(self, key: bytes) -> str:
+        prefix = key.split(self.separator, 1)[0].decode(errors='replace') if self.separator in key else '_'
+        if prefix not in self.counters and len(self.counters) >= self.max_prefixes:
+            return 'other'
+        return prefix
+
+    def _counters(self, prefix: str) -> Dict[str, int]:
+        counters = self.counters.get(prefix)
+        if counters is None:
+            counters = self.counters[prefix] = dict.fromkeys(COUNTERS, 0)
+        return counters
+
+    def _sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def _observe_size(self, prefix: str, size: int) -> None:
+        histogram = self.sizes.get(prefix)
+        if histogram is None:
+            histogram = self.sizes[prefix] = Histogram(SIZE_BUCKETS)
+        histogram.observe(size)
+
+    def observe_latency(self, operation: str, latency: float) -> None:
+        if not self._sampled():
+            return
+
+        histogram = self.latencies.get(operation)
+        if histogram is None:
+            histogram = self.latencies[operation] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(latency)
+
+    def record_error(self, operation: str) -> None:
+        self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def record_get(self, key: bytes, value: Optional[bytes], *, near: bool = False) -> None:
+        prefix = self.prefix(key)
+        counters = self._counters(prefix)
+        if value is None:
+            counters['misses'] += 1
+            return
+
+        counters['near_hits' if near else 'hits'] += 1
+        if self._sampled():
+            self._observe_size(prefix, len(value))
+
+    def record_set(self, key: bytes, value: bytes) -> None:
+        prefix = self.prefix(key)
+        self._counters(prefix)['sets'] += 1
+        if self._sampled():
+            self._observe_size(prefix, len(value))
+
+    def record_delete(self, key: bytes) -> None:
+        self._counters(self.prefix(key))['deletes'] += 1
+
+    def hit_ratio(self, prefix: str) -> Optional[float]:
+        counters = self.counters.get(prefix)
+        if not counters:
+            return None
+
+        hits = counters['hits'] + counters['near_hits']
+        total = hits + counters['misses']
+        return hits / total if total else None
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.errors.clear()
+        self.latencies.clear()
+        self.sizes.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Get all the metrics as a dict, for logging or for a dashboard.
+        """
+        return {
+            'prefixes': {
+                prefix: {**counters, 'hit_ratio': self.hit_ratio(prefix)} for prefix, counters in self.counters.items()
+            },
+            'errors': dict(self.errors),
+            'latency_seconds': {operation: h.snapshot() for operation, h in self.latencies.items()},
+            'value_bytes': {prefix: h.snapshot() for prefix, h in self.sizes.items()},
+            'sample_rate': self.sample_rate,
+        }
+
+    def render(self, namespace: str = 'kasushi_cache') -> str:
+        """
+        Get all the metrics in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+
+        for counter in COUNTERS:
+            lines.append(f'# TYPE {namespace}_{counter}_total counter')
+            for prefix, counters in self.counters.items():
+                lines.append(f'{namespace}_{counter}_total{{prefix="{_escape(prefix)}"}} {counters[counter]}')
+
+        lines.append(f'# TYPE {namespace}_errors_total counter')
+        for operation, count in self.errors.items():
+            lines.append(f'{namespace}_errors_total{{op="{_escape(operation)}"}} {count}')
+
+        for name, label, histograms in (('latency_seconds', 'op', self.latencies),
+                                        ('value_bytes', 'prefix', self.sizes)):
+            lines.append(f'# TYPE {namespace}_{name} histogram')
+            for value, histogram in histograms.items():
+                value = _escape(value)
+                snapshot = histogram.snapshot()
+                for bound, count in snapshot['buckets'].items():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{namespace}_{name}_bucket{{{label}="{value}",le="{le}"}} {count}')
+                lines.append(f'{namespace}_{name}_sum{{{label}="{value}"}} {snapshot["sum"]}')
+                lines.append(f'{namespace}_{name}_count{{{label}="{value}"}} {snapshot["count"]}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,96 @@
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, Mapping, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .cog import Cache
+
+Key = Union[str, bytes]
+
+
+class CacheNamespace:
+    """
+    A view of the cache where every key is prefixed by the namespace name and its current generation.
+
+    Invalidating the namespace increments the generation: every key set before becomes unreachable at once, and is
+    left to expire or to be evicted by memcached. The generation is kept locally for `generation_ttl`, so other
+    processes may read the previous generation for that long, unless the cache invalidation IPC handler is registered.
+    """
+
+    def __init__(self, cache: 'Cache', name: str, generation_ttl: timedelta = timedelta(seconds=5)):
+        self.cache = cache
+        self.name = name
+        self.generation_ttl = generation_ttl.total_seconds()
+        self.generation_key = f"{name}:generation".encode()
+
+    async def generation(self) -> int:
+        cached = self.cache._generations.get(self.generation_key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        backend = self.cache._raw_cache
+        value = await backend.get(self.generation_key)
+        if value is None:
+            # Starting from the current time, rather than 0, means a generation key that was evicted can't bring back
+            # the keys of an older generation.
+            value = str(time.time_ns()).encode()
+            if not await backend.add(self.generation_key, value):
+                value = await backend.get(self.generation_key) or value
+
+        generation = int(value)
+        self.cache._generations[self.generation_key] = (generation, time.monotonic() + self.generation_ttl)
+        return generation
+
+    def _key(self, generation: int, key: Key) -> bytes:
+        if isinstance(key, str):
+            key = key.encode()
+        return b'%b:%d:%b' % (self.name.encode(), generation, key)
+
+    async def invalidate(self) -> None:
+        """
+        Drop every key of this namespace, with a single memcached incr.
+        """
+        backend = self.cache._raw_cache
+        generation = await backend.incr(self.generation_key)
+        if generation is None:
+            generation = time.time_ns()
+            if not await backend.add(self.generation_key, str(generation).encode()):
+                generation = await backend.incr(self.generation_key)
+
+        self.cache._generations[self.generation_key] = (generation, time.monotonic() + self.generation_ttl)
+        await self.cache.publish_invalidation([self.generation_key])
+
+    async def get(self, key: Key, *, default: Any = None) -> Any:
+        return await self.cache.get(self._key(await self.generation(), key), default=default)
+
+    async def set(self, key: Key, value: Any, *, expire: Optional[timedelta] = None) -> bool:
+        return await self.cache.set(self._key(await self.generation(), key), value, expire=expire)
+
+    async def delete(self, key: Key) -> bool:
+        return await self.cache.delete(self._key(await self.generation(), key))
+
+    async def get_many(self, keys: Iterable[Key], *, default: Any = None,
+                       defaults: Optional[Mapping[Key, Any]] = None) -> Dict[Key, Any]:
+        generation = await self.generation()
+        keys = {self._key(generation, key): key for key in keys}
+        defaults = {self._key(generation, key): value for key, value in (defaults or {}).items()}
+        results = await self.cache.get_many(keys.keys(), default=default, defaults=defaults)
+        return {keys[key]: value for key, value in results.items()}
+
+    async def set_many(self, items: Mapping[Key, Any], *, expire: Optional[timedelta] = None,
+                       expires: Optional[Mapping[Key, timedelta]] = None) -> Dict[Key, bool]:
+        generation = await self.generation()
+        keys = {self._key(generation, key): key for key in items.keys()}
+        expires = {self._key(generation, key): value for key, value in (expires or {}).items()}
+        results = await self.cache.set_many({self._key(generation, key): value for key, value in items.items()},
+                                            expire=expire, expires=expires)
+        return {keys[key]: value for key, value in results.items()}
+
+    async def delete_many(self, keys: Iterable[Key]) -> Dict[Key, bool]:
+        generation = await self.generation()
+        keys = {self._key(generation, key): key for key in keys}
+        results = await self.cache.delete_many(keys.keys())
+        return {keys[key]: value for key, value in results.items()}
+
+    async def get_or_set(self, key: Key, coro_factory: Callable[[], Awaitable[Any]], **kwargs) -> Any:
+        return await self.cache.get_or_set(self._key(await self.generation(), key), coro_factory, **kwargs)
@@ -0,0 +1,119 @@
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class NearCache:
+    """
+    A bounded in-process LRU cache, layered in front of memcached.
+
+    Values are stored as the raw bytes memcached would return, so every hit still goes through `Cache.decode` and
+    callers never share mutable objects. Entries expire after `ttl`, and the least recently used entries are evicted
+    once either `max_size` entries or `max_bytes` bytes of values are held.
+    """
+
+    def __init__(self, *, max_size: int = 1024, max_bytes: int = 16 * 1024 * 1024,
+                 ttl: timedelta = timedelta(seconds=30)):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl.total_seconds()
+
+        self._entries: 'OrderedDict[bytes, Tuple[bytes, float]]' = OrderedDict()
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: bytes) -> bool:
+        return self.get(key, count=False) is not None
+
+    def get(self, key: bytes, *, count: bool = True) -> Optional[bytes]:
+        """
+        Get a value from the near cache, or None if it isn't there or has expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            if count:
+                self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key: bytes, value: bytes, *, expire: Optional[float] = None) -> None:
+        """
+        Store a value in the near cache. `expire` is the memcached expiration in seconds, if any: entries never outlive
+        their memcached counterpart.
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            # Would evict everything else and still not fit.
+            self._remove(key)
+            return
+
+        ttl = self.ttl
+        if expire:
+            ttl = min(ttl, expire)
+
+        self._remove(key)
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self.current_bytes += size
+
+        while len(self._entries) > self.max_size or self.current_bytes > self.max_bytes:
+            old_key, (old_value, _) = self._entries.popitem(last=False)
+            self.current_bytes -= len(old_value)
+            self.evictions += 1
+
+    def delete(self, key: bytes) -> bool:
+        """
+        Remove a key from the near cache.
+
+        Returns True if the key was present, False otherwise.
+        """
+        return self._remove(key)
+
+    def invalidate(self, keys: Iterable[bytes]) -> None:
+        """
+        Drop keys that were changed by another process.
+        """
+        for key in keys:
+            if self._remove(key):
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def _remove(self, key: bytes) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+
+        self.current_bytes -= len(entry[0])
+        return True
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': len(self._entries),
+            'bytes': self.current_bytes,
+        }
@@ -0,0 +1,208 @@
+import asyncio
+import math
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .cog import Cache
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # Seconds to wait before trying again, 0 if the request was allowed.
+
+
+class SlidingWindow:
+    """
+    Allows at most `limit` hits per `window` for each key, across every process sharing the cache.
+
+    Hits are counted with an atomic memcached `incr` on the current fixed window, and the count of the previous window
+    is weighted by how much of it still overlaps the sliding window. Closed windows never change, so their count is
+    kept locally and a check costs a single round-trip. Denied hits are given back, and don't count against the limit.
+    """
+
+    def __init__(self, cache: 'Cache', name: str, limit: int, window: timedelta):
+        if limit <= 0:
+            raise ValueError(f"The limit of a sliding window must be positive, not {limit}")
+        elif window.total_seconds() <= 0:
+            raise ValueError(f"The window of a sliding window must be positive, not {window}")
+
+        self.cache = cache
+        self.name = name
+        self.limit = limit
+        self.window = window.total_seconds()
+        self._exptime = int(self.window * 2) + 1
+        self._previous_counts: Dict[bytes, Tuple[int, int]] = {}
+
+    def _key(self, key: str, index: int) -> bytes:
+        return f"{self.name}:{key}:{index}".encode()
+
+    def _cached_previous(self, key: str, index: int) -> Optional[int]:
+        cached = self._previous_counts.get(self._key(key, index - 1))
+        return None if cached is None else cached[1]
+
+    def _remember_previous(self, key: str, index: int, count: int) -> None:
+        if len(self._previous_counts) > 10000:
+            # Drop the windows that are too old to ever be read again.
+            self._previous_counts = {k: v for k, v in self._previous_counts.items() if v[0] >= index - 1}
+        self._previous_counts[self._key(key, index - 1)] = (index - 1, count)
+
+    def _result(self, count: int, previous: int, elapsed: float, cost: int) -> RateLimitResult:
+        estimate = previous * (1 - elapsed) + count
+        if estimate <= self.limit:
+            return RateLimitResult(True, int(self.limit - estimate), 0.0)
+
+        # Wait for the previous window to slide out enough, or for the next window if that's not enough.
+        excess = estimate - self.limit
+        if previous and excess <= previous * (1 - elapsed):
+            retry_after = excess / previous * self.window
+        else:
+            retry_after = (1 - elapsed) * self.window
+        return RateLimitResult(False, max(0, int(self.limit - (estimate - cost))), retry_after)
+
+    async def hit(self, key: str, cost: int = 1) -> RateLimitResult:
+        """
+        Count a hit for `key`, and tell if it's allowed.
+        """
+        return (await self.hit_many([key], cost))[key]
+
+    async def hit_many(self, keys: Iterable[str], cost: int = 1) -> Dict[str, RateLimitResult]:
+        """
+        Count a hit for every key at once, with pipelined memcached commands.
+        """
+        backend = self.cache._raw_cache
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        index = int(now // self.window)
+        elapsed = (now % self.window) / self.window
+
+        current_keys = [self._key(key, index) for key in keys]
+        counts = await backend.multi_incr((current_key, cost) for current_key in current_keys)
+
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            added = await asyncio.gather(*(backend.add(current_keys[i], str(cost).encode(), self._exptime)
+                                           for i in missing))
+            lost_race = [i for i, was_added in zip(missing, added) if not was_added]
+            for i in missing:
+                counts[i] = cost
+            if lost_race:
+                for i, count in zip(lost_race, await backend.multi_incr((current_keys[i], cost) for i in lost_race)):
+                    counts[i] = count if count is not None else cost
+
+        previous_counts: List[Optional[int]] = [self._cached_previous(key, index) for key in keys]
+        unknown = [i for i, count in enumerate(previous_counts) if count is None]
+        if unknown:
+            values = await backend.multi_get(*(self._key(keys[i], index - 1) for i in unknown))
+            for i, value in zip(unknown, values):
+                previous_counts[i] = int(value) if value is not None else 0
+                self._remember_previous(keys[i], index, previous_counts[i])
+
+        results = {}
+        denied = []
+        for i, key in enumerate(keys):
+            results[key] = self._result(counts[i], previous_counts[i], elapsed, cost)
+            if not results[key].allowed:
+                denied.append(current_keys[i])
+
+        if denied:
+            await asyncio.gather(*(backend.decr(current_key, cost) for current_key in denied))
+
+        return results
+
+    async def reset(self, key: str) -> None:
+        index = int(time.time() // self.window)
+        self._previous_counts.pop(self._key(key, index - 1), None)
+        await self.cache._raw_cache.multi_delete(self._key(key, index), self._key(key, index - 1))
+
+
+class TokenBucket:
+    """
+    A bucket of `capacity` tokens per key, refilled at `rate` tokens per second, shared by every process using the
+    cache. Requests take tokens from the bucket, and are denied when it doesn't hold enough of them.
+
+    The bucket is stored as a single memcached item, updated with a `gets`/`cas` pair, so concurrent consumers never
+    take the same tokens: the loser of a race retries with the fresh value.
+    """
+
+    def __init__(self, cache: 'Cache', name: str, capacity: int, rate: float, *, max_retries: int = 10):
+        if capacity <= 0:
+            raise ValueError(f"The capacity of a token bucket must be positive, not {capacity}")
+        elif rate <= 0:
+            raise ValueError(f"The refill rate of a token bucket must be positive, not {rate}")
+
+        self.cache = cache
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self.max_retries = max_retries
+        # Once a bucket is full again, it doesn't need to be stored anymore.
+        self._exptime = math.ceil(capacity / rate) + 1
+
+    def _key(self, key: str) -> bytes:
+        return f"{self.name}:{key}".encode()
+
+    @staticmethod
+    def _encode(tokens: float, timestamp: float) -> bytes:
+        return f"{tokens:.6f}:{timestamp:.6f}".encode()
+
+    @staticmethod
+    def _decode(value: bytes) -> Tuple[float, float]:
+        tokens, timestamp = value.split(b':')
+        return float(tokens), float(timestamp)
+
+    def _denied(self, tokens: float, cost: int) -> RateLimitResult:
+        retry_after = (cost - tokens) / self.rate if cost <= self.capacity else math.inf
+        return RateLimitResult(False, int(tokens), retry_after)
+
+    async def consume(self, key: str, cost: int = 1) -> RateLimitResult:
+        """
+        Take `cost` tokens from the bucket of `key`, if it holds enough of them.
+        """
+        return (await self.consume_many([key], cost))[key]
+
+    async def consume_many(self, keys: Iterable[str], cost: int = 1) -> Dict[str, RateLimitResult]:
+        """
+        Take `cost` tokens from the bucket of each key. Every attempt reads all the pending buckets with one `gets`
+        and writes them back with one pipelined batch of `cas`, only the buckets that lost a race are retried.
+        """
+        backend = self.cache._raw_cache
+        keys = list(dict.fromkeys(keys))
+        pending = {self._key(key): key for key in keys}
+        results: Dict[str, RateLimitResult] = {}
+
+        for _ in range(self.max_retries):
+            if not pending:
+                break
+
+            bucket_keys = list(pending)
+            now = time.time()
+            writes = []
+            allowed = []
+            for bucket_key, (value, cas_token) in zip(bucket_keys, await backend.multi_gets(*bucket_keys)):
+                if value is None:
+                    tokens = float(self.capacity)
+                else:
+                    tokens, timestamp = self._decode(value)
+                    tokens = min(float(self.capacity), tokens + max(0.0, now - timestamp) * self.rate)
+
+                if tokens < cost:
+                    results[pending.pop(bucket_key)] = self._denied(tokens, cost)
+                    continue
+
+                writes.append((bucket_key, self._encode(tokens - cost, now), cas_token, self._exptime))
+                allowed.append(RateLimitResult(True, int(tokens - cost), 0.0))
+
+            for (bucket_key, _, _, _), result, stored in zip(writes, allowed, await backend.multi_cas(writes)):
+                if stored:
+                    results[pending.pop(bucket_key)] = result
+
+        # Too much contention on these buckets, fail closed.
+        for key in pending.values():
+            results[key] = RateLimitResult(False, 0, 1 / self.rate)
+        return {key: results[key] for key in keys}
+
+    async def reset(self, key: str) -> None:
+        await self.cache._raw_cache.delete(self._key(key))
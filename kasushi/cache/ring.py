@@ -0,0 +1,57 @@
+import bisect
+import hashlib
+from typing import Dict, Hashable, List, Tuple
+
+
+class HashRing:
+    """
+    A ketama-style consistent hash ring.
+
+    Every node is placed on the ring at a number of points proportional to its weight, and a key belongs to the first
+    node found clockwise from the key's own hash. Adding or removing a node therefore only moves the keys that land
+    between its points and their predecessors, about 1/N of them.
+    """
+    POINTS_PER_SERVER = 160
+
+    def __init__(self, nodes: Dict[Hashable, int]):
+        """
+        `nodes` maps each node name to its weight.
+        """
+        self.nodes = dict(nodes)
+        self._hashes: List[int] = []
+        self._owners: List[Hashable] = []
+        self._build()
+
+    def _build(self) -> None:
+        total_weight = sum(self.nodes.values())
+        points: List[Tuple[int, Hashable]] = []
+
+        for node, weight in self.nodes.items():
+            # Each md5 digest gives 4 points on the ring, like libketama does.
+            factor = (self.POINTS_PER_SERVER // 4) * len(self.nodes) * weight // total_weight
+            for i in range(factor):
+                digest = hashlib.md5(f"{node}-{i}".encode()).digest()
+                for j in range(4):
+                    points.append((int.from_bytes(digest[j * 4:j * 4 + 4], 'little'), node))
+
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: bytes) -> int:
+        return int.from_bytes(hashlib.md5(key).digest()[:4], 'little')
+
+    def get_node(self, key: bytes) -> Hashable:
+        index = bisect.bisect(self._hashes, self.hash(key))
+        if index == len(self._hashes):
+            index = 0
+        return self._owners[index]
+
+    def add_node(self, node: Hashable, weight: int = 1) -> None:
+        self.nodes[node] = weight
+        self._build()
+
+    def remove_node(self, node: Hashable) -> None:
+        del self.nodes[node]
+        self._build()
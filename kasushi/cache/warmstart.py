@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import logging
+import os
+import struct
+import time
+import zlib
+from datetime import timedelta
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .cog import Cache
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'KSWS'
+# Version 1 snapshots also held the values, they are ignored.
+SNAPSHOT_VERSION = 2
+_HEADER_STRUCT = struct.Struct('>4sBdI')  # magic, version, saved at, key count
+_KEY_STRUCT = struct.Struct('>H')  # key length
+
+
+def write_snapshot(path: str, keys: List[bytes], saved_at: float) -> None:
+    """
+    Write the keys to a zlib-compressed snapshot file. The file is replaced atomically, so a crash while writing it
+    never leaves a truncated snapshot behind.
+    """
+    body = b''.join(_KEY_STRUCT.pack(len(key)) + key for key in keys)
+    data = _HEADER_STRUCT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, saved_at, len(keys)) + zlib.compress(body)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as f:
+        f.write(data)
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path: str) -> Tuple[float, List[bytes]]:
+    """
+    Read a snapshot file, returning the time it was saved at, and its keys.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, version, saved_at, count = _HEADER_STRUCT.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} isn't a cache snapshot, or was written by another version")
+
+    body = zlib.decompress(data[_HEADER_STRUCT.size:])
+    keys = []
+    offset = 0
+    for _ in range(count):
+        key_length, = _KEY_STRUCT.unpack_from(body, offset)
+        offset += _KEY_STRUCT.size
+        keys.append(body[offset:offset + key_length])
+        offset += key_length
+
+    return saved_at, keys
+
+
+class WarmStart:
+    """
+    Counts how often every key is read, and keeps the `max_keys` hottest ones in a snapshot file across restarts.
+
+    Only the keys are saved. When loading, their current values are fetched from memcached with a single multi-get, to
+    fill the near cache of this process, so a value changed or deleted in the meantime is never brought back. Snapshots
+    older than `max_age` are ignored.
+
+    Counts are halved whenever the table grows past a few times `max_keys`, so keys that stopped being read fade out.
+    """
+
+    def __init__(self, cache: 'Cache', path: str, *, max_keys: int = 1000, max_age: timedelta = timedelta(minutes=10)):
+        self.cache = cache
+        self.path = path
+        self.max_keys = max_keys
+        self.max_age = max_age.total_seconds()
+
+        self.counts: Dict[bytes, int] = {}
+        # The reads made to load a snapshot aren't counted, they aren't made by the bot.
+        self._paused = False
+
+    def record(self, key: bytes) -> None:
+        if self._paused:
+            return
+
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if len(self.counts) > self.max_keys * 4:
+            hottest = heapq.nlargest(self.max_keys * 2, self.counts.items(), key=lambda item: item[1])
+            self.counts = {key: count // 2 for key, count in hottest if count > 1}
+
+    def hot_keys(self) -> List[bytes]:
+        return [key for key, _ in heapq.nlargest(self.max_keys, self.counts.items(), key=lambda item: item[1])]
+
+    async def save(self) -> int:
+        """
+        Write the hottest keys to the snapshot file, and return how many were written.
+        """
+        keys = self.hot_keys()
+        if not keys:
+            return 0
+
+        await asyncio.get_running_loop().run_in_executor(None, write_snapshot, self.path, keys, time.time())
+        return len(keys)
+
+    async def load(self) -> int:
+        """
+        Prefetch the keys of the snapshot file into the near cache, and return how many were found in memcached.
+        """
+        if self.cache.near_cache is None:
+            logger.warning("Not loading the cache snapshot %s, the near cache is disabled", self.path)
+            return 0
+
+        try:
+            saved_at, keys = await asyncio.get_running_loop().run_in_executor(None, read_snapshot, self.path)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, struct.error, zlib.error):
+            logger.warning("Ignoring the unreadable cache snapshot %s", self.path, exc_info=True)
+            return 0
+
+        if time.time() - saved_at > self.max_age or not keys:
+            return 0
+
+        self._paused = True
+        try:
+            found = await self.cache.bget_many(keys)
+        finally:
+            self._paused = False
+        return len(found)
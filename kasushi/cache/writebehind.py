@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .cog import Cache
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Delays `Cache.set` calls, keeping only the latest value of every key, and writes them to memcached in pipelined
+    batches every `interval`, or as soon as `max_pending` keys are waiting.
+
+    This process reads the buffered values immediately, other processes only see them after the next flush. It is
+    meant for keys written very often, like counters or "last seen" timestamps, where losing the last `interval` of
+    writes if the process crashes is acceptable.
+    """
+
+    def __init__(self, cache: 'Cache', *, interval: timedelta = timedelta(seconds=1), max_pending: int = 1000):
+        self.cache = cache
+        self.interval = interval.total_seconds()
+        self.max_pending = max_pending
+
+        self._pending: Dict[bytes, Tuple[bytes, int]] = {}
+        self._flushing: Dict[bytes, Tuple[bytes, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Created with the task, since asyncio primitives are bound to a loop before python 3.10.
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._closed = False
+
+        self.stats = {
+            'writes': 0,
+            'coalesced': 0,
+            'flushes': 0,
+            'flushed_keys': 0,
+            'errors': 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """
+        Get the value waiting to be written for a key, if any.
+        """
+        item = self._pending.get(key) or self._flushing.get(key)
+        return None if item is None else item[0]
+
+    def put(self, key: bytes, value: bytes, exptime: int) -> None:
+        if self._task is None:
+            self._start()
+
+        self.stats['writes'] += 1
+        if key in self._pending:
+            self.stats['coalesced'] += 1
+        self._pending[key] = (value, exptime)
+
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    async def discard(self, keys: Iterable[bytes]) -> None:
+        """
+        Forget the pending writes of these keys, because they are about to be written or deleted directly.
+
+        If one of them is being flushed, this waits for the flush to end, so that the direct write or delete lands after
+        the buffered value instead of being overwritten by it.
+        """
+        in_flush = False
+        for key in keys:
+            self._pending.pop(key, None)
+            if self._flushing.pop(key, None) is not None:
+                in_flush = True
+
+        if in_flush:
+            async with self._lock:
+                pass
+
+    async def flush(self) -> None:
+        """
+        Write every pending key now, in a single batch.
+        """
+        if self._lock is None or not self._pending:
+            return
+
+        async with self._lock:
+            self._flushing, self._pending = self._pending, {}
+            try:
+                # Keys discarded while the batch is written are removed from `_flushing`, so they aren't retried,
+                # and `discard` waits for the lock before they are written or deleted directly.
+                await self.cache._store_many({key: value for key, (value, _) in self._flushing.items()},
+                                             {key: exptime for key, (_, exptime) in self._flushing.items()})
+            except Exception:
+                logger.exception("Failed to flush %d pending cache writes, retrying later", len(self._flushing))
+                self.stats['errors'] += 1
+                for key, item in self._flushing.items():
+                    self._pending.setdefault(key, item)
+            else:
+                self.stats['flushes'] += 1
+                self.stats['flushed_keys'] += len(self._flushing)
+            finally:
+                self._flushing = {}
+
+    async def close(self) -> None:
+        """
+        Stop the background task, and write what's still pending.
+        """
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+        await self.flush()
@@ -48,3 +48,34 @@ class IPCInvalidHandlerError(KasushiError):
 
     def __str__(self):
         return self.message
+
+
+class IPCConnectionLostError(KasushiError):
+    """
+    Exception raised for requests that were waiting for a response when the IPC connection was lost.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class IPCStreamError(KasushiError):
+    """
+    Exception raised while iterating over a streamed IPC response, when the process sending it failed, or chunks were
+    lost.
+
+    Attributes:
+        message -- explanation of the error
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
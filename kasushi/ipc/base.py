@@ -1,8 +1,17 @@
+import asyncio
 import logging
-from typing import Union, Optional, TYPE_CHECKING
+from typing import Any, AsyncIterator, Dict, Hashable, Iterable, List, Union, Optional, TYPE_CHECKING
 
 from aiohttp.web_ws import WebSocketResponse
 
+from kasushi.exceptions import IPCConnectionLostError
+from .batching import make_writer
+from .codecs import CODECS, negotiate
+from .results import request_key
+from .routing import GuildSet, decode_ids, encode_ids
+from .rpc import min_timeout
+from .streams import merge
+
 if TYPE_CHECKING:
     from .client import IPCClient
     from .server import IPCServer, WSData
@@ -14,6 +23,16 @@ class Handler:
     server_reply = False
     name: str = None
     wait = True
+    # Seconds to wait for the response, the `request_timeout` of the IPC config if None.
+    request_timeout: Optional[float] = None
+    # Whether messages of this handler can wait a little to be batched with others, if batching is enabled.
+    batch = True
+    # Seconds the server reuses the result of a request for identical requests, see `ResultCache`. None dispatches
+    # every request, 0 only shares the result between identical requests dispatched at the same time.
+    result_ttl: Optional[float] = None
+    # Whether `send_request` returns an async iterator over the chunks of the response, see `IncomingStream`.
+    # `get_response` can then be an async generator.
+    stream = False
 
     def __init__(self, ipc: Union['IPCClient', 'IPCServer']):
         self.ipc = ipc
@@ -25,8 +44,10 @@ class Handler:
         self.ipc: 'IPCClient'
         data = {'handler': self.name, 'type': 'request', 'data': await self.get_request_data(*args, **kwargs)}
 
-        if self.wait:
-            return await self.finalize_response(await self.ipc.send_wait(data))
+        if self.stream:
+            return await self.ipc.send_stream(data, timeout=self.request_timeout)
+        elif self.wait:
+            return await self.finalize_response(await self.ipc.send_wait(data, timeout=self.request_timeout))
         else:
             await self.ipc.send(data)
 
@@ -38,34 +59,138 @@ class Handler:
         self.ipc: 'IPCServer'
         pass
 
+    async def server_response(self, sender_ws: 'WSData', data: dict) -> Any:
+        """
+        The response of a `server_reply` handler, needed to share it between identical requests when `result_ttl` is
+        set. It mustn't depend on the sender of the request.
+        """
+        raise NotImplementedError
+
+    def result_key(self, data: dict) -> Hashable:
+        """
+        The key of the request data in the server's result cache, identical requests must have the same key.
+        """
+        return request_key(data)
+
     async def get_response(self, data: dict) -> Optional[dict]:
         self.ipc: 'IPCClient'
         pass
 
 
+class MissingResponse:
+    """
+    Stands for the response of a process that didn't answer a broadcast: `reason` is `timeout` if it didn't answer in
+    time, `disconnected` if its connection was lost first, or `error` if the request couldn't be sent to it.
+    """
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __repr__(self):
+        return f'<MissingResponse reason={self.reason}>'
+
+
 class BroadcastHandler(Handler):
+    """
+    Sends the request to every process returned by `dispatch_to` concurrently, and answers with what
+    `aggregate_responses` makes of their responses. Override `targets` instead to send each process different data.
+
+    Each process has `target_timeout` seconds to answer, and the whole broadcast `timeout` seconds, or less if the
+    sender stops waiting earlier. Processes that didn't answer are given to `aggregate_responses` as a
+    `MissingResponse`, so one stalled process can't hang the broadcast.
+    """
     server_reply = True
+    target_timeout: Optional[float] = 5
+    timeout: Optional[float] = 10
 
     async def dispatch_to(self, sender_ws: 'WSData', data: dict):
         return self.ipc._active_ws
 
+    async def targets(self, sender_ws: 'WSData', data: dict) -> Dict['WSData', dict]:
+        """
+        The data of the request to send to each process.
+        """
+        return {ws: data for ws in await self.dispatch_to(sender_ws, data)}
+
     async def aggregate_responses(self, responses: dict):
         ...
 
+    async def merge_streams(self, streams: Dict['WSData', AsyncIterator]) -> AsyncIterator:
+        """
+        Combine the streamed responses of the processes, for `stream` handlers. By default, their chunks are sent as
+        they come, and the processes whose stream fails are left out.
+        """
+        targets = list(streams.keys())
+
+        def on_error(index: int, exception: BaseException):
+            logger.warning(f'[{targets[index]}] Streamed broadcast {self.name} failed: {exception!r}')
+
+        async for chunk in merge(list(streams.values()), on_error):
+            yield chunk
+
+    async def request_target(self, ws: 'WSData', data: dict, timeout: Optional[float]):
+        self.ipc: 'IPCServer'
+        bmsg = {'handler': self.name, 'type': 'request', 'data': data}
+        return (await self.ipc.send_wait(ws, bmsg, timeout=timeout))['data']
+
     async def server_dispatch(self, sender_ws: 'WSData', data: dict):
         self.ipc: 'IPCServer'
-        responses = {}
-        for ws in await self.dispatch_to(sender_ws, data['data']):
-            bmsg = {'handler': self.name, 'type': 'request', 'data': data['data']}
-            responses[ws] = (await self.ipc.send_wait(ws, bmsg))['data']
+        if data.get('stream'):
+            await self.stream_dispatch(sender_ws, data)
+            return
 
         ret = {'handler': data['handler'],
                'rtoken': data['rtoken'],
                'type': 'response',
-               'data': await self.aggregate_responses(responses)}
+               'data': await self.server_response(sender_ws, data)}
 
         await self.ipc.send(sender_ws, ret)
 
+    async def stream_dispatch(self, sender_ws: 'WSData', data: dict):
+        self.ipc: 'IPCServer'
+        streams = {}
+        for ws, target_data in (await self.targets(sender_ws, data['data'])).items():
+            request = {'handler': self.name, 'type': 'request', 'data': target_data}
+            streams[ws] = await self.ipc.send_stream(ws, request, timeout=self.target_timeout)
+
+        async def merged():
+            try:
+                async for chunk in self.merge_streams(streams):
+                    yield chunk
+            finally:
+                # Stops the processes still streaming, if the sender stopped reading.
+                for stream in streams.values():
+                    await stream.close()
+
+        await self.ipc.stream_to(sender_ws, data, merged())
+
+    async def server_response(self, sender_ws: 'WSData', data: dict):
+        self.ipc: 'IPCServer'
+        timeout = min_timeout(self.timeout, data.get('timeout'))
+        target_timeout = min_timeout(self.target_timeout, timeout)
+
+        tasks = {ws: asyncio.ensure_future(self.request_target(ws, target_data, target_timeout))
+                 for ws, target_data in (await self.targets(sender_ws, data['data'])).items()}
+        if tasks:
+            await asyncio.wait(tasks.values(), timeout=timeout)
+
+        responses: Dict['WSData', object] = {}
+        for ws, task in tasks.items():
+            if not task.done():
+                task.cancel()
+                responses[ws] = MissingResponse('timeout')
+            elif task.cancelled() or isinstance(task.exception(), asyncio.TimeoutError):
+                responses[ws] = MissingResponse('timeout')
+            elif isinstance(task.exception(), IPCConnectionLostError):
+                responses[ws] = MissingResponse('disconnected')
+            elif task.exception() is not None:
+                logger.warning(f'[{ws}] Broadcast {self.name} failed: {task.exception()!r}')
+                responses[ws] = MissingResponse('error')
+            else:
+                responses[ws] = task.result()
+
+        return await self.aggregate_responses(responses)
+
     async def get_response(self, data: dict) -> Optional[dict]:
         self.ipc: 'IPCClient'
         statuses = {}
@@ -77,6 +202,68 @@ class BroadcastHandler(Handler):
             }
 
 
+class ShardRoutedHandler(Handler):
+    """
+    Forwards the request to the process running the shard returned by `shard_id`, the `shard_id` of the request data
+    by default. If no process runs it, the server answers with `unrouted_response`.
+    """
+
+    def shard_id(self, data: dict) -> int:
+        return data['shard_id']
+
+    def route(self, data: dict) -> Optional['WSData']:
+        self.ipc: 'IPCServer'
+        return self.ipc.shard_to_ws_mapping.get(self.shard_id(data))
+
+    async def unrouted_response(self, data: dict) -> Any:
+        return {'success': False, 'message': 'No process runs this shard'}
+
+    async def server_dispatch(self, sender_ws: 'WSData', data: dict):
+        self.ipc: 'IPCServer'
+        target = self.route(data['data'])
+        if target is None:
+            await self.ipc.reply(sender_ws, data, await self.unrouted_response(data['data']))
+        else:
+            await self.ipc.send(target, data)
+
+
+class GuildRoutedHandler(ShardRoutedHandler):
+    """
+    Forwards the request to the process running the shard of the guild returned by `guild_id`, the `guild_id` of the
+    request data by default. The shard is computed from the guild ID, see `IPCServer.route_guild`.
+    """
+
+    def guild_id(self, data: dict) -> int:
+        return data['guild_id']
+
+    def route(self, data: dict) -> Optional['WSData']:
+        self.ipc: 'IPCServer'
+        return self.ipc.route_guild(self.guild_id(data))
+
+    async def unrouted_response(self, data: dict) -> Any:
+        return {'success': False, 'message': 'Guild not found'}
+
+
+class GuildMulticastHandler(BroadcastHandler):
+    """
+    Groups the guilds returned by `guild_ids` (the `guild_ids` of the request data by default) by the process running
+    them, and sends each of these processes a single request with the `guild_ids` it runs. Guilds no process runs are
+    left out. Processes without any of the guilds aren't asked anything.
+    """
+
+    def guild_ids(self, data: dict) -> List[int]:
+        return data['guild_ids']
+
+    async def targets(self, sender_ws: 'WSData', data: dict) -> Dict['WSData', dict]:
+        self.ipc: 'IPCServer'
+        groups: Dict['WSData', List[int]] = {}
+        for guild_id in self.guild_ids(data):
+            ws = self.ipc.route_guild(guild_id)
+            if ws is not None:
+                groups.setdefault(ws, []).append(guild_id)
+        return {ws: {**data, 'guild_ids': guild_ids} for ws, guild_ids in groups.items()}
+
+
 class LoginHandler(Handler):
     server_reply = True
     name = 'login'
@@ -84,15 +271,32 @@ class LoginHandler(Handler):
     async def finalize_response(self, raw_reponse: dict):
         self.ipc: 'IPCClient'
         if raw_reponse['success'] is True:
+            # Servers that don't know about codecs don't answer with one, and keep using text JSON.
+            self.ipc.codec = CODECS.get(raw_reponse.get('codec'))
+            self.ipc.compress = raw_reponse.get('compression') == 'zlib' and self.ipc.compression_threshold is not None
+            if raw_reponse.get('batching'):
+                self.ipc.writer = make_writer(self.ipc.ws, self.ipc.codec,
+                                              self.ipc.compression_threshold if self.ipc.compress else None,
+                                              self.ipc.batching)
             self.ipc.online.set()
+            # Sent after login, so topics subscribed to while logging in aren't missed.
+            self.ipc.sync_subscriptions()
+            asyncio.ensure_future(self.ipc.send_queued_publishes())
 
         return await super().finalize_response(raw_reponse)
 
     async def get_request_data(self):
         self.ipc: 'IPCClient'
+        # Changes made before this are already in the guilds sent, the ones made after are sent as deltas once online.
+        self.ipc.guilds = GuildSet(g.id for g in self.ipc.bot.guilds)
+
         return {"shared_secret": self.ipc.config['shared_secret'],
-                'guilds': [g.id for g in self.ipc.bot.guilds],
-                'shards': list(self.ipc.bot.shards.keys())}
+                'guild_ids': encode_ids(self.ipc.guilds.ids),
+                'shards': list(self.ipc.bot.shards.keys()),
+                'shard_count': getattr(self.ipc.bot, 'shard_count', None),
+                'codecs': self.ipc.codecs,
+                'compression': ['zlib'] if self.ipc.compression_threshold is not None else [],
+                'batching': True}
 
     async def server_dispatch(self, sender_ws: 'WSData', data: dict):
         self.ipc: 'IPCServer'
@@ -109,14 +313,18 @@ class LoginHandler(Handler):
     async def get_response(self, data: dict, sender_ws: 'WSData') -> Optional[dict]:
         self.ipc: 'IPCServer'  # Only in this case
         if data['data']['shared_secret'] == self.ipc.config['shared_secret']:
-            guilds = data['data']['guilds']
+            if 'guild_ids' in data['data']:
+                guilds = decode_ids(data['data']['guild_ids'])
+            else:
+                # Clients running an older version send a plain list.
+                guilds = data['data']['guilds']
             shards = data['data']['shards']
 
-            for guild_id in guilds:
-                self.ipc.guild_to_ws_mapping[guild_id] = sender_ws
+            self.ipc.set_guilds(sender_ws, guilds, version=0)
 
             for shard_id in shards:
                 self.ipc.shard_to_ws_mapping[shard_id] = sender_ws
+            self.ipc.shard_count = data['data'].get('shard_count') or self.ipc.shard_count
 
             sender_ws.logged_in = True
 
@@ -126,6 +334,103 @@ class LoginHandler(Handler):
                     logged_in_ws += 1
             sender_ws.remote_name = data['data'].get('name', 'Bot ' + str(logged_in_ws))
 
-            return {"success": True, 'message': 'You are now authenticated'}
+            # This response is still sent as text JSON, the codec is used from the next message on.
+            sender_ws.codec = negotiate(data['data'].get('codecs', []), self.ipc.codecs)
+            sender_ws.compress = ('zlib' in data['data'].get('compression', [])
+                                  and self.ipc.compression_threshold is not None)
+            if data['data'].get('batching'):
+                sender_ws.writer = make_writer(sender_ws.ws, sender_ws.codec,
+                                               self.ipc.compression_threshold if sender_ws.compress else None,
+                                               self.ipc.batching)
+
+            return {"success": True, 'message': 'You are now authenticated',
+                    'codec': sender_ws.codec.name if sender_ws.codec else None,
+                    'compression': 'zlib' if sender_ws.compress else None,
+                    'batching': True}
         else:
             return {"success": False, 'message': 'Invalid secret'}
+
+
+class GuildSyncHandler(Handler):
+    """
+    Keeps the guild routing of the server up to date with the guilds joined and left by a process after it logged in.
+
+    Changes are sent as deltas, with the version and checksum of the set of guilds of the process. When they don't
+    match what the server gets by applying the delta, a delta was lost or the sets diverged: the server asks for the
+    full set, and ignores the deltas until it gets it.
+    """
+    name = 'guild_sync'
+    wait = False
+
+    async def get_request_data(self, joined: Iterable[int] = (), left: Iterable[int] = (), full: bool = False):
+        self.ipc: 'IPCClient'
+        guilds = self.ipc.guilds
+        data = {'version': guilds.version, 'checksum': guilds.checksum}
+        if full:
+            data['guilds'] = encode_ids(guilds.ids)
+        else:
+            data['joined'] = encode_ids(joined)
+            data['left'] = encode_ids(left)
+        return data
+
+    async def server_dispatch(self, sender_ws: 'WSData', data: dict):
+        self.ipc: 'IPCServer'
+        data = data['data']
+        if 'guilds' in data:
+            self.ipc.set_guilds(sender_ws, decode_ids(data['guilds']), data['version'])
+            sender_ws.guilds_stale = False
+        elif sender_ws.guilds_stale:
+            return
+        elif data['version'] == sender_ws.guilds.version + 1:
+            added, removed = sender_ws.guilds.apply(decode_ids(data['joined']), decode_ids(data['left']))
+            self.ipc.route_guilds(sender_ws, added, removed)
+
+        if sender_ws.guilds.version != data['version'] or sender_ws.guilds.checksum != data['checksum']:
+            logger.warning(f'[{sender_ws}] Guild routing is out of date (version {sender_ws.guilds.version}, got '
+                           f'{data["version"]}), asking for a full sync')
+            sender_ws.guilds_stale = True
+            await self.ipc.send(sender_ws, {'handler': self.name, 'type': 'request', 'data': {'resync': True}})
+
+    async def get_response(self, data: dict) -> None:
+        self.ipc: 'IPCClient'
+        if data.get('resync'):
+            self.ipc.resync_guilds()
+
+
+class SubscribeHandler(Handler):
+    """
+    Tells the server every topic this process is subscribed to, see `IPCClient.subscribe`.
+    """
+    name = 'subscribe'
+    wait = False
+
+    async def get_request_data(self, topics: List[str]):
+        self.ipc: 'IPCClient'
+        return {'topics': topics}
+
+    async def server_dispatch(self, sender_ws: 'WSData', data: dict):
+        self.ipc: 'IPCServer'
+        self.ipc.set_subscriptions(sender_ws, data['data']['topics'])
+
+
+class PublishHandler(Handler):
+    """
+    Sends a published payload to the processes subscribed to its topic, see `IPCClient.publish`. Nothing is answered.
+    """
+    name = 'publish'
+    wait = False
+
+    async def get_request_data(self, topic: str, payload: Any):
+        self.ipc: 'IPCClient'
+        return {'topic': topic, 'payload': payload}
+
+    async def server_dispatch(self, sender_ws: 'WSData', data: dict):
+        self.ipc: 'IPCServer'
+        for wsd in list(self.ipc.subscriptions.get(data['data']['topic'], ())):
+            # The sender already delivered it to its own callbacks.
+            if wsd is not sender_ws:
+                await self.ipc.send(wsd, data)
+
+    async def get_response(self, data: dict) -> None:
+        self.ipc: 'IPCClient'
+        self.ipc.deliver(data['topic'], data['payload'])
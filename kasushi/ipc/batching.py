@@ -0,0 +1,82 @@
+import asyncio
+from typing import List, Optional
+
+from .codecs import WireCodec, encode_batch, encode_frame
+
+DEFAULT_BATCH_DELAY = 0.002
+DEFAULT_BATCH_MAX_BYTES = 64 * 1024
+
+
+class BatchWriter:
+    """
+    The outbound queue of a connection: messages sent within `delay` seconds of each other are written as a single
+    batched frame, so bursts of small messages cost one websocket frame (and one syscall) instead of one each.
+
+    The queue is written as soon as it holds `max_bytes`, or when a message is sent with `immediate=True`. Messages are
+    always written in the order they were sent.
+    """
+
+    def __init__(self, ws, codec: WireCodec, compression_threshold: Optional[int], *,
+                 delay: float = DEFAULT_BATCH_DELAY, max_bytes: int = DEFAULT_BATCH_MAX_BYTES):
+        self.ws = ws
+        self.codec = codec
+        self.compression_threshold = compression_threshold
+        self.delay = delay
+        self.max_bytes = max_bytes
+
+        self._frames: List[bytes] = []
+        self._size = 0
+        self._flush_task: Optional[asyncio.Future] = None
+
+        self.stats = {
+            'messages': 0,
+            'frames': 0,
+        }
+
+    async def send(self, data: dict, *, immediate: bool = False) -> None:
+        frame = encode_frame(data, self.codec)
+        self._frames.append(frame)
+        self._size += len(frame)
+        self.stats['messages'] += 1
+
+        if immediate or self._size >= self.max_bytes:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._frames:
+            return
+
+        frames, self._frames, self._size = self._frames, [], 0
+        self.stats['frames'] += 1
+        await self.ws.send_bytes(encode_batch(frames, self.compression_threshold))
+
+    async def close(self) -> None:
+        """
+        Write what's still queued, and stop the pending flush.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+
+def make_writer(ws, codec: Optional[WireCodec], compression_threshold: Optional[int],
+                batching_config: Optional[dict]) -> Optional[BatchWriter]:
+    """
+    Get a batch writer for a connection, or None if batching is disabled or the connection still uses text JSON.
+    """
+    if batching_config is None or codec is None:
+        return None
+
+    return BatchWriter(
+        ws, codec, compression_threshold,
+        delay=batching_config.get('delay', DEFAULT_BATCH_DELAY),
+        max_bytes=batching_config.get('max_bytes', DEFAULT_BATCH_MAX_BYTES),
+    )
@@ -1,22 +1,26 @@
 import asyncio
-import json
+import inspect
 import logging
 import random
-import uuid
-from typing import Dict, Type
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Type
 
 import aiohttp
 from discord.ext import commands
 
-from .base import Handler, LoginHandler
+from kasushi.exceptions import IPCConnectionLostError
+from .base import GuildSyncHandler, Handler, LoginHandler, PublishHandler, SubscribeHandler
+from .batching import BatchWriter
+from .codecs import DEFAULT_COMPRESSION_THRESHOLD, WireCodec, available_codecs, decode_messages, send_message
+from .members import MemberIndex
+from .routing import GuildSet
+from .rpc import DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUEST_TIMEOUT, PendingRequests
+from .streams import IncomingStream, OutgoingStream, collect, single
 
 logger = logging.getLogger(__name__)
 
-
-class WaitingEvent(asyncio.Event):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.response = None
+DEFAULT_COALESCE_DELAY = 0.05
+DEFAULT_MAX_QUEUED_PUBLISHES = 100
 
 
 class IPCClient:
@@ -26,14 +30,57 @@ class IPCClient:
         self.handlers: Dict[str, Handler] = {}
         self.bot = bot
         self.config = config
-        self._URL = config['client']['server_url'] + "/ws"
+        server_url: str = config['client']['server_url']
+        if server_url.startswith('unix:'):
+            # unix:/path/to/socket, the host in the URL is only used for the Host header.
+            self._unix_path = server_url[len('unix:'):]
+            self._URL = "http://localhost/ws"
+        else:
+            self._unix_path = None
+            self._URL = server_url + "/ws"
         self.online = asyncio.Event()
         self.closed = False
         self.ws = None
         self.session = None
-        self.waiting_events = {}
+
+        self.request_timeout: Optional[float] = config.get('request_timeout', DEFAULT_REQUEST_TIMEOUT)
+        self.pending = PendingRequests(config.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT))
+        # Streamed responses being received and sent, by rtoken.
+        self.streams_in: Dict[int, IncomingStream] = {}
+        self.streams_out: Dict[int, OutgoingStream] = {}
+
+        self.codecs = available_codecs(config.get('codecs'))
+        self.compression_threshold: Optional[int] = config.get('compression_threshold',
+                                                               DEFAULT_COMPRESSION_THRESHOLD)
+        # Negotiated at login, text JSON is used until then.
+        self.codec: Optional[WireCodec] = None
+        self.compress = False
+        # Also set up at login, if the server can read batches.
+        self.batching: Optional[dict] = config.get('batching')
+        self.writer: Optional[BatchWriter] = None
+
+        # The guilds the server routes to this process, set at login. Changes after that are sent by `sync_guilds`.
+        self.guilds: Optional[GuildSet] = None
+        self._guild_changes: Dict[int, bool] = {}
+        self._guilds_resync = False
+        self._guild_sync: Optional[asyncio.Future] = None
+
+        # With `member_index`, the guilds of every cached member, kept up to date by the IPC cog.
+        self.members: Optional[MemberIndex] = MemberIndex.from_guilds(bot.guilds) if config.get('member_index') else None
+
+        # The callbacks of the topics this process subscribed to, see `subscribe`.
+        self.subscriptions: Dict[str, List[Callable[[Any], Any]]] = {}
+        self.coalesce_delay: float = config.get('coalesce_delay', DEFAULT_COALESCE_DELAY)
+        self._coalesced: Dict[str, Any] = {}
+        self._coalesce_task: Optional[asyncio.Future] = None
+        # Published while not logged in to the server, sent once logged in. The oldest are dropped past the limit.
+        self._queued_publishes: Deque[Tuple[str, Any]] = deque(
+            maxlen=config.get('max_queued_publishes', DEFAULT_MAX_QUEUED_PUBLISHES))
 
         self.add_handler(LoginHandler)
+        self.add_handler(GuildSyncHandler)
+        self.add_handler(SubscribeHandler)
+        self.add_handler(PublishHandler)
 
         for handler in self.config['handlers']:
             self.add_handler(handler)
@@ -54,21 +101,213 @@ class IPCClient:
         rtoken = data.get('rtoken')
         handler = data.get('handler')
         if rtoken and type == 'response':
-            event = self.waiting_events.get(rtoken)
-            if event:
-                event.response = data['data']
-                event.set()
-            else:
-                pass
+            if not self.pending.resolve(rtoken, data['data']):
+                logger.debug(f"IPC Client got a response for {rtoken}, which isn't waited for anymore")
+            return
+        elif rtoken and type in ('chunk', 'end'):
+            stream = self.streams_in.get(rtoken)
+            if stream is not None:
+                stream.feed(data)
+            return
+        elif rtoken and type == 'credit':
+            outgoing = self.streams_out.get(rtoken)
+            if outgoing is not None:
+                outgoing.control(data)
+            return
+
+        # Requests are answered in the background, so that a slow handler doesn't delay the responses behind it.
+        asyncio.ensure_future(self.answer_request(handler, rtoken, data))
+
+    async def answer_request(self, handler: str, rtoken: Optional[int], data: dict):
+        response = self.handlers[handler].get_response(data['data'])
+        if data.get('stream'):
+            await self.stream_response(handler, rtoken, data, response)
+            return
+        elif inspect.isasyncgen(response):
+            # The sender can't receive a stream, it gets every chunk at once.
+            response = collect(response)
+
+        try:
+            # The sender won't wait past its own timeout, there's no point in answering after that.
+            res = await asyncio.wait_for(response, data.get('timeout'))
+        except asyncio.TimeoutError:
+            logger.debug(f"IPC Client gave up answering {handler} request {rtoken}, the sender stopped waiting")
             return
 
-        res = await self.handlers[handler].get_response(data['data'])
-        if res:
+        # Empty results are answered too, or a broadcast would wait for them until its timeout.
+        if res is not None:
             ret = {'data': res, 'handler': handler, 'rtoken': rtoken, 'type': 'response'}
             await self.send(ret)
 
+    def guild_joined(self, guild_id: int):
+        self._guild_changes[guild_id] = True
+        self._schedule_guild_sync()
+
+    def guild_left(self, guild_id: int):
+        self._guild_changes[guild_id] = False
+        self._schedule_guild_sync()
+
+    def resync_guilds(self):
+        self._guilds_resync = True
+        self._schedule_guild_sync()
+
+    def _schedule_guild_sync(self):
+        if self._guild_sync is None or self._guild_sync.done():
+            self._guild_sync = asyncio.ensure_future(self.sync_guilds())
+
+    async def sync_guilds(self):
+        """
+        Send the guild changes to the server, as a single delta for the changes made in the same event loop iteration.
+        """
+        await asyncio.sleep(0)
+        await self.online.wait()
+        self._guild_sync = None
+
+        changes, self._guild_changes = self._guild_changes, {}
+        full, self._guilds_resync = self._guilds_resync, False
+        joined = [guild_id for guild_id, present in changes.items() if present and guild_id not in self.guilds]
+        left = [guild_id for guild_id, present in changes.items() if not present and guild_id in self.guilds]
+        if not joined and not left and not full:
+            return
+
+        self.guilds.apply(joined, left)
+        try:
+            await self.handlers['guild_sync'].send_request(joined, left, full=full)
+        except ConnectionResetError:
+            # The next login sends every guild.
+            logger.debug("IPC Client couldn't send the guild changes, the connection is closing")
+
+    async def stream_response(self, handler: str, rtoken: int, data: dict, response):
+        if not inspect.isasyncgen(response):
+            response = single(await response)
+
+        outgoing = OutgoingStream(response, lambda message: self.send({**message, 'handler': handler, 'rtoken': rtoken}),
+                                  window=data['stream'], timeout=self.request_timeout)
+        self.streams_out[rtoken] = outgoing
+        try:
+            await outgoing.run()
+        finally:
+            self.streams_out.pop(rtoken, None)
+
+    async def send_stream(self, data, *, timeout: Optional[float] = None) -> IncomingStream:
+        """
+        Send a request, and return its streamed response. Each chunk is waited for at most `timeout` seconds,
+        `request_timeout` by default.
+        """
+        rtoken = self.pending.new_rtoken()
+        stream = IncomingStream(
+            lambda message: self.send({**message, 'type': 'credit', 'handler': data['handler'], 'rtoken': rtoken}),
+            timeout=timeout if timeout is not None else self.request_timeout,
+            on_close=lambda: self.streams_in.pop(rtoken, None))
+        self.streams_in[rtoken] = stream
+        await self.send({**data, 'rtoken': rtoken, 'stream': stream.window})
+        return stream
+
+    def fail_streams(self, exception: BaseException):
+        for stream in list(self.streams_in.values()):
+            stream.fail(exception)
+        for outgoing in self.streams_out.values():
+            outgoing.control({'cancel': True})
+
+    def subscribe(self, topic: str, callback: Callable[[Any], Any]):
+        """
+        Call `callback` with the payload of every message published to `topic`, by any process. The callback can be a
+        coroutine function.
+        """
+        callbacks = self.subscriptions.setdefault(topic, [])
+        callbacks.append(callback)
+        if len(callbacks) == 1:
+            self.sync_subscriptions()
+
+    def unsubscribe(self, topic: str, callback: Callable[[Any], Any]):
+        callbacks = self.subscriptions.get(topic)
+        if not callbacks or callback not in callbacks:
+            return
+
+        callbacks.remove(callback)
+        if not callbacks:
+            del self.subscriptions[topic]
+            self.sync_subscriptions()
+
+    def sync_subscriptions(self):
+        # Otherwise, they are sent once logged in.
+        if self.online.is_set():
+            asyncio.ensure_future(self.handlers['subscribe'].send_request(list(self.subscriptions.keys())))
+
+    async def publish(self, topic: str, payload: Any, *, coalesce: bool = False):
+        """
+        Send a payload to the processes subscribed to `topic`, this one included. Nothing is answered, and processes
+        that aren't subscribed don't receive anything.
+
+        With `coalesce`, the payload is sent after `coalesce_delay` seconds, and only if no other payload was published
+        to the topic with `coalesce` in the meantime, for notifications where only the last one matters.
+
+        This never waits for the server: while not logged in, payloads are queued and sent once logged in again, up to
+        `max_queued_publishes` of them.
+        """
+        if coalesce:
+            self._coalesced[topic] = payload
+            if self._coalesce_task is None:
+                self._coalesce_task = asyncio.ensure_future(self._publish_coalesced())
+            return
+
+        self.deliver(topic, payload)
+        await self._send_publish(topic, payload)
+
+    async def _send_publish(self, topic: str, payload: Any):
+        # Payloads published before are sent first, by `send_queued_publishes`.
+        if self.online.is_set() and not self._queued_publishes:
+            try:
+                await self.handlers['publish'].send_request(topic, payload)
+                return
+            except ConnectionError:
+                logger.debug(f"IPC Client lost the connection publishing to {topic}, queuing it")
+
+        if len(self._queued_publishes) == self._queued_publishes.maxlen:
+            dropped = self._queued_publishes[0][0] if self._queued_publishes else topic
+            logger.warning(f"IPC Client dropped a payload published to {dropped}, too many are waiting for the server")
+        self._queued_publishes.append((topic, payload))
+
+    async def send_queued_publishes(self):
+        """
+        Send what was published while not logged in, in order. Called once logged in.
+        """
+        while self._queued_publishes and self.online.is_set():
+            topic, payload = self._queued_publishes.popleft()
+            try:
+                await self.handlers['publish'].send_request(topic, payload)
+            except ConnectionError:
+                logger.debug("IPC Client lost the connection sending the queued publishes, retrying once logged in")
+                self._queued_publishes.appendleft((topic, payload))
+                return
+
+    async def _publish_coalesced(self):
+        await asyncio.sleep(self.coalesce_delay)
+        self._coalesce_task = None
+        coalesced, self._coalesced = self._coalesced, {}
+        for topic, payload in coalesced.items():
+            await self.publish(topic, payload)
+
+    def deliver(self, topic: str, payload: Any):
+        for callback in list(self.subscriptions.get(topic, ())):
+            try:
+                result = callback(payload)
+            except Exception:
+                logger.exception(f"IPC Client subscriber to {topic} failed")
+                continue
+
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(self._await_subscriber(topic, result))
+
+    async def _await_subscriber(self, topic: str, result):
+        try:
+            await result
+        except Exception:
+            logger.exception(f"IPC Client subscriber to {topic} failed")
+
     async def async_setup(self):
-        self.session = aiohttp.ClientSession()
+        connector = aiohttp.UnixConnector(path=self._unix_path) if self._unix_path else None
+        self.session = aiohttp.ClientSession(connector=connector)
         asyncio.create_task(self.background())
 
     async def background(self):
@@ -85,27 +324,41 @@ class IPCClient:
             async with self.session.ws_connect(self._URL) as ws:
                 logger.debug("IPC Client websocket connection established")
                 self.ws = ws
+                self.codec = None
+                self.compress = False
+                self.writer = None
                 asyncio.ensure_future(
                     self.handlers['login'].send_request())  # Don't use client.send_request, we are not online yet.
                 logger.debug("IPC Client login sent")
 
                 async for msg in self.ws:
                     logger.debug("IPC Client message recv'd: " + str(msg))
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        await self.handle_message(json.loads(msg.data))
+                    if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                        for data in decode_messages(msg):
+                            await self.handle_message(data)
                     elif msg.type in (aiohttp.WSMsgType.CLOSED,
                                       aiohttp.WSMsgType.ERROR):
                         break
             self.online.clear()
+            self.pending.fail_all(IPCConnectionLostError("The connection to the IPC server was lost"))
+            self.fail_streams(IPCConnectionLostError("The connection to the IPC server was lost"))
             logger.debug("IPC Client websocket closed")
             await asyncio.sleep(2)
 
     async def async_teardown(self):
         logger.debug("IPC Client closing")
         self.closed = True
-        self.online = False
+        self.online.clear()
+        if self._guild_sync is not None:
+            self._guild_sync.cancel()
+        if self._coalesce_task is not None:
+            self._coalesce_task.cancel()
+        self.pending.fail_all(IPCConnectionLostError("The IPC client is closing"))
+        self.fail_streams(IPCConnectionLostError("The IPC client is closing"))
 
         if self.ws:
+            if self.writer is not None:
+                await self.writer.close()
             logger.debug("IPC Client closing websocket connection")
             await self.ws.close()
             logger.debug("IPC Client websocket connection closed")
@@ -115,15 +368,16 @@ class IPCClient:
             await self.session.close()
             logger.debug("IPC Client session closed")
 
-    async def send_wait(self, data):
-        data['rtoken'] = uuid.uuid4().hex
-        event = WaitingEvent()
-        self.waiting_events[data['rtoken']] = event
-        await self.send(data)
-        await event.wait()
-        del self.waiting_events[data['rtoken']]
-
-        return event.response
+    async def send_wait(self, data, *, timeout: Optional[float] = None):
+        """
+        Send a request, and wait for its response for at most `timeout` seconds, `request_timeout` by default.
+        """
+        return await self.pending.call(data, self.send, timeout if timeout is not None else self.request_timeout)
 
     async def send(self, data):
-        await self.ws.send_json(data)
+        if self.writer is not None:
+            handler = self.handlers.get(data.get('handler'))
+            await self.writer.send(data, immediate=handler is not None and not handler.batch)
+            return
+
+        await send_message(self.ws, data, self.codec, self.compression_threshold if self.compress else None)
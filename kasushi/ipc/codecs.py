@@ -0,0 +1,183 @@
+import json
+import struct
+import zlib
+from typing import Any, Dict, Iterable, List, Optional
+
+import aiohttp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Messages are sent as text JSON until a codec is negotiated at login. After that, they are sent as binary frames
+# starting with a header byte: the codec id in the low bits, and COMPRESSED if the rest of the frame is zlib-compressed.
+# Receivers only look at the header, so they can decode every frame whatever was negotiated.
+COMPRESSED = 0x80
+COMPRESSION_LEVEL = 1
+DEFAULT_COMPRESSION_THRESHOLD = 4096
+# Batches hold several frames, each prefixed by its length.
+BATCH = 0x7f
+_LENGTH_STRUCT = struct.Struct('>I')
+
+
+class WireCodec:
+    """
+    Turns IPC messages into bytes and back. Subclasses need a unique `name`, and an `id` below 128.
+    """
+    name: str = None
+    id: int = None
+
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JSONWireCodec(WireCodec):
+    """
+    JSON, encoded with orjson when it's installed. Both ends don't need the same library to understand each other.
+    """
+    name = 'json'
+    id = 1
+
+    def dumps(self, data: Any) -> bytes:
+        if orjson is not None:
+            try:
+                return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # Ints too large for orjson, for example.
+                pass
+        return json.dumps(data, separators=(',', ':')).encode()
+
+    def loads(self, data: bytes) -> Any:
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+def _str_keys(data: Any) -> Any:
+    if isinstance(data, dict):
+        return {key if isinstance(key, str) else json.dumps(key).strip('"'): _str_keys(value)
+                for key, value in data.items()}
+    elif isinstance(data, (list, tuple)):
+        return [_str_keys(value) for value in data] if any(isinstance(value, (dict, list, tuple))
+                                                            for value in data) else data
+    return data
+
+
+class MsgpackWireCodec(WireCodec):
+    """
+    msgpack, when it's installed. Mapping keys are turned into strings like JSON does, so handlers get the same
+    messages whatever codec was negotiated.
+    """
+    name = 'msgpack'
+    id = 2
+
+    def dumps(self, data: Any) -> bytes:
+        return msgpack.packb(_str_keys(data))
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data)
+
+
+CODECS: Dict[str, WireCodec] = {JSONWireCodec.name: JSONWireCodec()}
+if msgpack is not None:
+    CODECS[MsgpackWireCodec.name] = MsgpackWireCodec()
+
+_codecs_by_id: Dict[int, WireCodec] = {codec.id: codec for codec in CODECS.values()}
+
+# Preference order, when the configuration doesn't say.
+DEFAULT_CODECS = ['msgpack', 'json']
+
+
+def available_codecs(names: Optional[Iterable[str]] = None) -> List[str]:
+    return [name for name in (names or DEFAULT_CODECS) if name in CODECS]
+
+
+def negotiate(offered: Iterable[str], supported: Iterable[str]) -> Optional[WireCodec]:
+    """
+    Pick the first codec offered by the client that the server supports too, or None to keep text JSON.
+    """
+    supported = set(supported)
+    for name in offered:
+        if name in supported and name in CODECS:
+            return CODECS[name]
+    return None
+
+
+def _frame(header: int, payload: bytes, compression_threshold: Optional[int]) -> bytes:
+    if compression_threshold is not None and len(payload) > compression_threshold:
+        compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+        if len(compressed) < len(payload):
+            payload = compressed
+            header |= COMPRESSED
+    return bytes((header,)) + payload
+
+
+def encode_frame(data: Any, codec: WireCodec, compression_threshold: Optional[int] = None) -> bytes:
+    return _frame(codec.id, codec.dumps(data), compression_threshold)
+
+
+def encode_batch(frames: List[bytes], compression_threshold: Optional[int] = None) -> bytes:
+    """
+    Put uncompressed frames together in a single frame, compressed as a whole.
+    """
+    if len(frames) == 1:
+        return _frame(frames[0][0], frames[0][1:], compression_threshold)
+    return _frame(BATCH, b''.join(_LENGTH_STRUCT.pack(len(frame)) + frame for frame in frames), compression_threshold)
+
+
+def _decode_payload(header: int, payload: bytes) -> Any:
+    codec = _codecs_by_id.get(header)
+    if codec is None:
+        raise ValueError(f"Unknown IPC codec id {header}")
+    return codec.loads(payload)
+
+
+def decode_frames(data: bytes) -> List[Any]:
+    header = data[0]
+    payload = data[1:]
+    if header & COMPRESSED:
+        payload = zlib.decompress(payload)
+        header &= ~COMPRESSED
+
+    if header != BATCH:
+        return [_decode_payload(header, payload)]
+
+    messages = []
+    offset = 0
+    while offset < len(payload):
+        length, = _LENGTH_STRUCT.unpack_from(payload, offset)
+        offset += _LENGTH_STRUCT.size
+        messages.append(_decode_payload(payload[offset], payload[offset + 1:offset + length]))
+        offset += length
+    return messages
+
+
+def decode_frame(data: bytes) -> Any:
+    return decode_frames(data)[0]
+
+
+def decode_messages(msg: aiohttp.WSMessage) -> List[dict]:
+    """
+    Decode the messages of a websocket frame, which may be a batch. Frames that aren't data frames hold none.
+    """
+    if msg.type == aiohttp.WSMsgType.TEXT:
+        return [json.loads(msg.data)]
+    elif msg.type == aiohttp.WSMsgType.BINARY:
+        return decode_frames(msg.data)
+    return []
+
+
+async def send_message(ws, data: dict, codec: Optional[WireCodec], compression_threshold: Optional[int]) -> None:
+    if codec is None:
+        await ws.send_json(data)
+    else:
+        await ws.send_bytes(encode_frame(data, codec, compression_threshold))
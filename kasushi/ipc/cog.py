@@ -5,6 +5,7 @@ from discord.ext import commands
 
 from kasushi.exceptions import InvalidConfigurationError
 from kasushi.ipc.client import IPCClient
+from kasushi.ipc.members import MemberIndex
 from kasushi.ipc.server import IPCServer
 
 
@@ -47,8 +48,8 @@ class IPCCog(commands.Cog):
             except KeyError:
                 raise InvalidConfigurationError('IPC `client.server_url` is not set')
             else:
-                if not ipc_client_server_url.startswith('http'):
-                    raise InvalidConfigurationError('IPC `client.server_url` must start with http or https')
+                if not ipc_client_server_url.startswith(('http', 'unix:')):
+                    raise InvalidConfigurationError('IPC `client.server_url` must start with http, https or unix:')
 
         config.setdefault('handlers', [])
 
@@ -75,6 +76,47 @@ class IPCCog(commands.Cog):
 
         await self.bot.ipc.async_setup()
 
+    def member_index(self) -> Optional[MemberIndex]:
+        ipc: Optional[IPCClient] = getattr(self.bot, 'ipc', None)
+        return ipc.members if ipc is not None else None
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild) -> None:
+        ipc: Optional[IPCClient] = getattr(self.bot, 'ipc', None)
+        if ipc is not None:
+            ipc.guild_joined(guild.id)
+        await self.on_guild_available(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild) -> None:
+        # Guilds are chunked before being available, unless chunking at startup is disabled. Guilds chunked later with
+        # `guild.chunk()` must be added to `bot.ipc.members` with `add_guild`.
+        members = self.member_index()
+        if members is not None:
+            members.add_guild(guild.id, (member.id for member in guild.members))
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild) -> None:
+        ipc: Optional[IPCClient] = getattr(self.bot, 'ipc', None)
+        if ipc is not None:
+            ipc.guild_left(guild.id)
+        members = self.member_index()
+        if members is not None:
+            members.remove_guild(guild.id, (member.id for member in guild.members))
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member) -> None:
+        members = self.member_index()
+        if members is not None:
+            members.add(member.id, member.guild.id)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload) -> None:
+        # Unlike on_member_remove, also sent for members that weren't cached.
+        members = self.member_index()
+        if members is not None:
+            members.remove(payload.user.id, payload.guild_id)
+
     async def cog_unload(self) -> None:
         if self.server:
             await self.server.async_teardown()
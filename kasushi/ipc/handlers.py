@@ -1,34 +1,32 @@
 from typing import Optional, List
 
-from aiohttp.web_ws import WebSocketResponse
-
-from .base import Handler, BroadcastHandler
+from .base import Handler, BroadcastHandler, GuildMulticastHandler, GuildRoutedHandler, MissingResponse
 from .client import IPCClient
 from .server import IPCServer, WSData
 
 
-class GuildInfoHandler(Handler):
+def _guild_info(guild) -> dict:
+    return {
+        'name': guild.name,
+        'id': guild.id,
+        'member_count': guild.member_count,
+    }
+
+
+class GuildInfoHandler(GuildRoutedHandler):
     name = 'guild_info'
 
     async def get_request_data(self, guild_id: int):
         self.ipc: 'IPCClient'
         return {"guild_id": guild_id}
 
-    async def server_dispatch(self, sender_ws: WebSocketResponse, data: dict):
-        self.ipc: 'IPCServer'
-        await self.ipc.send(self.ipc.guild_to_ws_mapping[data['data']['guild_id']], data)
-
     async def get_response(self, data: dict) -> Optional[dict]:
         self.ipc: 'IPCClient'
         guild = self.ipc.bot.get_guild(data['guild_id'])
         if guild:
             return {
                 'success': True,
-                'guild': {
-                    'name': guild.name,
-                    'id': guild.id,
-                    'member_count': guild.member_count,
-                }
+                'guild': _guild_info(guild)
             }
         else:
             return {
@@ -37,13 +35,43 @@ class GuildInfoHandler(Handler):
             }
 
 
+class GuildsInfoHandler(GuildMulticastHandler):
+    """
+    Like `GuildInfoHandler`, for many guilds at once. Only the guilds found are in the response, keyed by ID.
+    """
+    name = 'guilds_info'
+
+    async def get_request_data(self, guild_ids: List[int]):
+        self.ipc: 'IPCClient'
+        return {"guild_ids": guild_ids}
+
+    async def aggregate_responses(self, responses: dict):
+        res = {}
+        for ws, response in responses.items():
+            if not isinstance(response, MissingResponse):
+                res.update(response)
+        return res
+
+    async def get_response(self, data: dict) -> dict:
+        self.ipc: 'IPCClient'
+        guilds = {}
+        for guild_id in data['guild_ids']:
+            guild = self.ipc.bot.get_guild(guild_id)
+            if guild:
+                guilds[guild.id] = _guild_info(guild)
+
+        return guilds
+
+
 class ShardStatusHandler(BroadcastHandler):
     name = 'shard_status'
+    result_ttl = 1
 
     async def aggregate_responses(self, responses: dict):
         res = {}
         for ws, response in responses.items():
-            res.update(response.items())
+            if not isinstance(response, MissingResponse):
+                res.update(response.items())
         return res
 
     async def get_response(self, data: dict) -> dict:
@@ -61,15 +89,20 @@ class ShardStatusHandler(BroadcastHandler):
 
 class FindMemberHandler(BroadcastHandler):
     name = 'find_member'
+    result_ttl = 0
 
     async def aggregate_responses(self, responses: dict[WSData, List[int]]):
         res = []
         for ws, response in responses.items():
-            res.extend(response)
+            if not isinstance(response, MissingResponse):
+                res.extend(response)
         return res
 
     async def get_response(self, data: dict) -> List[int]:
         self.ipc: 'IPCClient'
+        if self.ipc.members is not None:
+            return self.ipc.members.guilds_of(data['user_id'])
+
         guilds_ids = []
         for guild in self.ipc.bot.guilds:
             if guild.get_member(data['user_id']):
@@ -77,3 +110,27 @@ class FindMemberHandler(BroadcastHandler):
 
         return guilds_ids
 
+
+class CacheInvalidationHandler(Handler):
+    """
+    Drops keys from the near cache of every other process when they are set or deleted, and namespace generations
+    when they are invalidated.
+    """
+    name = 'cache_invalidate'
+    wait = False
+
+    async def get_request_data(self, keys: List[bytes]):
+        self.ipc: 'IPCClient'
+        return {"keys": [key.decode() for key in keys]}
+
+    async def server_dispatch(self, sender_ws: WSData, data: dict):
+        self.ipc: 'IPCServer'
+        for wsd in self.ipc._active_ws:
+            if wsd is not sender_ws and wsd.logged_in:
+                await self.ipc.send(wsd, data)
+
+    async def get_response(self, data: dict) -> None:
+        self.ipc: 'IPCClient'
+        cache = getattr(self.ipc.bot, 'cache', None)
+        if cache is not None:
+            cache.drop_local(key.encode() for key in data['keys'])
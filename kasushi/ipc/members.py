@@ -0,0 +1,59 @@
+from array import array
+from typing import Dict, Iterable, List
+
+
+class MemberIndex:
+    """
+    The guilds of every member cached by this process, by user ID, so finding the guilds of a user costs the size of
+    the result instead of a scan of every guild.
+
+    The guild IDs of a user are kept in an `array` of 64 bits integers, a few times smaller than a set. Users are in a
+    few guilds at most, so searching the array when a member joins or leaves is cheap.
+    """
+
+    def __init__(self):
+        self._guilds: Dict[int, array] = {}
+
+    @classmethod
+    def from_guilds(cls, guilds: Iterable) -> 'MemberIndex':
+        index = cls()
+        for guild in guilds:
+            index.add_guild(guild.id, (member.id for member in getattr(guild, 'members', ())))
+        return index
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    def add(self, user_id: int, guild_id: int) -> None:
+        guilds = self._guilds.get(user_id)
+        if guilds is None:
+            self._guilds[user_id] = array('Q', (guild_id,))
+        elif guild_id not in guilds:
+            guilds.append(guild_id)
+
+    def remove(self, user_id: int, guild_id: int) -> None:
+        guilds = self._guilds.get(user_id)
+        if guilds is None:
+            return
+
+        try:
+            guilds.remove(guild_id)
+        except ValueError:
+            return
+
+        if not guilds:
+            del self._guilds[user_id]
+
+    def add_guild(self, guild_id: int, user_ids: Iterable[int]) -> None:
+        """
+        Index the members of a guild, when it becomes available or is chunked.
+        """
+        for user_id in user_ids:
+            self.add(user_id, guild_id)
+
+    def remove_guild(self, guild_id: int, user_ids: Iterable[int]) -> None:
+        for user_id in user_ids:
+            self.remove(user_id, guild_id)
+
+    def guilds_of(self, user_id: int) -> List[int]:
+        return list(self._guilds.get(user_id, ()))
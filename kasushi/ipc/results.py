@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+DEFAULT_MAX_RESULTS = 1000
+
+
+def request_key(data: Any) -> str:
+    """
+    A key identical for requests with the same data, whatever the order of their keys.
+    """
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+
+
+class ResultCache:
+    """
+    Shares the results of identical requests of a handler on the server.
+
+    A request arriving while an identical one is being dispatched waits for its result instead of being dispatched
+    again (single-flight). Results are then reused for `ttl` seconds; with a `ttl` of 0, only concurrent requests share
+    a result. Failed dispatches are never cached, every request waiting on them fails the same way.
+
+    `stats` counts the requests answered from a cached result (`hits`), the ones that joined a dispatch in progress
+    (`coalesced`), and the ones that were dispatched (`misses`).
+    """
+
+    def __init__(self, ttl: float, *, max_results: int = DEFAULT_MAX_RESULTS):
+        self.ttl = ttl
+        self.max_results = max_results
+
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+        self.stats = {
+            'hits': 0,
+            'coalesced': 0,
+            'misses': 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def _store(self, key: Hashable, result: Any) -> None:
+        if self.ttl <= 0:
+            return
+
+        now = time.monotonic()
+        if len(self._results) >= self.max_results:
+            self._results = {key: item for key, item in self._results.items() if item[0] > now}
+            while len(self._results) >= self.max_results:
+                # Results are stored in order, the first one expires first.
+                del self._results[next(iter(self._results))]
+        self._results[key] = (now + self.ttl, result)
+
+    def invalidate(self, key: Hashable = None) -> None:
+        """
+        Forget the cached result of a key, or of every key. Dispatches in progress are still shared.
+        """
+        if key is None:
+            self._results.clear()
+        else:
+            self._results.pop(key, None)
+
+    async def get(self, key: Hashable, dispatch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached result of `key`, or wait for the dispatch in progress, or start one with `dispatch`.
+        """
+        item = self._results.get(key)
+        if item is not None:
+            if item[0] > time.monotonic():
+                self.stats['hits'] += 1
+                return item[1]
+            del self._results[key]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            self.stats['misses'] += 1
+            task = asyncio.ensure_future(dispatch())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+
+        # Shielded, so a waiter giving up doesn't cancel the dispatch for the others.
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
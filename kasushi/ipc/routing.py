@@ -0,0 +1,81 @@
+import base64
+from typing import Iterable, List, Set, Tuple
+
+_MASK = (1 << 64) - 1
+
+
+def encode_ids(ids: Iterable[int]) -> str:
+    """
+    Encode a set of IDs compactly: sorted, as the differences between consecutive IDs, in LEB128 varints, in base64.
+    Guild IDs take about 9 characters each, instead of 20 in a JSON list.
+    """
+    data = bytearray()
+    previous = 0
+    for id in sorted(ids):
+        delta = id - previous
+        previous = id
+        while delta >= 0x80:
+            data.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return base64.b64encode(data).decode()
+
+
+def decode_ids(encoded: str) -> List[int]:
+    ids = []
+    previous = 0
+    delta = 0
+    shift = 0
+    for byte in base64.b64decode(encoded):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += delta
+            ids.append(previous)
+            delta = 0
+            shift = 0
+    return ids
+
+
+def _mix(id: int) -> int:
+    # The splitmix64 finalizer, so that close IDs change different bits of the checksum.
+    id = (id ^ (id >> 30)) * 0xbf58476d1ce4e5b9 & _MASK
+    id = (id ^ (id >> 27)) * 0x94d049bb133111eb & _MASK
+    return id ^ (id >> 31)
+
+
+class GuildSet:
+    """
+    The guilds of a process, as known by the process itself and by the server.
+
+    The checksum is a XOR of the mixed IDs, so both ends can update it with every change, in any order, and compare it
+    to find out that their sets diverged. The version is bumped by every change, to find out that one was lost.
+    """
+
+    def __init__(self, ids: Iterable[int] = (), version: int = 0):
+        self.ids: Set[int] = set(ids)
+        self.version = version
+        self.checksum = 0
+        for id in self.ids:
+            self.checksum ^= _mix(id)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id: int) -> bool:
+        return id in self.ids
+
+    def apply(self, joined: Iterable[int], left: Iterable[int]) -> Tuple[List[int], List[int]]:
+        """
+        Add and remove guilds, and bump the version even if nothing changed. Returns the guilds that were actually added
+        and removed.
+        """
+        added = [id for id in dict.fromkeys(joined) if id not in self.ids]
+        removed = [id for id in dict.fromkeys(left) if id in self.ids]
+        self.ids.update(added)
+        self.ids.difference_update(removed)
+        for id in added + removed:
+            self.checksum ^= _mix(id)
+        self.version += 1
+        return added, removed
@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+DEFAULT_REQUEST_TIMEOUT = 30
+DEFAULT_MAX_IN_FLIGHT = 1000
+
+
+def min_timeout(*timeouts: Optional[float]) -> Optional[float]:
+    """
+    The shortest of the timeouts, None meaning no timeout.
+    """
+    timeouts = [timeout for timeout in timeouts if timeout is not None]
+    return min(timeouts) if timeouts else None
+
+
+class PendingRequests:
+    """
+    The requests sent on a connection that are waiting for a response, keyed by their integer correlation ID (the
+    `rtoken` of the messages).
+
+    Every request waits on a future, resolved when its response comes in, for at most its timeout. The remaining time
+    is sent along with the request, so the other end can give up when the caller already did. At most `max_in_flight`
+    requests wait at once, later ones wait for a slot within their own timeout. When the connection is lost,
+    `fail_all` makes every waiting request fail immediately.
+    """
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, ids: Optional[Iterator[int]] = None):
+        self.max_in_flight = max_in_flight
+        self._ids = ids if ids is not None else itertools.count(1)
+        self._futures: Dict[int, asyncio.Future] = {}
+        # Created on first use, since asyncio primitives are bound to a loop before python 3.10.
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def new_rtoken(self) -> int:
+        """
+        An rtoken for a message that isn't waited for with `call`, like a streamed request.
+        """
+        return next(self._ids)
+
+    def resolve(self, rtoken: int, response: Any) -> bool:
+        """
+        Give a response to the request waiting for it. Returns False if no request is waiting for this rtoken.
+        """
+        future = self._futures.get(rtoken)
+        if future is None or future.done():
+            return False
+        future.set_result(response)
+        return True
+
+    def fail_all(self, exception: BaseException) -> None:
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(exception)
+
+    async def call(self, data: dict, send: Callable[[dict], Awaitable[None]], timeout: Optional[float]) -> Any:
+        """
+        Send a request with `send`, and wait for its response.
+
+        Raises `asyncio.TimeoutError` if no response came in `timeout` seconds, and the exception given to `fail_all`
+        if the connection is lost first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        await asyncio.wait_for(self._slots.acquire(), timeout)
+        try:
+            rtoken = next(self._ids)
+            future = asyncio.get_running_loop().create_future()
+            self._futures[rtoken] = future
+            try:
+                data['rtoken'] = rtoken
+                if deadline is not None:
+                    data['timeout'] = deadline - time.monotonic()
+                await send(data)
+                return await asyncio.wait_for(future, None if deadline is None else deadline - time.monotonic())
+            finally:
+                del self._futures[rtoken]
+        finally:
+            self._slots.release()
@@ -1,69 +1,180 @@
 import asyncio
+import itertools
 import logging
-import uuid
-from typing import Dict, Any, List, Optional, Type
+import time
+from typing import Dict, Any, AsyncIterator, Iterable, List, NamedTuple, Optional, Set, Tuple, Type
 
 import aiohttp.web
 from aiohttp.web_ws import WebSocketResponse
 from discord.ext import commands
 
-from .base import Handler, LoginHandler
-from .client import WaitingEvent
+from kasushi.exceptions import IPCConnectionLostError
+from .base import GuildSyncHandler, Handler, LoginHandler, PublishHandler, SubscribeHandler
+from .batching import BatchWriter
+from .codecs import DEFAULT_COMPRESSION_THRESHOLD, WireCodec, available_codecs, decode_messages, send_message
+from .results import ResultCache
+from .routing import GuildSet
+from .rpc import DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUEST_TIMEOUT, PendingRequests
+from .streams import IncomingStream, OutgoingStream
 
 logger = logging.getLogger(__name__)
 
 
 class WSData:
-    def __init__(self, ws: WebSocketResponse):
+    def __init__(self, ws: WebSocketResponse, pending: Optional[PendingRequests] = None):
         self.ws = ws
+        self.pending = pending or PendingRequests()
         self.logged_in = False
         self.remote_name = "???"
+        self.codec: Optional[WireCodec] = None
+        self.compress = False
+        self.writer: Optional[BatchWriter] = None
+        # The guilds routed to this connection, and whether the server is waiting for the full set after a mismatch.
+        self.guilds: Optional[GuildSet] = None
+        self.guilds_stale = False
+        # Streamed responses received from and sent to this connection by the server itself, by rtoken.
+        self.streams_in: Dict[int, IncomingStream] = {}
+        self.streams_out: Dict[int, OutgoingStream] = {}
+        self.topics: Set[str] = set()
 
     def __str__(self):
         return self.remote_name
 
 
+class ReturnPath(NamedTuple):
+    origin: WSData
+    rtoken: Any
+    expires_at: float
+
+
 class IPCServer:
     def __init__(self, config: dict, *args, **kwargs):
         self.config = config
-        self.waiting_events: Dict[str, WaitingEvent] = {}
+        self.request_timeout: Optional[float] = config.get('request_timeout', DEFAULT_REQUEST_TIMEOUT)
+        self.max_in_flight: int = config.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT)
+        # Correlation IDs of the requests sent by the server, and of the requests it forwards. They come from a single
+        # counter, so a response always matches a single request whatever connection it comes from.
+        self._rtokens = itertools.count(1)
+
+        self.codecs = available_codecs(config.get('codecs'))
+        self.compression_threshold: Optional[int] = config.get('compression_threshold',
+                                                               DEFAULT_COMPRESSION_THRESHOLD)
+        self.batching: Optional[dict] = config.get('batching')
 
         self._active_ws: List[WSData] = []
 
-        self.return_paths: Dict[str, WSData] = {}
+        self.return_paths: Dict[int, ReturnPath] = {}
+        self._next_return_paths_purge = 0.0
+        # Streams forwarded between two clients: (receiver, its rtoken) -> (sender, the server's rtoken), to forward
+        # the receiver's credit to the sender. Added with the first chunk, since the return path doesn't know the sender.
+        self.stream_routes: Dict[Tuple[WSData, int], Tuple[WSData, int]] = {}
+        # Requests forwarded by the server to share their response between identical requests.
+        self.forwarded = PendingRequests(self.max_in_flight, self._rtokens)
 
         self.handlers: Dict[str, Handler] = {}
+        # By handler name, for the handlers with a `result_ttl`, which the `result_ttl` config mapping can override.
+        self.result_caches: Dict[str, ResultCache] = {}
 
         self.shard_to_ws_mapping: Dict[int, WSData] = {}
+        # Sent by the clients at login, to find the shard of a guild without `guild_to_ws_mapping`.
+        self.shard_count: Optional[int] = None
+        # The connections subscribed to each topic, for `PublishHandler`.
+        self.subscriptions: Dict[str, Set[WSData]] = {}
         self.guild_to_ws_mapping: Dict[int, WSData] = {}
         self.add_handler(LoginHandler)
+        self.add_handler(GuildSyncHandler)
+        self.add_handler(SubscribeHandler)
+        self.add_handler(PublishHandler)
 
         for handler in self.config['handlers']:
             self.add_handler(handler)
 
     def add_handler(self, handler: Type[Handler]):
         self.handlers[handler.name] = handler(self)
+        result_ttl = self.config.get('result_ttl', {}).get(handler.name, handler.result_ttl)
+        if result_ttl is not None:
+            self.result_caches[handler.name] = ResultCache(result_ttl)
 
     async def index(self, request):
         return aiohttp.web.Response(text='This is a websocket IPC server for Kasushi IPC')
 
     async def websocket_handler(self, request):
         # Got websocket connection
-        wsd = WSData(aiohttp.web.WebSocketResponse())
+        wsd = WSData(aiohttp.web.WebSocketResponse(), PendingRequests(self.max_in_flight, self._rtokens))
         await wsd.ws.prepare(request)
         self._active_ws.append(wsd)
 
         async for msg in wsd.ws:
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                json_data = msg.json()
-
-                if wsd.logged_in:
-                    asyncio.create_task(self.handle_incoming_message(wsd, json_data))
-                else:
-                    asyncio.create_task(self.handle_login_message(wsd, json_data))
+            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                for json_data in decode_messages(msg):
+                    if wsd.logged_in:
+                        asyncio.create_task(self.handle_incoming_message(wsd, json_data))
+                    else:
+                        asyncio.create_task(self.handle_login_message(wsd, json_data))
 
         self._active_ws.remove(wsd)
-        return wsd
+        wsd.pending.fail_all(IPCConnectionLostError(f"The connection to {wsd} was lost"))
+        if wsd.guilds is not None:
+            self.route_guilds(wsd, (), wsd.guilds.ids)
+        self.shard_to_ws_mapping = {shard_id: shard_wsd for shard_id, shard_wsd in self.shard_to_ws_mapping.items()
+                                    if shard_wsd is not wsd}
+        await self.close_streams(wsd)
+        self.set_subscriptions(wsd, ())
+        self.return_paths = {rtoken: path for rtoken, path in self.return_paths.items() if path.origin is not wsd}
+        return wsd.ws
+
+    def set_subscriptions(self, wsd: WSData, topics: Iterable[str]) -> None:
+        topics = set(topics)
+        for topic in wsd.topics - topics:
+            subscribers = self.subscriptions[topic]
+            subscribers.discard(wsd)
+            if not subscribers:
+                del self.subscriptions[topic]
+        for topic in topics - wsd.topics:
+            self.subscriptions.setdefault(topic, set()).add(wsd)
+        wsd.topics = topics
+
+    def route_guild(self, guild_id: int) -> Optional[WSData]:
+        """
+        The connection of the process running a guild. Its shard is `(guild_id >> 22) % shard_count`, the guild
+        routing table is only used when the shard count isn't known, or no process runs that shard.
+        """
+        if self.shard_count:
+            wsd = self.shard_to_ws_mapping.get((guild_id >> 22) % self.shard_count)
+            if wsd is not None:
+                return wsd
+        return self.guild_to_ws_mapping.get(guild_id)
+
+    def route_guilds(self, wsd: WSData, added: Iterable[int], removed: Iterable[int]) -> None:
+        self.guild_to_ws_mapping.update(dict.fromkeys(added, wsd))
+        for guild_id in removed:
+            # The guild may have moved to another process already.
+            if self.guild_to_ws_mapping.get(guild_id) is wsd:
+                del self.guild_to_ws_mapping[guild_id]
+
+    def set_guilds(self, wsd: WSData, guild_ids: Iterable[int], version: int) -> None:
+        """
+        Replace the guilds routed to a connection.
+        """
+        previous = wsd.guilds.ids if wsd.guilds is not None else set()
+        wsd.guilds = GuildSet(guild_ids, version)
+        self.route_guilds(wsd, wsd.guilds.ids, previous - wsd.guilds.ids)
+
+    def add_return_path(self, wsd: WSData, data: dict) -> None:
+        """
+        Remember where to send the response of a forwarded request, and give it an rtoken unique to the server.
+        """
+        now = time.monotonic()
+        if now >= self._next_return_paths_purge:
+            # Drop the requests whose sender stopped waiting, their responses won't ever be needed.
+            self._next_return_paths_purge = now + 1
+            self.return_paths = {rtoken: path for rtoken, path in self.return_paths.items() if path.expires_at > now}
+
+        timeout = data.get('timeout', self.request_timeout)
+        expires_at = now + timeout if timeout is not None else float('inf')
+        rtoken = next(self._rtokens)
+        self.return_paths[rtoken] = ReturnPath(wsd, data['rtoken'], expires_at)
+        data['rtoken'] = rtoken
 
     async def handle_incoming_message(self, wsd: WSData, data: dict):
         type = data.get('type')
@@ -72,25 +183,152 @@ class IPCServer:
         if type == 'request':
             logger.debug(f'[{wsd}] -> {data}')
             handler_class = self.handlers.get(handler)
-            if handler_class:
+            result_cache = self.result_caches.get(handler)
+            if handler_class and rtoken and result_cache is not None and not data.get('stream'):
+                await self.dispatch_cached(wsd, handler_class, result_cache, data)
+            elif handler_class:
                 if rtoken and not handler_class.server_reply:
-                    self.return_paths[rtoken] = wsd
+                    self.add_return_path(wsd, data)
                 await handler_class.server_dispatch(wsd, data)
             else:
                 logger.warning(f'[{wsd}] Handler {handler} not found, cannot forward')
+        elif type in ('chunk', 'end', 'credit'):
+            logger.debug(f'[{wsd}] <- {data}')
+            await self.handle_stream_message(wsd, data)
         else:
             logger.debug(f'[{wsd}] <- {data}')
-            if rtoken:
-                maybe_event = self.waiting_events.get(rtoken)
-                if maybe_event:
-                    maybe_event.response = data
-                    maybe_event.set()
-                else:
-                    try:
-                        await self.return_paths[rtoken].ws.send_json(data)
-                    except KeyError:
-                        logger.warning(f'[{wsd}] No return path for {rtoken}')
-                        return
+            if rtoken and not wsd.pending.resolve(rtoken, data) and not self.forwarded.resolve(rtoken, data):
+                return_path = self.return_paths.pop(rtoken, None)
+                if return_path is None:
+                    logger.warning(f'[{wsd}] No return path for {rtoken}')
+                    return
+                await self.send(return_path.origin, {**data, 'rtoken': return_path.rtoken})
+
+    async def handle_stream_message(self, wsd: WSData, data: dict):
+        rtoken = data.get('rtoken')
+        if data['type'] == 'credit':
+            outgoing = wsd.streams_out.get(rtoken)
+            if outgoing is not None:
+                outgoing.control(data)
+            elif (wsd, rtoken) in self.stream_routes:
+                sender, sender_rtoken = self.stream_routes[(wsd, rtoken)]
+                await self.send(sender, {**data, 'rtoken': sender_rtoken})
+            return
+
+        stream = wsd.streams_in.get(rtoken)
+        if stream is not None:
+            stream.feed(data)
+            return
+
+        # A stream forwarded to another client. Its return path is kept until the end, and expires when no chunk
+        # came for `request_timeout`.
+        if data['type'] == 'end':
+            return_path = self.return_paths.pop(rtoken, None)
+        else:
+            return_path = self.return_paths.get(rtoken)
+        if return_path is None:
+            logger.warning(f'[{wsd}] No return path for stream {rtoken}')
+            return
+
+        if data['type'] == 'end':
+            self.stream_routes.pop((return_path.origin, return_path.rtoken), None)
+        else:
+            self.stream_routes[(return_path.origin, return_path.rtoken)] = (wsd, rtoken)
+            if self.request_timeout is not None:
+                self.return_paths[rtoken] = return_path._replace(expires_at=time.monotonic() + self.request_timeout)
+        await self.send(return_path.origin, {**data, 'rtoken': return_path.rtoken})
+
+    async def close_streams(self, wsd: WSData):
+        """
+        Fail or stop the streams of a connection that was lost.
+        """
+        for stream in list(wsd.streams_in.values()):
+            stream.fail(IPCConnectionLostError(f"The connection to {wsd} was lost"))
+        for outgoing in wsd.streams_out.values():
+            outgoing.control({'cancel': True})
+
+        for (receiver, receiver_rtoken), (sender, sender_rtoken) in list(self.stream_routes.items()):
+            if receiver is wsd:
+                del self.stream_routes[(receiver, receiver_rtoken)]
+                await self.send(sender, {'type': 'credit', 'rtoken': sender_rtoken, 'cancel': True})
+            elif sender is wsd:
+                del self.stream_routes[(receiver, receiver_rtoken)]
+                await self.send(receiver, {'type': 'end', 'rtoken': receiver_rtoken, 'error': 'connection lost'})
+
+    async def send_stream(self, wsd: WSData, data: dict, *, timeout: Optional[float] = None) -> IncomingStream:
+        """
+        Send a request to a client, and return its streamed response. Each chunk is waited for at most `timeout`
+        seconds, `request_timeout` by default.
+        """
+        rtoken = next(self._rtokens)
+        stream = IncomingStream(
+            lambda message: self.send(wsd, {**message, 'type': 'credit', 'handler': data['handler'], 'rtoken': rtoken}),
+            timeout=timeout if timeout is not None else self.request_timeout,
+            on_close=lambda: wsd.streams_in.pop(rtoken, None))
+        wsd.streams_in[rtoken] = stream
+        await self.send(wsd, {**data, 'rtoken': rtoken, 'stream': stream.window})
+        return stream
+
+    async def stream_to(self, wsd: WSData, request: dict, generator: AsyncIterator):
+        """
+        Send the chunks of a generator as the streamed response to a request.
+        """
+        rtoken = request['rtoken']
+        outgoing = OutgoingStream(
+            generator, lambda message: self.send(wsd, {**message, 'handler': request['handler'], 'rtoken': rtoken}),
+            window=request['stream'], timeout=self.request_timeout)
+        wsd.streams_out[rtoken] = outgoing
+        try:
+            await outgoing.run()
+        finally:
+            wsd.streams_out.pop(rtoken, None)
+
+    async def reply(self, wsd: WSData, data: dict, response: Any):
+        """
+        Answer a request that would have been forwarded from the server itself, for example when no process can answer
+        it.
+        """
+        rtoken = data.get('rtoken')
+        if rtoken is None:
+            return
+
+        message = {'handler': data['handler'], 'type': 'response', 'rtoken': rtoken, 'data': response}
+        if self.forwarded.resolve(rtoken, message):
+            return
+
+        return_path = self.return_paths.pop(rtoken, None)
+        if return_path is not None:
+            message['rtoken'] = return_path.rtoken
+        await self.send(wsd, message)
+
+    async def dispatch_cached(self, wsd: WSData, handler: Handler, result_cache: ResultCache, data: dict):
+        """
+        Answer a request with the result of an identical one if there is one in the cache or in flight, and dispatch
+        it otherwise.
+        """
+        try:
+            response = await asyncio.wait_for(
+                result_cache.get(handler.result_key(data['data']), lambda: self.dispatch_shared(wsd, handler, data)),
+                data.get('timeout'))
+        except asyncio.TimeoutError:
+            logger.debug(f'[{wsd}] Gave up on {handler.name} request {data["rtoken"]}, the sender stopped waiting')
+            return
+        except IPCConnectionLostError as e:
+            logger.debug(f'[{wsd}] Shared {handler.name} request failed: {e}')
+            return
+        except Exception:
+            logger.exception(f'[{wsd}] Shared {handler.name} request failed')
+            return
+
+        await self.send(wsd, {**response, 'rtoken': data['rtoken']})
+
+    async def dispatch_shared(self, wsd: WSData, handler: Handler, data: dict) -> dict:
+        if handler.server_reply:
+            return {'handler': handler.name, 'type': 'response', 'data': await handler.server_response(wsd, data)}
+
+        # The server waits for the response itself instead of adding a return path, to give it to every waiter.
+        return await self.forwarded.call(dict(data), lambda message: handler.server_dispatch(wsd, message),
+                                         data.get('timeout', self.request_timeout))
 
     async def handle_login_message(self, wsd: WSData, data):
         data['handler'] = 'login'
@@ -106,30 +344,45 @@ class IPCServer:
         self._app = app
         self._runner = aiohttp.web.AppRunner(app)
         await self._runner.setup()
-        self._site = aiohttp.web.TCPSite(self._runner, self.config.get('server_listen_host', '0.0.0.0'),
-                                         self.config.get('server_listen_port', 12321))
-        await self._site.start()
+
+        # Processes on the same host can connect through a unix socket, without the loopback TCP overhead. Set
+        # `server_listen_port` to None to only listen on the socket.
+        self._sites = []
+        if self.config.get('server_listen_port', 12321) is not None:
+            self._sites.append(aiohttp.web.TCPSite(self._runner, self.config.get('server_listen_host', '0.0.0.0'),
+                                                   self.config.get('server_listen_port', 12321)))
+        if self.config.get('server_listen_path'):
+            self._sites.append(aiohttp.web.UnixSite(self._runner, self.config['server_listen_path']))
+
+        for site in self._sites:
+            await site.start()
 
     async def async_teardown(self):
         logger.debug("IPC Server closing")
         for wsd in self._active_ws[:]:
             logger.debug(f"Closing {wsd}")
+            if wsd.writer is not None:
+                await wsd.writer.close()
             await wsd.ws.close()
             logger.debug(f"Closed {wsd}")
 
-        await self._site.stop()
+        for site in self._sites:
+            await site.stop()
         logger.debug("IPC Server closed")
 
-    async def send_wait(self, wsd: WSData, data):
-        data['rtoken'] = uuid.uuid4().hex
-        event = WaitingEvent()
-        self.waiting_events[data['rtoken']] = event
-        await self.send(wsd, data)
-        await event.wait()
-        del self.waiting_events[data['rtoken']]
-
-        return event.response
+    async def send_wait(self, wsd: WSData, data, *, timeout: Optional[float] = None):
+        """
+        Send a request to a client, and wait for its response for at most `timeout` seconds, `request_timeout` by
+        default.
+        """
+        return await wsd.pending.call(data, lambda message: self.send(wsd, message),
+                                      timeout if timeout is not None else self.request_timeout)
 
     async def send(self, wsd: WSData, data):
         logger.debug(f'[{wsd}] !-> {data}')
-        await wsd.ws.send_json(data)
+        if wsd.writer is not None:
+            handler = self.handlers.get(data.get('handler'))
+            await wsd.writer.send(data, immediate=handler is not None and not handler.batch)
+            return
+
+        await send_message(wsd.ws, data, wsd.codec, self.compression_threshold if wsd.compress else None)
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from kasushi.exceptions import IPCStreamError
+
+logger = logging.getLogger(__name__)
+
+# How many chunks the sender of a stream may send ahead of what the receiver consumed.
+DEFAULT_WINDOW = 32
+
+
+class IncomingStream:
+    """
+    The chunks of a streamed response, as an async iterator.
+
+    Chunks are numbered, so a lost or reordered one fails the stream instead of going unnoticed. The sender only sends
+    `window` chunks ahead of what was consumed: credit for more is sent with `control` once half of the window was
+    consumed, so a slow consumer slows the sender down instead of buffering the whole response. Each chunk is waited
+    for at most `timeout` seconds.
+
+    Stopping the iteration early must be done with `close`, to tell the sender.
+    """
+
+    def __init__(self, control: Callable[[dict], Awaitable[None]], *, window: int = DEFAULT_WINDOW,
+                 timeout: Optional[float] = None, on_close: Optional[Callable[[], None]] = None):
+        self.window = window
+        self.timeout = timeout
+        self._control = control
+        self._on_close = on_close
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._next_seq = 0
+        self._consumed = 0
+        self.closed = False
+
+    def feed(self, message: dict) -> None:
+        self._queue.put_nowait(message)
+
+    def fail(self, exception: BaseException) -> None:
+        self._queue.put_nowait(exception)
+
+    def _close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            if self._on_close is not None:
+                self._on_close()
+
+    async def close(self) -> None:
+        """
+        Stop receiving the stream, and tell the sender to stop sending it.
+        """
+        if not self.closed:
+            self._close()
+            await self._control({'cancel': True})
+
+    def __aiter__(self) -> 'IncomingStream':
+        return self
+
+    async def __anext__(self) -> Any:
+        if self.closed:
+            raise StopAsyncIteration
+
+        try:
+            message = await asyncio.wait_for(self._queue.get(), self.timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise
+
+        if isinstance(message, BaseException):
+            self._close()
+            raise message
+        elif message.get('error'):
+            self._close()
+            raise IPCStreamError(f"The stream failed: {message['error']}")
+        elif message.get('seq') != self._next_seq:
+            await self.close()
+            raise IPCStreamError(f"Got chunk {message.get('seq')} of the stream instead of {self._next_seq}")
+        self._next_seq += 1
+
+        if message['type'] == 'end':
+            self._close()
+            raise StopAsyncIteration
+
+        self._consumed += 1
+        if self._consumed >= max(1, self.window // 2):
+            credit, self._consumed = self._consumed, 0
+            await self._control({'credit': credit})
+        return message['data']
+
+
+class OutgoingStream:
+    """
+    Sends the items of an async generator as numbered chunks with `send`, then an end message. It waits for credit from
+    the receiver when `window` chunks weren't acknowledged yet, at most `timeout` seconds.
+    """
+
+    def __init__(self, generator: AsyncIterator, send: Callable[[dict], Awaitable[None]], *,
+                 window: int = DEFAULT_WINDOW, timeout: Optional[float] = None):
+        self.generator = generator
+        self.send = send
+        self.credit = window
+        self.timeout = timeout
+        self.cancelled = False
+        self._credited = asyncio.Event()
+
+    def control(self, message: dict) -> None:
+        if message.get('cancel'):
+            self.cancelled = True
+        else:
+            self.credit += message.get('credit', 0)
+        self._credited.set()
+
+    async def run(self) -> None:
+        seq = 0
+        error = None
+        try:
+            async for item in self.generator:
+                while self.credit <= 0 and not self.cancelled:
+                    self._credited.clear()
+                    await asyncio.wait_for(self._credited.wait(), self.timeout)
+                if self.cancelled:
+                    break
+                self.credit -= 1
+                await self.send({'type': 'chunk', 'seq': seq, 'data': item})
+                seq += 1
+        except asyncio.TimeoutError:
+            logger.debug("Stopped streaming a response, the receiver didn't consume it in time")
+            error = 'timed out waiting for the receiver'
+        except ConnectionError:
+            logger.debug("Stopped streaming a response, the connection was lost")
+            return
+        except Exception as e:
+            logger.exception("Streaming a response failed")
+            error = repr(e)
+        finally:
+            if hasattr(self.generator, 'aclose'):
+                await self.generator.aclose()
+
+        # Also sent when the receiver cancelled the stream, so the server forwarding it can forget it.
+        end = {'type': 'end', 'seq': seq}
+        if error is not None:
+            end['error'] = error
+        try:
+            await self.send(end)
+        except ConnectionError:
+            logger.debug("Couldn't end a streamed response, the connection was lost")
+
+
+async def single(value: Any) -> AsyncIterator:
+    """
+    A stream of a single chunk, for handlers that don't stream their response.
+    """
+    yield value
+
+
+async def collect(generator: AsyncIterator) -> List[Any]:
+    return [item async for item in generator]
+
+
+async def merge(iterators: List[AsyncIterator],
+                on_error: Optional[Callable[[int, BaseException], None]] = None) -> AsyncIterator:
+    """
+    Yield the items of several async iterators as they come. Items are only taken from an iterator when the previous one
+    was consumed, so backpressure still works through the merge. Iterators that fail are given to `on_error` with
+    their index, and skipped.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    done = object()
+
+    async def pump(index: int, iterator: AsyncIterator):
+        try:
+            async for item in iterator:
+                await queue.put(item)
+        except Exception as e:
+            if on_error is not None:
+                on_error(index, e)
+        await queue.put(done)
+
+    tasks = [asyncio.ensure_future(pump(index, iterator)) for index, iterator in enumerate(iterators)]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is done:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -8,6 +8,7 @@ logger = logging.getLogger(__name__)
 
 async def configure(bot: commands.Bot, settings: dict):
     bot._kasushi_settings = settings
+    bot._kasushi_config = settings
 
 
 class CustomFormatter(logging.Formatter):
@@ -0,0 +1,270 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+
+from kasushi.cache.backends import MemoryBackend
+from kasushi.cache.cog import Cache, CacheCog
+from kasushi.cache.near import NearCache
+from kasushi.cache.writebehind import WriteBehindBuffer
+from kasushi.exceptions import InvalidConfigurationError
+
+
+class BotMock:
+    pass
+
+
+@pytest.mark.asyncio
+async def test_get_set_delete():
+    cache = Cache(BotMock(), MemoryBackend())
+    await cache.set("coins", 0)
+    await cache.set("coins", 10)
+    assert await cache.get("coins") == 10
+    assert await cache.delete("coins") is True
+    assert await cache.get("coins", default=5) == 5
+
+
+@pytest.mark.asyncio
+async def test_many():
+    cache = Cache(BotMock(), MemoryBackend(), near_cache=NearCache())
+    assert await cache.set_many({"coins:1": 10, b"coins:2": 20}, expires={"coins:1": timedelta(hours=1)}) == \
+           {"coins:1": True, b"coins:2": True}
+
+    assert await cache.get_many(["coins:1", b"coins:2", "coins:3"], default=0, defaults={"coins:3": 3}) == \
+           {"coins:1": 10, b"coins:2": 20, "coins:3": 3}
+
+    assert await cache.delete_many(["coins:1", "coins:3"]) == {"coins:1": True, "coins:3": False}
+    assert await cache.get("coins:1") is None
+
+
+class BrokenHandlerMock:
+    def __init__(self):
+        self.calls = 0
+
+    async def send_request(self, **data):
+        self.calls += 1
+        raise ConnectionResetError("Cannot write to closing transport")
+
+
+class IPCMock:
+    def __init__(self, online: bool):
+        self.closed = False
+        self.online = asyncio.Event()
+        if online:
+            self.online.set()
+        self.handlers = {"cache_invalidate": BrokenHandlerMock()}
+
+
+@pytest.mark.asyncio
+async def test_invalidation_is_best_effort():
+    bot = BotMock()
+    cache = Cache(bot, MemoryBackend(), near_cache=NearCache())
+
+    # Nothing is sent before the IPC client is logged in.
+    bot.ipc = IPCMock(online=False)
+    assert await cache.set("coins", 10) is True
+    assert bot.ipc.handlers["cache_invalidate"].calls == 0
+
+    # Failing to send doesn't fail the write, which already succeeded.
+    bot.ipc = IPCMock(online=True)
+    assert await cache.set("coins", 20) is True
+    assert await cache.delete("coins") is True
+    assert await cache.set_many({"a": 1, "b": 2}) == {"a": True, "b": True}
+    assert bot.ipc.handlers["cache_invalidate"].calls == 3
+
+
+@pytest.mark.asyncio
+async def test_get_or_set():
+    cache = Cache(BotMock(), MemoryBackend())
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"top": [1, 2, 3]}
+
+    results = await asyncio.gather(*[cache.get_or_set("leaderboard", compute, expire=timedelta(minutes=5))
+                                     for _ in range(10)])
+
+    assert results == [{"top": [1, 2, 3]}] * 10
+    assert len(calls) == 1
+    assert await cache.get_or_set("leaderboard", compute) == {"top": [1, 2, 3]}
+    assert len(calls) == 1
+
+    # The value is stored as is, so it can be read without get_or_set.
+    assert await cache.get("leaderboard") == {"top": [1, 2, 3]}
+    assert await cache.get_many(["leaderboard"]) == {"leaderboard": {"top": [1, 2, 3]}}
+
+    # Values stored by set are returned as they are.
+    await cache.set("plain", "value")
+    assert await cache.get_or_set("plain", compute) == "value"
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_or_set_lock():
+    backend = MemoryBackend()
+    cache = Cache(BotMock(), backend)
+
+    async def compute():
+        return "computed"
+
+    # Another process holds the lock and takes too long: the value is computed here, but its lock is left alone.
+    await backend.add(b"report:lock", b"1", 60)
+    assert await cache.get_or_set("report", compute, lock_timeout=timedelta(seconds=0.1)) == "computed"
+    assert await backend.get(b"report:lock") == b"1"
+
+    # The lock taken by this process is released.
+    await cache.get_or_set("other", compute)
+    assert await backend.get(b"other:lock") is None
+
+    # Lock keys stay within the 250 bytes memcached allows.
+    long_key = "x" * 248
+    assert await cache.get_or_set(long_key, compute) == "computed"
+    assert await cache.get_or_set(long_key, compute) == "computed"
+
+
+@pytest.mark.asyncio
+async def test_get_or_set_early_refresh():
+    cache = Cache(BotMock(), MemoryBackend())
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert await cache.get_or_set("stats", compute, expire=timedelta(hours=1)) == 1
+    # Far from its expiration, the key is never refreshed.
+    assert await cache.get_or_set("stats", compute, expire=timedelta(hours=1)) == 1
+
+    # Close to its expiration, a slow computation is refreshed early.
+    await cache.bset(b"stats:xfetch", cache.encode([10 ** 6, time.time() + 1]), expire=timedelta(hours=1))
+    assert await cache.get_or_set("stats", compute, expire=timedelta(hours=1)) == 2
+
+
+@pytest.mark.asyncio
+async def test_namespace():
+    cache = Cache(BotMock(), MemoryBackend())
+    guild = cache.namespace("guild:123")
+    other = cache.namespace("guild:456")
+
+    await guild.set("prefix", "!")
+    await guild.set_many({"language": "en", "coins": 10})
+    await other.set("prefix", "?")
+    assert await guild.get("prefix") == "!"
+    assert await guild.get_many(["language", "coins", "missing"]) == {"language": "en", "coins": 10, "missing": None}
+
+    await guild.invalidate()
+    assert await guild.get("prefix") is None
+    assert await guild.get_many(["language", "coins"], default=0) == {"language": 0, "coins": 0}
+    assert await other.get("prefix") == "?"
+
+    # Other processes see the new generation once their local copy expires.
+    cache._generations.clear()
+    assert await cache.namespace("guild:123").get("prefix") is None
+
+
+@pytest.mark.asyncio
+async def test_chunking():
+    backend = MemoryBackend(max_item_size=1000)
+    cache = Cache(BotMock(), backend, chunk_size=900)
+    snapshot = {"members": list(range(2000))}
+
+    assert await cache.set("snapshot", snapshot) is True
+    assert await cache.get("snapshot") == snapshot
+    assert len(backend._items) > 3
+
+    await cache.set_many({"small": 1, "large": list(range(1000))})
+    assert await cache.get_many(["small", "large", "snapshot"]) == \
+           {"small": 1, "large": list(range(1000)), "snapshot": snapshot}
+
+    # A single evicted chunk makes the whole value a miss.
+    chunk_key = next(key for key in backend._items.keys() if key.startswith(b"snapshot:chunk:"))
+    await backend.delete(chunk_key)
+    assert await cache.get("snapshot", default="missing") == "missing"
+    assert (await cache.get_many(["snapshot"]))["snapshot"] is None
+
+
+@pytest.mark.asyncio
+async def test_write_behind():
+    backend = MemoryBackend()
+    cache = Cache(BotMock(), backend)
+    cache.write_behind = WriteBehindBuffer(cache, interval=timedelta(hours=1), max_pending=3)
+
+    for count in range(50):
+        assert await cache.set("last_seen:1", count) is True
+    await cache.set("last_seen:2", 1)
+    assert await cache.get("last_seen:1") == 49
+    assert await backend.get(b"last_seen:1") is None
+    assert cache.write_behind.stats["coalesced"] == 49
+
+    await cache.delete("last_seen:2")
+    assert await cache.get("last_seen:2") is None
+
+    # Reaching max_pending wakes the flush task up.
+    await cache.set("last_seen:3", 1)
+    await cache.set("last_seen:4", 1)
+    await asyncio.sleep(0.01)
+    assert len(cache.write_behind) == 0
+    assert cache.write_behind.stats["flushes"] == 1
+    assert cache.decode(await backend.get(b"last_seen:1")) == 49
+
+    await cache.set("last_seen:5", 1)
+    await cache.write_behind.close()
+    assert cache.decode(await backend.get(b"last_seen:5")) == 1
+
+
+@pytest.mark.asyncio
+async def test_config_check_is_idempotent():
+    for cache_config in ({"server_ip": "127.0.0.1"},
+                         {"servers": ["10.0.0.1:11212", {"server_ip": "10.0.0.2", "weight": 2}]}):
+        bot = BotMock()
+        bot._kasushi_config = {"cache": cache_config}
+        cog = CacheCog(bot)
+
+        # Reloading the cog checks the same config again.
+        await cog.config_check()
+        first = list(cog.servers)
+        await cog.config_check()
+        assert cog.servers == first
+    assert first == [("10.0.0.1", 11212, 1), ("10.0.0.2", 11211, 2)]
+    assert cache_config["servers"] == ["10.0.0.1:11212", {"server_ip": "10.0.0.2", "weight": 2}]
+
+
+@pytest.mark.asyncio
+async def test_config_check_warm_start_needs_near_cache():
+    bot = BotMock()
+    bot._kasushi_config = {"cache": {"server_ip": "127.0.0.1", "warm_start": {"path": "snapshot"}}}
+    with pytest.raises(InvalidConfigurationError):
+        await CacheCog(bot).config_check()
+
+    bot._kasushi_config["cache"]["near_cache"] = {}
+    await CacheCog(bot).config_check()
+
+
+class SlowBackend(MemoryBackend):
+    async def multi_set(self, items):
+        items = list(items)
+        await asyncio.sleep(0.05)
+        return await super().multi_set(items)
+
+
+@pytest.mark.asyncio
+async def test_write_behind_discard_during_flush():
+    backend = SlowBackend()
+    cache = Cache(BotMock(), backend)
+    cache.write_behind = WriteBehindBuffer(cache, interval=timedelta(hours=1))
+
+    await cache.set("last_seen:1", 1)
+    await cache.set("last_seen:2", 1)
+    flush = asyncio.ensure_future(cache.write_behind.flush())
+    await asyncio.sleep(0)
+
+    # Written or deleted directly while the buffered values are being flushed.
+    await cache.delete("last_seen:1")
+    await cache.bset(b"last_seen:2", cache.encode(2))
+    await flush
+
+    assert await backend.get(b"last_seen:1") is None
+    assert cache.decode(await backend.get(b"last_seen:2")) == 2
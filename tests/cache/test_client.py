@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+from aiomcache.exceptions import ClientException
+
+from kasushi.cache.client import MemcachedClient, ShardedClient
+
+
+class FakeMemcached:
+    """
+    A memcached server speaking just enough of the text protocol to test the pipelined commands of the clients.
+    """
+
+    def __init__(self, *, max_item_size: int = 1024 * 1024):
+        self.max_item_size = max_item_size
+        self.items = {}
+        self.versions = {}
+        self.commands = []
+        self.server = None
+        self.port = None
+
+    async def start(self) -> 'FakeMemcached':
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, *args = line.split()
+                self.commands.append(command)
+                if command in (b'set', b'add', b'cas'):
+                    key, _, _, length, *cas = args
+                    value = (await reader.readexactly(int(length) + 2))[:-2]
+                    if len(value) > self.max_item_size:
+                        writer.write(b'SERVER_ERROR object too large for cache\r\n')
+                    elif command == b'add' and key in self.items:
+                        writer.write(b'NOT_STORED\r\n')
+                    elif command == b'cas' and key not in self.items:
+                        writer.write(b'NOT_FOUND\r\n')
+                    elif command == b'cas' and int(cas[0]) != self.versions[key]:
+                        writer.write(b'EXISTS\r\n')
+                    else:
+                        self.items[key] = value
+                        self.versions[key] = self.versions.get(key, 0) + 1
+                        writer.write(b'STORED\r\n')
+                elif command in (b'get', b'gets'):
+                    for key in args:
+                        value = self.items.get(key)
+                        if value is not None:
+                            cas = b' %d' % self.versions.get(key, 0) if command == b'gets' else b''
+                            writer.write(b'VALUE %b 0 %d%b\r\n%b\r\n' % (key, len(value), cas, value))
+                    writer.write(b'END\r\n')
+                elif command == b'incr':
+                    value = self.items.get(args[0])
+                    if value is None:
+                        writer.write(b'NOT_FOUND\r\n')
+                    elif not value.isdigit():
+                        writer.write(b'CLIENT_ERROR cannot increment or decrement non-numeric value\r\n')
+                    else:
+                        self.items[args[0]] = b'%d' % (int(value) + int(args[1]))
+                        writer.write(self.items[args[0]] + b'\r\n')
+                elif command == b'delete':
+                    writer.write(b'DELETED\r\n' if self.items.pop(args[0], None) is not None else b'NOT_FOUND\r\n')
+                else:
+                    writer.write(b'ERROR\r\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+@pytest.mark.asyncio
+async def test_multi_set_and_delete():
+    server = await FakeMemcached().start()
+    client = MemcachedClient('127.0.0.1', server.port)
+    try:
+        assert await client.multi_set([(b'a', b'1', 0), (b'b', b'\r\n' * 10, 60), (b'c', b'', 0)]) == [True] * 3
+        assert server.items == {b'a': b'1', b'b': b'\r\n' * 10, b'c': b''}
+
+        assert await client.multi_delete(b'a', b'missing', b'c') == [True, False, True]
+        assert server.items == {b'b': b'\r\n' * 10}
+        assert await client.multi_set([]) == []
+        assert await client.multi_delete() == []
+        assert server.commands == [b'set'] * 3 + [b'delete'] * 3
+    finally:
+        await client.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_pipeline_error():
+    server = await FakeMemcached(max_item_size=10).start()
+    client = MemcachedClient('127.0.0.1', server.port)
+    try:
+        with pytest.raises(ClientException):
+            await client.multi_set([(b'small', b'1', 0), (b'large', b'x' * 100, 0)])
+        assert server.items == {b'small': b'1'}
+    finally:
+        await client.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_multi_incr():
+    server = await FakeMemcached().start()
+    client = MemcachedClient('127.0.0.1', server.port)
+    try:
+        server.items.update({b'hits:1': b'1', b'hits:2': b'41', b'name': b'kasushi'})
+        assert await client.multi_incr([(b'hits:1', 1), (b'missing', 1), (b'hits:2', 1), (b'hits:1', 5)]) == \
+               [2, None, 42, 7]
+        assert server.items[b'hits:1'] == b'7'
+        assert await client.multi_incr([]) == []
+
+        with pytest.raises(ClientException):
+            await client.multi_incr([(b'name', 1)])
+    finally:
+        await client.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_multi_gets_and_cas():
+    server = await FakeMemcached().start()
+    client = MemcachedClient('127.0.0.1', server.port)
+    try:
+        await client.multi_set([(b'a', b'1', 0), (b'b', b'2', 0)])
+        (a, a_cas), (b, b_cas), missing = await client.multi_gets(b'a', b'b', b'missing')
+        assert (a, b, missing) == (b'1', b'2', (None, None))
+
+        await client.set(b'b', b'changed')
+        assert await client.multi_cas([(b'a', b'10', a_cas, 0), (b'b', b'20', b_cas, 60),
+                                       (b'missing', b'30', None, 0), (b'a', b'40', None, 0)]) == \
+               [True, False, True, False]
+        assert server.items == {b'a': b'10', b'b': b'changed', b'missing': b'30'}
+        assert await client.multi_cas([]) == []
+        assert server.commands[-5:] == [b'set', b'cas', b'cas', b'add', b'add']
+    finally:
+        await client.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_sharded_fan_out():
+    servers = [await FakeMemcached().start(), await FakeMemcached().start()]
+    client = ShardedClient([('127.0.0.1', server.port, 1) for server in servers])
+    try:
+        keys = [f'guild:{i}'.encode() for i in range(50)]
+        assert await client.multi_set([(key, key.upper(), 0) for key in keys]) == [True] * 50
+
+        # Every key is stored on the server owning it, and both servers got some.
+        for server in servers:
+            assert server.items
+            for key in server.items:
+                assert client.ring.get_node(key) == f'127.0.0.1:{server.port}'
+        assert sum(len(server.items) for server in servers) == 50
+
+        assert await client.multi_get(b'missing', *keys) == (None, *(key.upper() for key in keys))
+        assert await client.multi_delete(*keys[:10], b'missing') == [True] * 10 + [False]
+        assert await client.multi_get(*keys[:12]) == (None,) * 10 + (b'GUILD:10', b'GUILD:11')
+
+        await client.multi_set([(b'hits:%d' % i, b'0', 0) for i in range(20)])
+        assert await client.multi_incr([(b'hits:%d' % i, i) for i in range(20)] + [(b'missing', 1)]) == \
+               list(range(20)) + [None]
+
+        tokens = await client.multi_gets(*keys[8:12])
+        assert [value for value, _ in tokens] == [None, None, b'GUILD:10', b'GUILD:11']
+        assert await client.multi_cas([(key, b'new', cas_token, 0) for key, (_, cas_token) in zip(keys[8:12], tokens)]) \
+               == [True] * 4
+        assert await client.multi_get(*keys[8:12]) == (b'new',) * 4
+    finally:
+        await client.close()
+        for server in servers:
+            await server.close()
@@ -0,0 +1,49 @@
+import pickle
+
+import pytest
+
+from kasushi.cache.codecs import JSONCodec, Serializer
+
+VALUES = [0, 1, -1, 2 ** 70, -(2 ** 70), "coins", {"a": [1, 2, 3]}, None, True, ["x" * 5000]]
+
+
+@pytest.mark.parametrize("codecs", [['pickle'], ['varint', 'pickle'], ['json', 'pickle']])
+@pytest.mark.parametrize("compression", [None, 'zlib', 'lzma'])
+def test_roundtrip(codecs, compression):
+    serializer = Serializer(codecs, compression=compression, compression_threshold=100)
+    for value in VALUES:
+        assert serializer.loads(serializer.dumps(value)) == value
+
+
+def test_legacy_pickle():
+    serializer = Serializer(['varint', 'json'], compression='zlib')
+    assert serializer.loads(pickle.dumps({"coins": 10})) == {"coins": 10}
+
+    # Uncompressed pickles stay readable by versions without codecs.
+    assert pickle.loads(Serializer().dumps({"coins": 10})) == {"coins": 10}
+
+
+def test_compression_threshold():
+    serializer = Serializer(compression='zlib', compression_threshold=1024)
+    assert len(serializer.dumps("x" * 2000)) < 100
+    assert serializer.dumps("x" * 10)[0] == 0x80
+
+
+def test_varint_size():
+    serializer = Serializer(['varint', 'pickle'])
+    assert len(serializer.dumps(100)) == 3
+    assert serializer.dumps(True)[0] == 0x80
+
+
+def test_json_falls_back():
+    serializer = Serializer(['json', 'pickle'])
+    value = {"ids": (1, 2), "names": {1: "a"}, "raw": b"x", "tags": {"a"}}
+    assert serializer.loads(serializer.dumps(value)) == value
+    assert serializer.dumps(value)[0] == 0x80
+
+    assert serializer.dumps({"a": [1, 2.5, None, True]})[0] == JSONCodec.id
+    # Pickle keeps shared and cyclic lists, JSON doesn't.
+    cyclic = [1]
+    cyclic.append(cyclic)
+    assert serializer.dumps([cyclic[:1], cyclic[:1]])[0] == JSONCodec.id
+    assert serializer.loads(serializer.dumps(cyclic))[1][1][0] == 1
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+import pytest
+
+from kasushi.cache.decorators import cached
+
+calls = []
+
+
+@cached(tier='local')
+async def get_settings(guild_id: int, language: str = 'en'):
+    calls.append(guild_id)
+    return {'guild_id': guild_id, 'language': language}
+
+
+@cached(tier='local', negative=timedelta(seconds=60), key=lambda user_id: user_id)
+async def find_user(user_id: int):
+    calls.append(user_id)
+    return None
+
+
+@cached(tier='local')
+async def find_missing(user_id: int):
+    calls.append(user_id)
+    return None
+
+
+@pytest.mark.asyncio
+async def test_hits():
+    calls.clear()
+    assert await get_settings(1) == {'guild_id': 1, 'language': 'en'}
+    assert await get_settings(1, 'en') == {'guild_id': 1, 'language': 'en'}
+    assert await get_settings(guild_id=1) == {'guild_id': 1, 'language': 'en'}
+    assert await get_settings(1, 'fr') == {'guild_id': 1, 'language': 'fr'}
+
+    assert calls == [1, 1]
+    assert get_settings.cache_info()['hits'] == 2
+    assert get_settings.cache_info()['misses'] == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate():
+    calls.clear()
+    await get_settings(2)
+    assert await get_settings.invalidate(2) is True
+    await get_settings(2)
+
+    assert calls == [2, 2]
+
+
+@pytest.mark.asyncio
+async def test_negative_caching():
+    calls.clear()
+    assert await find_user(3) is None
+    assert await find_user(3) is None
+    assert find_user.key_for(3).endswith(':3')
+
+    assert await find_missing(4) is None
+    assert await find_missing(4) is None
+
+    assert calls == [3, 4, 4]
+
+
+class Settings:
+    pass
+
+
+class Guild:
+    def __init__(self, id: int):
+        self.id = id
+
+
+@cached(tier='local')
+async def get_options(guild, options):
+    return options
+
+
+def test_keys():
+    assert get_options.key_for(Guild(1), {'b': [1, 2], 'a': None}) == \
+           get_options.key_for(Guild(1), {'a': None, 'b': [1, 2]})
+    assert get_options.key_for(Guild(1), None) != get_options.key_for(Guild(2), None)
+
+    # Objects without a stable repr would never hit the cache.
+    with pytest.raises(TypeError, match='key='):
+        get_options.key_for(Guild(1), Settings())
+    with pytest.raises(TypeError):
+        get_options.key_for(Guild(1), [Settings()])
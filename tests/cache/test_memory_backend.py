@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from aiomcache.exceptions import ClientException, ValidationException
+
+from kasushi.cache.backends import MemoryBackend
+
+
+@pytest.mark.asyncio
+async def test_get_set_delete():
+    backend = MemoryBackend()
+    assert await backend.get(b'coins') is None
+    assert await backend.get(b'coins', b'0') == b'0'
+
+    assert await backend.set(b'coins', b'10') is True
+    assert await backend.get(b'coins') == b'10'
+
+    assert await backend.delete(b'coins') is True
+    assert await backend.delete(b'coins') is False
+
+    with pytest.raises(ValidationException):
+        await backend.set(b'invalid key', b'1')
+
+
+@pytest.mark.asyncio
+async def test_add_incr_cas():
+    backend = MemoryBackend()
+    assert await backend.add(b'counter', b'1') is True
+    assert await backend.add(b'counter', b'2') is False
+
+    assert await backend.incr(b'counter', 5) == 6
+    assert await backend.decr(b'counter', 10) == 0
+    assert await backend.incr(b'missing') is None
+
+    await backend.set(b'text', b'abc')
+    with pytest.raises(ClientException):
+        await backend.incr(b'text')
+
+    value, token = await backend.gets(b'counter')
+    assert value == b'0'
+    assert await backend.cas(b'counter', b'1', token) is True
+    assert await backend.cas(b'counter', b'2', token) is False
+    assert await backend.get(b'counter') == b'1'
+
+
+@pytest.mark.asyncio
+async def test_expiration(monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+    backend = MemoryBackend()
+    await backend.set(b'short', b'1', 1)
+    await backend.set(b'long', b'1', 100)
+    await backend.set(b'touched', b'1', 1)
+    await backend.set(b'absolute', b'1', int(now) + 5)
+    assert await backend.touch(b'touched', 100) is True
+
+    now += 10
+    assert await backend.get(b'long') == b'1'
+    assert b'short' not in backend._items
+    assert await backend.get(b'touched') == b'1'
+    assert await backend.get(b'absolute') is None
+
+
+@pytest.mark.asyncio
+async def test_limits():
+    backend = MemoryBackend(max_bytes=10, max_item_size=8)
+    with pytest.raises(ClientException):
+        await backend.set(b'big', b'x' * 9)
+
+    await backend.set(b'a', b'12345')
+    await backend.set(b'b', b'12345')
+    await backend.get(b'a')
+    await backend.set(b'c', b'1')
+
+    assert await backend.multi_get(b'a', b'b', b'c') == (b'12345', None, b'1')
+    assert backend.evictions == 1
@@ -0,0 +1,63 @@
+from kasushi.cache.metrics import CacheMetrics
+
+
+def test_counters():
+    metrics = CacheMetrics(sample_rate=1)
+    metrics.record_get(b'guild:1:settings', b'abc')
+    metrics.record_get(b'guild:2:settings', b'abc', near=True)
+    metrics.record_get(b'guild:3:settings', None)
+    metrics.record_set(b'user:1', b'abcd')
+    metrics.record_delete(b'user:1')
+    metrics.record_error('get')
+
+    snapshot = metrics.snapshot()
+    assert snapshot['prefixes']['guild']['hits'] == 1
+    assert snapshot['prefixes']['guild']['near_hits'] == 1
+    assert snapshot['prefixes']['guild']['misses'] == 1
+    assert snapshot['prefixes']['user']['sets'] == 1
+    assert snapshot['prefixes']['user']['deletes'] == 1
+    assert snapshot['errors'] == {'get': 1}
+    assert metrics.hit_ratio('guild') == 2 / 3
+
+
+def test_histograms():
+    metrics = CacheMetrics(sample_rate=1)
+    metrics.observe_latency('get', 0.0003)
+    metrics.observe_latency('get', 2)
+    metrics.record_set(b'user:1', b'x' * 100)
+
+    latency = metrics.snapshot()['latency_seconds']['get']
+    assert latency['count'] == 2
+    assert latency['buckets'][0.00025] == 0
+    assert latency['buckets'][0.0005] == 1
+    assert latency['buckets'][float('inf')] == 2
+
+    assert metrics.snapshot()['value_bytes']['user']['buckets'][256] == 1
+
+    text = metrics.render()
+    assert 'kasushi_cache_sets_total{prefix="user"} 1' in text
+    assert 'kasushi_cache_latency_seconds_bucket{op="get",le="+Inf"} 2' in text
+
+
+def test_render_escapes_labels():
+    metrics = CacheMetrics(sample_rate=1)
+    metrics.record_set(b'say "hi"\\\n:1', b'x')
+    metrics.observe_latency('get"', 0.001)
+
+    text = metrics.render()
+    assert 'kasushi_cache_sets_total{prefix="say \\"hi\\"\\\\\\n"} 1' in text
+    assert 'kasushi_cache_value_bytes_count{prefix="say \\"hi\\"\\\\\\n"} 1' in text
+    assert 'kasushi_cache_latency_seconds_count{op="get\\""} 1' in text
+    assert all(line.startswith(('# TYPE kasushi_cache_', 'kasushi_cache_')) for line in text.splitlines())
+
+
+def test_sampling_and_prefix_limit():
+    metrics = CacheMetrics(sample_rate=0, max_prefixes=2)
+    for i in range(10):
+        metrics.record_set(f'prefix{i}:key'.encode(), b'x')
+        metrics.observe_latency('set', 0.001)
+
+    assert set(metrics.counters.keys()) == {'prefix0', 'prefix1', 'other'}
+    assert metrics.counters['other']['sets'] == 8
+    assert metrics.latencies == {}
+    assert metrics.sizes == {}
@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+from kasushi.cache.near import NearCache
+
+
+def test_get_set():
+    near = NearCache()
+    assert near.get(b'coins') is None
+
+    near.set(b'coins', b'10')
+    assert near.get(b'coins') == b'10'
+
+    assert near.stats['hits'] == 1
+    assert near.stats['misses'] == 1
+
+
+def test_lru_eviction():
+    near = NearCache(max_size=2)
+    near.set(b'a', b'1')
+    near.set(b'b', b'2')
+    near.get(b'a')
+    near.set(b'c', b'3')
+
+    assert b'a' in near
+    assert b'b' not in near
+    assert b'c' in near
+    assert near.evictions == 1
+
+
+def test_max_bytes():
+    near = NearCache(max_bytes=10)
+    near.set(b'a', b'12345')
+    near.set(b'b', b'12345')
+    near.set(b'c', b'1')
+
+    assert b'a' not in near
+    assert near.current_bytes == 6
+
+    near.set(b'd', b'x' * 11)
+    assert b'd' not in near
+
+
+def test_ttl():
+    near = NearCache(ttl=timedelta(seconds=0.05))
+    near.set(b'a', b'1')
+    near.set(b'b', b'2', expire=0.01)
+    assert b'a' in near
+
+    time.sleep(0.06)
+    assert b'a' not in near
+    assert b'b' not in near
+
+
+def test_invalidate():
+    near = NearCache()
+    near.set(b'a', b'1')
+    near.set(b'b', b'2')
+    near.invalidate([b'a', b'z'])
+
+    assert b'a' not in near
+    assert b'b' in near
+    assert near.invalidations == 1
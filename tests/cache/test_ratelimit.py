@@ -0,0 +1,134 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+
+from kasushi.cache.backends import MemoryBackend
+from kasushi.cache.cog import Cache
+from kasushi.cache.ratelimit import SlidingWindow, TokenBucket
+
+
+class BotMock:
+    pass
+
+
+@pytest.mark.asyncio
+async def test_sliding_window(monkeypatch):
+    now = 1_000_020.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+    cache = Cache(BotMock(), MemoryBackend())
+    window = SlidingWindow(cache, 'cooldown', limit=3, window=timedelta(seconds=60))
+
+    results = [await window.hit('user:1') for _ in range(4)]
+    assert [result.allowed for result in results] == [True, True, True, False]
+    assert results[0].remaining == 2
+    assert results[3].retry_after > 0
+    assert (await window.hit('user:2')).allowed is True
+
+    # Half of the previous window still counts.
+    now += 90
+    results = [await window.hit('user:1') for _ in range(3)]
+    assert [result.allowed for result in results] == [True, False, False]
+
+
+@pytest.mark.asyncio
+async def test_sliding_window_many():
+    cache = Cache(BotMock(), MemoryBackend())
+    window = SlidingWindow(cache, 'cooldown', limit=1, window=timedelta(seconds=60))
+
+    await window.hit('b')
+    results = await window.hit_many(['a', 'b', 'c'])
+    assert {key: result.allowed for key, result in results.items()} == {'a': True, 'b': False, 'c': True}
+
+    await window.reset('b')
+    assert (await window.hit('b')).allowed is True
+
+
+@pytest.mark.asyncio
+async def test_token_bucket(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+    cache = Cache(BotMock(), MemoryBackend())
+    bucket = TokenBucket(cache, 'commands', capacity=5, rate=1)
+
+    results = await asyncio.gather(*[bucket.consume('user:1') for _ in range(7)])
+    assert sum(result.allowed for result in results) == 5
+
+    denied = await bucket.consume('user:1', cost=2)
+    assert denied.allowed is False
+    assert denied.retry_after == 2
+
+    now += 2
+    assert (await bucket.consume('user:1', cost=2)).allowed is True
+    assert (await bucket.consume('user:1')).allowed is False
+    assert (await bucket.consume('user:1', cost=10)).retry_after == float('inf')
+
+    results = await bucket.consume_many(['user:1', 'user:2'])
+    assert results['user:1'].allowed is False
+    assert results['user:2'].allowed is True
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def multi_gets(self, *keys):
+        self.calls.append('multi_gets')
+        return await super().multi_gets(*keys)
+
+    async def multi_cas(self, items):
+        self.calls.append('multi_cas')
+        return await super().multi_cas(items)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_many_round_trips(monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: 1_000_000.0)
+
+    backend = CountingBackend()
+    cache = Cache(BotMock(), backend)
+    bucket = TokenBucket(cache, 'commands', capacity=2, rate=1)
+    keys = [f'user:{i}' for i in range(100)]
+
+    results = await bucket.consume_many(keys + ['user:0'])
+    assert list(results) == keys
+    assert all(result.allowed and result.remaining == 1 for result in results.values())
+    # One multi-get and one pipelined batch of writes for every bucket, however many there are.
+    assert backend.calls == ['multi_gets', 'multi_cas']
+
+    backend.calls.clear()
+    await bucket.consume('user:0')
+    results = await bucket.consume_many(keys[:3])
+    assert [result.allowed for result in results.values()] == [False, True, True]
+    assert backend.calls == ['multi_gets', 'multi_cas'] * 2
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_contention(monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: 1_000_000.0)
+
+    backend = MemoryBackend()
+    cache = Cache(BotMock(), backend)
+    bucket = TokenBucket(cache, 'commands', capacity=5, rate=1, max_retries=3)
+
+    async def multi_cas(items):
+        # Another process always writes the buckets first.
+        return [False for _ in items]
+
+    backend.multi_cas = multi_cas
+    results = await bucket.consume_many(['user:1', 'user:2'])
+    assert results == {'user:1': (False, 0, 1.0), 'user:2': (False, 0, 1.0)}
+
+
+def test_invalid_limits():
+    cache = Cache(BotMock(), MemoryBackend())
+    with pytest.raises(ValueError):
+        TokenBucket(cache, 'bucket', capacity=10, rate=0)
+    with pytest.raises(ValueError):
+        TokenBucket(cache, 'bucket', capacity=0, rate=1)
+    with pytest.raises(ValueError):
+        SlidingWindow(cache, 'cooldown', limit=3, window=timedelta(0))
@@ -0,0 +1,40 @@
+from collections import Counter
+
+from kasushi.cache.ring import HashRing
+
+KEYS = [f"guild:{i}:settings".encode() for i in range(10000)]
+
+
+def test_distribution():
+    ring = HashRing({'a': 1, 'b': 1, 'c': 2})
+    counts = Counter(ring.get_node(key) for key in KEYS)
+
+    assert set(counts.keys()) == {'a', 'b', 'c'}
+    assert 0.2 < counts['a'] / len(KEYS) < 0.3
+    assert 0.4 < counts['c'] / len(KEYS) < 0.6
+
+
+def test_stable():
+    assert HashRing({'a': 1, 'b': 1}).get_node(b'coins') == HashRing({'b': 1, 'a': 1}).get_node(b'coins')
+
+
+def test_add_node_remaps_few_keys():
+    ring = HashRing({'a': 1, 'b': 1, 'c': 1, 'd': 1})
+    before = {key: ring.get_node(key) for key in KEYS}
+
+    ring.add_node('e')
+    moved = [key for key in KEYS if ring.get_node(key) != before[key]]
+
+    assert all(ring.get_node(key) == 'e' for key in moved)
+    assert len(moved) / len(KEYS) < 0.3
+
+
+def test_remove_node_remaps_its_keys_only():
+    ring = HashRing({'a': 1, 'b': 1, 'c': 1, 'd': 1})
+    before = {key: ring.get_node(key) for key in KEYS}
+
+    ring.remove_node('d')
+
+    for key in KEYS:
+        if before[key] != 'd':
+            assert ring.get_node(key) == before[key]
@@ -0,0 +1,76 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+from kasushi.cache.backends import MemoryBackend
+from kasushi.cache.cog import Cache
+from kasushi.cache.near import NearCache
+from kasushi.cache.warmstart import WarmStart, read_snapshot, write_snapshot
+
+
+class BotMock:
+    pass
+
+
+def test_hot_keys():
+    warm_start = WarmStart(Cache(BotMock(), MemoryBackend()), "unused", max_keys=2)
+    for _ in range(10):
+        warm_start.record(b"guild:1")
+    for _ in range(5):
+        warm_start.record(b"guild:2")
+    for i in range(20):
+        warm_start.record(f"user:{i}".encode())
+
+    assert warm_start.hot_keys() == [b"guild:1", b"guild:2"]
+    assert len(warm_start.counts) <= 8
+
+
+def test_snapshot_roundtrip(tmp_path):
+    path = str(tmp_path / "snapshot")
+    write_snapshot(path, [b"a", b"b" * 200], 42.0)
+    assert read_snapshot(path) == (42.0, [b"a", b"b" * 200])
+
+
+@pytest.mark.asyncio
+async def test_save_and_load(tmp_path):
+    path = str(tmp_path / "snapshot")
+    backend = MemoryBackend()
+
+    cache = Cache(BotMock(), backend)
+    cache.warm_start = WarmStart(cache, path, max_keys=2)
+    await cache.set_many({"guild:1": "one", "guild:2": "two", "guild:3": "three"})
+    for _ in range(3):
+        await cache.get("guild:1")
+        await cache.get("guild:2")
+    await cache.get("guild:3")
+    counts = dict(cache.warm_start.counts)
+    assert await cache.warm_start.save() == 2
+    assert read_snapshot(path)[1] == [b"guild:1", b"guild:2"]
+
+    # Restarted process: guild:2 was deleted from memcached in the meantime, it must not come back.
+    await backend.delete(b"guild:2")
+    cache = Cache(BotMock(), backend, near_cache=NearCache())
+    cache.warm_start = WarmStart(cache, path)
+    assert await cache.warm_start.load() == 1
+    # Loading doesn't count as reading the keys.
+    assert cache.warm_start.counts == {}
+    assert counts == {b"guild:1": 3, b"guild:2": 3, b"guild:3": 1}
+
+    assert b"guild:1" in cache.near_cache
+    assert b"guild:2" not in cache.near_cache
+    assert await backend.get(b"guild:2") is None
+    assert await backend.get(b"guild:3") is not None and b"guild:3" not in cache.near_cache
+
+
+@pytest.mark.asyncio
+async def test_stale_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot")
+    write_snapshot(path, [b"guild:1"], time.time() - 3600)
+
+    backend = MemoryBackend()
+    cache = Cache(BotMock(), backend, near_cache=NearCache())
+    cache.warm_start = WarmStart(cache, path, max_age=timedelta(minutes=10))
+    assert await cache.warm_start.load() == 0
+    assert b"guild:1" not in cache.near_cache
+    assert await WarmStart(cache, str(tmp_path / "missing")).load() == 0
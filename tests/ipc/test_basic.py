@@ -2,9 +2,11 @@ import discord
 import pytest
 import asyncio
 import logging
+from collections import deque
 
-from kasushi.ipc.handlers import GuildInfoHandler, ShardStatusHandler, FindMemberHandler
+from kasushi.ipc.handlers import GuildInfoHandler, GuildsInfoHandler, ShardStatusHandler, FindMemberHandler
 from kasushi.ipc.client import IPCClient
+from kasushi.ipc.routing import GuildSet
 from kasushi.ipc.server import IPCServer
 from utils import setup_logger
 
@@ -185,3 +187,413 @@ async def test_find_member():
     await server.async_teardown()
     await client1.async_teardown()
     await client2.async_teardown()
+
+
+class SlowShardStatusHandler(ShardStatusHandler):
+    name = 'slow_shard_status'
+    target_timeout = 0.5
+
+    async def get_response(self, data: dict) -> dict:
+        if getattr(self.ipc.bot, 'stalled', False):
+            await asyncio.sleep(60)
+        return await super().get_response(data)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_stalled_process():
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.stalled = True
+
+    slow_configuration = {**configuration, "handlers": [SlowShardStatusHandler]}
+    server = IPCServer(slow_configuration)
+    await server.async_setup()
+
+    client1 = IPCClient(botMockClient1, slow_configuration)
+    client2 = IPCClient(botMockClient2, slow_configuration)
+    await client1.async_setup()
+    await client2.async_setup()
+    await client2.online.wait()
+
+    start = asyncio.get_running_loop().time()
+    shard_status = await client1.send_request('slow_shard_status')
+
+    assert asyncio.get_running_loop().time() - start < 5
+    assert list(shard_status.keys()) == ['0']
+
+    await server.async_teardown()
+    await client1.async_teardown()
+    await client2.async_teardown()
+
+
+@pytest.mark.asyncio
+async def test_unix_socket(tmp_path):
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient1.guilds = [GuildMock(id=0)]
+
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.guilds = [GuildMock(id=10)]
+
+    socket_path = str(tmp_path / "ipc.sock")
+    server = IPCServer({**configuration, "server_listen_path": socket_path})
+    await server.async_setup()
+
+    # Mixed deployment: one process on the same host through the socket, the other through TCP.
+    client1 = IPCClient(botMockClient1, configuration)
+    client2 = IPCClient(botMockClient2, {**configuration, "client": {"server_url": "unix:" + socket_path}})
+    await client1.async_setup()
+    await client2.async_setup()
+    await client2.online.wait()
+
+    assert (await client1.send_request('guild_info', guild_id=10))['guild']['id'] == 10
+    assert (await client2.send_request('guild_info', guild_id=0))['guild']['id'] == 0
+
+    await server.async_teardown()
+    await client1.async_teardown()
+    await client2.async_teardown()
+
+
+class CountingShardStatusHandler(ShardStatusHandler):
+    name = 'counting_shard_status'
+    result_ttl = 60
+    answered = 0
+
+    async def get_response(self, data: dict) -> dict:
+        CountingShardStatusHandler.answered += 1
+        await asyncio.sleep(0.01)
+        return await super().get_response(data)
+
+
+@pytest.mark.asyncio
+async def test_shared_results():
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient1.guilds = [GuildMock(id=0)]
+
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.guilds = [GuildMock(id=10)]
+
+    shared_configuration = {**configuration,
+                            "handlers": configuration["handlers"] + [CountingShardStatusHandler],
+                            "result_ttl": {"guild_info": 60}}
+    server = IPCServer(shared_configuration)
+    await server.async_setup()
+
+    client1 = IPCClient(botMockClient1, shared_configuration)
+    client2 = IPCClient(botMockClient2, shared_configuration)
+    await client1.async_setup()
+    await client2.async_setup()
+    await client1.online.wait()
+    await client2.online.wait()
+
+    # Identical broadcasts arriving together share a single fan-out, later ones reuse its result.
+    results = await asyncio.gather(*(client.send_request('counting_shard_status')
+                                     for client in (client1, client2) for _ in range(10)))
+    results.append(await client1.send_request('counting_shard_status'))
+    assert all(list(result.keys()) == ['0', '1'] for result in results)
+    assert CountingShardStatusHandler.answered == 2
+    assert server.result_caches['counting_shard_status'].stats == {'hits': 1, 'coalesced': 19, 'misses': 1}
+
+    # Forwarded requests too, when the configuration gives them a TTL.
+    botMockClient2.guilds[0].name = "Renamed"
+    assert (await client1.send_request('guild_info', guild_id=10))['guild']['name'] == "Renamed"
+    botMockClient2.guilds[0].name = "Renamed again"
+    assert (await client2.send_request('guild_info', guild_id=10))['guild']['name'] == "Renamed"
+    assert server.result_caches['guild_info'].stats == {'hits': 1, 'coalesced': 0, 'misses': 1}
+    assert not server.return_paths and not len(server.forwarded)
+
+    await server.async_teardown()
+    await client1.async_teardown()
+    await client2.async_teardown()
+
+
+@pytest.mark.asyncio
+async def test_guild_sync():
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient1.guilds = [GuildMock(id=0), GuildMock(id=1)]
+
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.guilds = [GuildMock(id=10)]
+
+    server = IPCServer(configuration)
+    await server.async_setup()
+
+    client1 = IPCClient(botMockClient1, configuration)
+    client2 = IPCClient(botMockClient2, configuration)
+    await client1.async_setup()
+    await client2.async_setup()
+    await client1.online.wait()
+    await client2.online.wait()
+
+    ws1 = server.guild_to_ws_mapping[0]
+    ws2 = server.guild_to_ws_mapping[10]
+
+    botMockClient2.guilds.append(GuildMock(id=11))
+    client2.guild_joined(11)
+    botMockClient1.guilds.pop()
+    client1.guild_left(1)
+    await asyncio.sleep(0.05)
+    assert server.guild_to_ws_mapping == {0: ws1, 10: ws2, 11: ws2}
+    assert (await client1.send_request('guild_info', guild_id=11))['guild']['id'] == 11
+    assert ws2.guilds.version == 1 and ws2.guilds.checksum == client2.guilds.checksum
+
+    # The server lost track of a guild: the next delta doesn't match, and the client sends every guild.
+    ws2.guilds = GuildSet([11], version=1)
+    del server.guild_to_ws_mapping[10]
+    client2.guild_joined(12)
+    await asyncio.sleep(0.05)
+    assert server.guild_to_ws_mapping == {0: ws1, 10: ws2, 11: ws2, 12: ws2}
+    assert not ws2.guilds_stale and ws2.guilds.checksum == client2.guilds.checksum
+
+    await server.async_teardown()
+    await client1.async_teardown()
+    await client2.async_teardown()
+
+
+@pytest.mark.asyncio
+async def test_computed_routing():
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shard_count = botMockClient2.shard_count = 2
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient1.guilds = [GuildMock(id=2 << 22), GuildMock(id=4 << 22)]
+
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.guilds = [GuildMock(id=1 << 22), GuildMock(id=3 << 22)]
+
+    routed_configuration = {**configuration, "handlers": configuration["handlers"] + [GuildsInfoHandler]}
+    server = IPCServer(routed_configuration)
+    await server.async_setup()
+
+    client1 = IPCClient(botMockClient1, routed_configuration)
+    client2 = IPCClient(botMockClient2, routed_configuration)
+    await client1.async_setup()
+    await client2.async_setup()
+    await client1.online.wait()
+    await client2.online.wait()
+
+    # The shard of a guild is computed from its ID, the guild routing table isn't needed.
+    server.guild_to_ws_mapping.clear()
+    assert server.shard_count == 2
+    assert (await client1.send_request('guild_info', guild_id=3 << 22))['guild']['id'] == 3 << 22
+    assert (await client2.send_request('guild_info', guild_id=2 << 22))['guild']['id'] == 2 << 22
+
+    asked = []
+    get_response = client2.handlers['guilds_info'].get_response
+
+    async def counting_get_response(data):
+        asked.append(data['guild_ids'])
+        return await get_response(data)
+
+    client2.handlers['guilds_info'].get_response = counting_get_response
+
+    guilds = await client1.send_request('guilds_info', guild_ids=[1 << 22, 2 << 22, 3 << 22, 4 << 22, 5 << 22])
+    assert sorted(int(guild_id) for guild_id in guilds.keys()) == [i << 22 for i in range(1, 5)]
+    assert asked == [[1 << 22, 3 << 22, 5 << 22]]
+
+    # Processes without any of the guilds aren't asked.
+    assert list((await client1.send_request('guilds_info', guild_ids=[2 << 22])).keys()) == [str(2 << 22)]
+    assert len(asked) == 1
+
+    await client2.async_teardown()
+    await asyncio.sleep(0.05)
+    assert (await client1.send_request('guild_info', guild_id=3 << 22)) == {'success': False,
+                                                                             'message': 'Guild not found'}
+    assert not server.return_paths
+
+    await server.async_teardown()
+    await client1.async_teardown()
+
+
+@pytest.mark.asyncio
+async def test_member_index():
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient1.guilds = [GuildMock(id=0), GuildMock(id=1)]
+
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.guilds = [GuildMock(id=10)]
+
+    for guild, member_ids in zip(botMockClient1.guilds + botMockClient2.guilds, ([5, 7], [7], [7, 8])):
+        guild.members = [discord.Object(member_id) for member_id in member_ids]
+
+    indexed_configuration = {**configuration, "member_index": True}
+    server = IPCServer(indexed_configuration)
+    await server.async_setup()
+
+    client1 = IPCClient(botMockClient1, indexed_configuration)
+    client2 = IPCClient(botMockClient2, indexed_configuration)
+    await client1.async_setup()
+    await client2.async_setup()
+    await client1.online.wait()
+    await client2.online.wait()
+
+    # Answered from the index, GuildMock.get_member would find other guilds.
+    assert sorted(await client1.send_request('find_member', user_id=7)) == [0, 1, 10]
+    assert await client1.send_request('find_member', user_id=1) == []
+
+    client2.members.add(5, 10)
+    client1.members.remove(7, 1)
+    assert sorted(await client2.send_request('find_member', user_id=5)) == [0, 10]
+    assert sorted(await client2.send_request('find_member', user_id=7)) == [0, 10]
+
+    await server.async_teardown()
+    await client1.async_teardown()
+    await client2.async_teardown()
+
+
+class StreamedGuildMembersHandler(GuildInfoHandler):
+    name = 'streamed_guild_members'
+    stream = True
+
+    async def get_response(self, data: dict):
+        for i in range(data['guild_id'] * 10):
+            yield {'member': i}
+
+
+class StreamedShardsHandler(ShardStatusHandler):
+    name = 'streamed_shards'
+    stream = True
+    result_ttl = None
+
+    async def get_response(self, data: dict):
+        for shard_id in self.ipc.bot.shards.keys():
+            for i in range(50):
+                yield [shard_id, i]
+
+
+@pytest.mark.asyncio
+async def test_streamed_responses():
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient1.guilds = [GuildMock(id=0)]
+
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.guilds = [GuildMock(id=10)]
+
+    streamed_configuration = {**configuration, "handlers": configuration["handlers"] + [StreamedGuildMembersHandler,
+                                                                                        StreamedShardsHandler]}
+    server = IPCServer(streamed_configuration)
+    await server.async_setup()
+
+    client1 = IPCClient(botMockClient1, streamed_configuration)
+    client2 = IPCClient(botMockClient2, streamed_configuration)
+    await client1.async_setup()
+    await client2.async_setup()
+    await client1.online.wait()
+    await client2.online.wait()
+
+    # Forwarded through the server, with the credit going back to the process streaming.
+    chunks = [chunk async for chunk in await client1.send_request('streamed_guild_members', guild_id=10)]
+    assert chunks == [{'member': i} for i in range(100)]
+
+    # Merged by the server.
+    chunks = [tuple(chunk) async for chunk in await client1.send_request('streamed_shards')]
+    assert sorted(chunks) == [(shard_id, i) for shard_id in (0, 1) for i in range(50)]
+
+    # Stopping early stops the process streaming.
+    stream = await client1.send_request('streamed_guild_members', guild_id=10)
+    assert await stream.__anext__() == {'member': 0}
+    await stream.close()
+    await asyncio.sleep(0.05)
+    assert not client2.streams_out and not client1.streams_in
+    assert not server.stream_routes and not server.return_paths
+
+    # Requests that don't ask for a stream get every chunk at once.
+    assert len(await client2.handlers['streamed_guild_members'].get_response({'guild_id': 1}).__anext__()) == 1
+    del StreamedGuildMembersHandler.stream
+    try:
+        assert len(await client1.send_request('streamed_guild_members', guild_id=10)) == 100
+    finally:
+        StreamedGuildMembersHandler.stream = True
+
+    await server.async_teardown()
+    await client1.async_teardown()
+    await client2.async_teardown()
+
+
+@pytest.mark.asyncio
+async def test_publish_subscribe():
+    botMockClient1 = BotMock()
+    botMockClient2 = BotMock()
+
+    botMockClient1.shards = {0: ShardMock(0)}
+    botMockClient1.guilds = [GuildMock(id=0)]
+
+    botMockClient2.shards = {1: ShardMock(1)}
+    botMockClient2.guilds = [GuildMock(id=10)]
+
+    server = IPCServer(configuration)
+    await server.async_setup()
+
+    client1 = IPCClient(botMockClient1, {**configuration, "coalesce_delay": 0.01})
+    client2 = IPCClient(botMockClient2, configuration)
+
+    received = []
+
+    async def on_reload(payload):
+        received.append(payload)
+
+    # Before login, sent once logged in.
+    client1.subscribe('reload', on_reload)
+    client2.subscribe('other', received.append)
+    # Published before login, sent once logged in.
+    await asyncio.wait_for(client2.publish('reload', {'module': 'queued'}), 1)
+    await client1.async_setup()
+    await client1.online.wait()
+    await asyncio.sleep(0.05)
+    await client2.async_setup()
+    await client2.online.wait()
+    await asyncio.sleep(0.05)
+
+    ws1, ws2 = server.guild_to_ws_mapping[0], server.guild_to_ws_mapping[10]
+    assert server.subscriptions == {'reload': {ws1}, 'other': {ws2}}
+    assert received == [{'module': 'queued'}]
+    received.clear()
+
+    # Only subscribed processes get it, the publisher delivers to its own subscribers directly.
+    await client2.publish('reload', {'module': 'a'})
+    await client1.publish('reload', {'module': 'b'})
+    await client2.publish('nobody', 1)
+    await asyncio.sleep(0.05)
+    assert sorted(payload['module'] for payload in received) == ['a', 'b']
+
+    received.clear()
+    for i in range(5):
+        await client2.publish('reload', i, coalesce=True)
+    await asyncio.sleep(0.1)
+    assert received == [4]
+
+    client1.unsubscribe('reload', on_reload)
+    await asyncio.sleep(0.05)
+    assert server.subscriptions == {'other': {ws2}}
+
+    await client2.async_teardown()
+    await asyncio.sleep(0.05)
+    assert server.subscriptions == {}
+
+    # Published while the server is gone: kept up to `max_queued_publishes`, without waiting.
+    await server.async_teardown()
+    await asyncio.sleep(0.05)
+    client1._queued_publishes = deque(maxlen=2)
+    for i in range(3):
+        await asyncio.wait_for(client1.publish('other', i), 1)
+    assert list(client1._queued_publishes) == [('other', 1), ('other', 2)]
+
+    await client1.async_teardown()
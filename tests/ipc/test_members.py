@@ -0,0 +1,31 @@
+import discord
+
+from kasushi.ipc.members import MemberIndex
+
+
+class GuildMock(discord.Object):
+    def __init__(self, id, member_ids):
+        super().__init__(id)
+        self.members = [discord.Object(member_id) for member_id in member_ids]
+
+
+def test_member_index():
+    index = MemberIndex.from_guilds([GuildMock(1, [10, 11]), GuildMock(2, [11, 12])])
+    assert len(index) == 3
+    assert index.guilds_of(11) == [1, 2]
+    assert index.guilds_of(13) == []
+
+    index.add(13, 1)
+    index.add(13, 1)
+    index.remove(10, 1)
+    index.remove(10, 2)
+    index.remove(14, 1)
+    assert index.guilds_of(13) == [1]
+    assert index.guilds_of(10) == []
+    assert len(index) == 3
+
+    index.remove_guild(1, [11, 13])
+    assert index.guilds_of(11) == [2]
+    assert len(index) == 2
+    index.add_guild(1 << 63, [11])
+    assert index.guilds_of(11) == [2, 1 << 63]
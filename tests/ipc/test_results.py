@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from kasushi.ipc.results import ResultCache, request_key
+
+
+def test_request_key():
+    assert request_key({'a': 1, 'b': [2]}) == request_key({'b': [2], 'a': 1})
+    assert request_key({'a': 1}) != request_key({'a': 2})
+
+
+@pytest.mark.asyncio
+async def test_single_flight_and_ttl():
+    cache = ResultCache(0.05)
+    calls = []
+
+    async def dispatch():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    assert await asyncio.gather(*(cache.get('key', dispatch) for _ in range(10))) == [1] * 10
+    assert await cache.get('key', dispatch) == 1
+    assert cache.stats == {'hits': 1, 'coalesced': 9, 'misses': 1}
+
+    await asyncio.sleep(0.06)
+    assert await cache.get('key', dispatch) == 2
+    cache.invalidate('key')
+    assert await cache.get('key', dispatch) == 3
+    assert await cache.get('other', dispatch) == 4
+
+
+@pytest.mark.asyncio
+async def test_failures_and_no_ttl():
+    cache = ResultCache(0)
+    calls = []
+
+    async def dispatch():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise asyncio.TimeoutError
+        return len(calls)
+
+    results = await asyncio.gather(*(cache.get('key', dispatch) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+    # Failures aren't cached, and a TTL of 0 only shares concurrent dispatches.
+    assert await cache.get('key', dispatch) == 2
+    assert await cache.get('key', dispatch) == 3
+    assert len(cache) == 0
+
+    # A waiter giving up doesn't cancel the dispatch of the others.
+    waiter = asyncio.ensure_future(cache.get('key', dispatch))
+    other = asyncio.ensure_future(cache.get('key', dispatch))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    assert await other == 4
+
+
+@pytest.mark.asyncio
+async def test_max_results():
+    cache = ResultCache(60, max_results=2)
+
+    async def dispatch():
+        return 'value'
+
+    for key in ('a', 'b', 'c'):
+        await cache.get(key, dispatch)
+    assert len(cache) == 2
+    await cache.get('a', dispatch)
+    assert cache.stats['misses'] == 4
@@ -0,0 +1,21 @@
+import json
+import random
+
+from kasushi.ipc.routing import GuildSet, decode_ids, encode_ids
+
+
+def test_encode_ids():
+    ids = {random.randrange(1 << 40, 1 << 60) for _ in range(1000)} | {0, 1, (1 << 64) - 1}
+    assert decode_ids(encode_ids(ids)) == sorted(ids)
+    assert decode_ids(encode_ids([])) == []
+    assert len(encode_ids(ids)) < len(json.dumps(list(ids)))
+
+
+def test_guild_set():
+    guilds = GuildSet([1, 2, 3])
+    assert guilds.apply([4, 4, 1], [2, 5]) == ([4], [2])
+    assert guilds.version == 1 and len(guilds) == 3 and 4 in guilds
+    # The checksum only depends on the guilds, whatever order they were added in.
+    assert guilds.checksum == GuildSet([4, 3, 1]).checksum
+    assert guilds.checksum != GuildSet([4, 3]).checksum
+    assert GuildSet().checksum == 0
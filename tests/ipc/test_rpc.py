@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from kasushi.exceptions import IPCConnectionLostError
+from kasushi.ipc.rpc import PendingRequests, min_timeout
+
+
+def test_min_timeout():
+    assert min_timeout(None, None) is None
+    assert min_timeout(5, None, 2) == 2
+
+
+@pytest.mark.asyncio
+async def test_call_resolved():
+    pending = PendingRequests()
+    sent = []
+
+    async def send(data):
+        sent.append(data)
+        asyncio.get_running_loop().call_soon(pending.resolve, data['rtoken'], 'pong')
+
+    assert await pending.call({'type': 'request'}, send, timeout=1) == 'pong'
+    assert await pending.call({'type': 'request'}, send, timeout=None) == 'pong'
+    assert [data['rtoken'] for data in sent] == [1, 2]
+    assert 0 < sent[0]['timeout'] <= 1 and 'timeout' not in sent[1]
+    assert len(pending) == 0
+    assert pending.resolve(1, 'late') is False
+
+
+@pytest.mark.asyncio
+async def test_call_timeout_and_disconnect():
+    pending = PendingRequests()
+
+    async def send(data):
+        pass
+
+    with pytest.raises(asyncio.TimeoutError):
+        await pending.call({}, send, timeout=0.05)
+    assert len(pending) == 0
+
+    call = asyncio.ensure_future(pending.call({}, send, timeout=None))
+    await asyncio.sleep(0)
+    pending.fail_all(IPCConnectionLostError("lost"))
+    with pytest.raises(IPCConnectionLostError):
+        await call
+    assert len(pending) == 0
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight():
+    pending = PendingRequests(max_in_flight=2)
+    sent = []
+
+    async def send(data):
+        sent.append(data['rtoken'])
+
+    calls = [asyncio.ensure_future(pending.call({}, send, timeout=1)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    assert sent == [1, 2]
+
+    pending.resolve(1, 'first')
+    assert await calls[0] == 'first'
+    await asyncio.sleep(0.01)
+    assert sent == [1, 2, 3]
+
+    pending.resolve(2, 'second')
+    pending.resolve(3, 'third')
+    assert await asyncio.gather(calls[1], calls[2]) == ['second', 'third']
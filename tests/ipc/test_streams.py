@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from kasushi.exceptions import IPCStreamError
+from kasushi.ipc.streams import IncomingStream, OutgoingStream, merge
+
+
+def connect(generator, window=4, timeout=1):
+    """
+    An outgoing stream sending straight to an incoming one, and the incoming one's credit straight back.
+    """
+    outgoing = None
+
+    async def control(message):
+        outgoing.control(message)
+
+    async def send(message):
+        incoming.feed(message)
+
+    incoming = IncomingStream(control, window=window, timeout=timeout)
+    outgoing = OutgoingStream(generator, send, window=window, timeout=timeout)
+    return incoming, outgoing
+
+
+@pytest.mark.asyncio
+async def test_backpressure():
+    produced = []
+
+    async def generator():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    incoming, outgoing = connect(generator())
+    task = asyncio.ensure_future(outgoing.run())
+    await asyncio.sleep(0.01)
+    # The window is full, the generator waits for credit.
+    assert len(produced) == 5
+
+    received = []
+    async for item in incoming:
+        received.append(item)
+        assert len(produced) - len(received) <= 5
+    assert received == list(range(20))
+    await task
+    assert incoming.closed
+
+
+@pytest.mark.asyncio
+async def test_errors():
+    async def failing():
+        yield 1
+        raise ValueError("nope")
+
+    incoming, outgoing = connect(failing())
+    await outgoing.run()
+    assert await incoming.__anext__() == 1
+    with pytest.raises(IPCStreamError):
+        await incoming.__anext__()
+
+    async def control(message):
+        pass
+
+    incoming = IncomingStream(control)
+    incoming.feed({'type': 'chunk', 'seq': 1, 'data': None})
+    with pytest.raises(IPCStreamError):
+        await incoming.__anext__()
+
+    incoming = IncomingStream(control, timeout=0.01)
+    with pytest.raises(asyncio.TimeoutError):
+        await incoming.__anext__()
+
+
+@pytest.mark.asyncio
+async def test_cancel():
+    closed = []
+
+    async def endless():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.append(True)
+
+    incoming, outgoing = connect(endless())
+    task = asyncio.ensure_future(outgoing.run())
+    assert [await incoming.__anext__() for _ in range(3)] == [0, 1, 2]
+    await incoming.close()
+    await asyncio.wait_for(task, 1)
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_merge():
+    async def numbers(start):
+        for i in range(start, start + 3):
+            yield i
+            await asyncio.sleep(0)
+
+    async def failing():
+        yield 100
+        raise ValueError("nope")
+
+    errors = []
+    merged = [item async for item in merge([numbers(0), failing(), numbers(10)], lambda i, e: errors.append(i))]
+    assert sorted(merged) == [0, 1, 2, 10, 11, 12, 100]
+    assert errors == [1]
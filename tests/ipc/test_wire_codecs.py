@@ -0,0 +1,156 @@
+import asyncio
+import json
+
+import discord
+import pytest
+
+from kasushi.ipc.batching import BatchWriter
+from kasushi.ipc.client import IPCClient
+from kasushi.ipc.codecs import BATCH, COMPRESSED, CODECS, decode_frame, decode_frames, encode_batch, encode_frame, \
+    negotiate
+from kasushi.ipc.handlers import ShardStatusHandler
+from kasushi.ipc.server import IPCServer
+
+configuration = \
+    {
+        "shared_secret": "secret",
+        "server": {
+            "host": "0.0.0.0",
+            "port": 12321,
+        },
+        "client": {
+            "server_url": "http://127.0.0.1:12321",
+        },
+        "handlers": [ShardStatusHandler],
+        "compression_threshold": 64,
+    }
+
+
+class BotMock:
+    def __init__(self):
+        self.shards = {}
+        self.guilds = []
+
+
+class ShardMock(discord.Object):
+    latency = 0.1
+
+    def is_ws_ratelimited(self):
+        return False
+
+    def is_closed(self):
+        return False
+
+
+@pytest.mark.parametrize("codec", list(CODECS.values()), ids=list(CODECS.keys()))
+def test_frame_roundtrip(codec):
+    message = {'handler': 'login', 'type': 'request', 'data': {'guilds': list(range(1000)), 'shards': {0: 'ok'}}}
+    expected = json.loads(json.dumps(message))
+
+    frame = encode_frame(message, codec)
+    assert frame[0] == codec.id
+    assert decode_frame(frame) == expected
+
+    compressed = encode_frame(message, codec, compression_threshold=64)
+    assert compressed[0] == codec.id | COMPRESSED
+    assert len(compressed) < len(frame)
+    assert decode_frame(compressed) == expected
+
+    # Small messages aren't worth compressing.
+    assert encode_frame({'type': 'response'}, codec, compression_threshold=64)[0] == codec.id
+
+
+def test_batch_roundtrip():
+    codec = CODECS['json']
+    messages = [{'handler': 'cache_invalidate', 'type': 'request', 'data': {'keys': [f'key:{i}']}} for i in range(50)]
+    frames = [encode_frame(message, codec) for message in messages]
+
+    batch = encode_batch(frames)
+    assert batch[0] == BATCH
+    assert decode_frames(batch) == messages
+
+    compressed = encode_batch(frames, compression_threshold=64)
+    assert compressed[0] == BATCH | COMPRESSED
+    assert decode_frames(compressed) == messages
+
+    # A batch of one message is a regular frame.
+    assert decode_frame(encode_batch(frames[:1])) == messages[0]
+
+
+class WSMock:
+    def __init__(self):
+        self.frames = []
+
+    async def send_bytes(self, data):
+        self.frames.append(data)
+
+
+@pytest.mark.asyncio
+async def test_batch_writer():
+    ws = WSMock()
+    writer = BatchWriter(ws, CODECS['json'], None, delay=0.01, max_bytes=1024)
+
+    for i in range(10):
+        await writer.send({'type': 'request', 'data': i})
+    assert ws.frames == []
+    await asyncio.sleep(0.05)
+    assert [decode_frames(frame) for frame in ws.frames] == [[{'type': 'request', 'data': i} for i in range(10)]]
+
+    # Latency-sensitive messages are written right away, with what was queued before them.
+    await writer.send({'type': 'request', 'data': 'queued'})
+    await writer.send({'type': 'request', 'data': 'urgent'}, immediate=True)
+    assert [m['data'] for m in decode_frames(ws.frames[-1])] == ['queued', 'urgent']
+
+    # The byte budget flushes early.
+    for i in range(100):
+        await writer.send({'type': 'request', 'data': 'x' * 100})
+    assert len(ws.frames) > 3
+    await writer.close()
+    assert writer.stats['messages'] == 112
+
+
+def test_negotiate():
+    assert negotiate(['unknown', 'json'], ['json']).name == 'json'
+    assert negotiate(['json'], []) is None
+    assert negotiate([], ['json']) is None
+
+
+@pytest.mark.asyncio
+async def test_negotiated_login():
+    bot = BotMock()
+    bot.shards = {0: ShardMock(0)}
+
+    server = IPCServer(configuration)
+    await server.async_setup()
+    client = IPCClient(bot, configuration)
+    await client.async_setup()
+    await client.online.wait()
+
+    assert client.codec is not None and client.compress is True
+    assert server._active_ws[0].codec.name == client.codec.name
+    assert await client.send_request('shard_status') == {'0': {'latency': 0.1, 'ws_ratelimited': False, 'closed': False}}
+    assert client.writer is None
+
+    await server.async_teardown()
+    await client.async_teardown()
+
+
+@pytest.mark.asyncio
+async def test_batched_connection():
+    bot = BotMock()
+    bot.shards = {0: ShardMock(0)}
+    batching_configuration = {**configuration, "batching": {"delay": 0.005}}
+
+    server = IPCServer(batching_configuration)
+    await server.async_setup()
+    client = IPCClient(bot, batching_configuration)
+    await client.async_setup()
+    await client.online.wait()
+
+    assert client.writer is not None and server._active_ws[0].writer is not None
+    results = await asyncio.gather(*(client.send_request('shard_status') for _ in range(20)))
+    assert all(result == {'0': {'latency': 0.1, 'ws_ratelimited': False, 'closed': False}} for result in results)
+    assert client.writer.stats['frames'] < client.writer.stats['messages']
+
+    await server.async_teardown()
+    await client.async_teardown()